@@ -1,5 +1,5 @@
 import uuid
-from django.db import models
+from django.db import models, transaction
 from django.core.exceptions import ValidationError
 from apps.users.models import User
 from apps.products.models import Product
@@ -45,6 +45,11 @@ class BranchProduct(models.Model):
     class Meta:
         unique_together = ('branch', 'product')
         ordering = ('product__name',)
+        indexes = [
+            # Serves both the all-branch opened/closed reports and the
+            # per-branch active count.
+            models.Index(fields=['status', 'branch'], name='branchproduct_status_idx'),
+        ]
 
     def __str__(self):
         return f"{self.product.name} at {self.branch.name}"
@@ -54,8 +59,28 @@ class BranchProduct(models.Model):
             raise ValidationError("Quantity cannot be negative.")
 
     def save(self, *args, **kwargs):
+        from apps.reports.models import BranchInventorySummary
+
         self.full_clean()
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            BranchInventorySummary.lock([self.branch_id])
+            if self._state.adding:
+                previous = {"status": None, "quantity": 0}
+            else:
+                previous = (
+                    type(self)
+                    .objects.select_for_update()
+                    .values("status", "quantity")
+                    .get(pk=self.pk)
+                )
+            super().save(*args, **kwargs)
+            BranchInventorySummary.apply(
+                self.branch_id,
+                total_products=1 if previous["status"] is None else 0,
+                active_products=(self.status == "active")
+                - (previous["status"] == "active"),
+                total_units=self.quantity - previous["quantity"],
+            )
 
     @property
     def product_name(self):
@@ -90,6 +115,47 @@ class ProductRequest(models.Model):
 
     class Meta:
         ordering = ("-date_requested",)
+        indexes = [
+            models.Index(
+                fields=["-date_requested", "-id"], name="request_date_requested_id_idx"
+            ),
+            models.Index(
+                fields=["branch", "status", "date_requested"],
+                name="request_branch_status_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.quantity} x {self.product.name} requested by {self.branch.name}"
+
+    def save(self, *args, **kwargs):
+        from apps.reports.models import BranchInventorySummary, request_field
+
+        with transaction.atomic():
+            # Summaries are locked before the request row, like every other
+            # writer does.
+            branch_ids = [self.branch_id]
+            if not self._state.adding:
+                branch_ids += (
+                    type(self)
+                    .objects.filter(pk=self.pk)
+                    .values_list("branch", flat=True)
+                )
+            BranchInventorySummary.lock(branch_ids)
+            previous = None
+            if not self._state.adding:
+                previous = (
+                    type(self)
+                    .objects.select_for_update()
+                    .values("branch", "status")
+                    .get(pk=self.pk)
+                )
+            super().save(*args, **kwargs)
+            if previous != {"branch": self.branch_id, "status": self.status}:
+                if previous:
+                    BranchInventorySummary.apply(
+                        previous["branch"], **{request_field(previous["status"]): -1}
+                    )
+                BranchInventorySummary.apply(
+                    self.branch_id, **{request_field(self.status): 1}
+                )
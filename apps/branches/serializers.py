@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from apps.reports import stock
 from .models import Branch, ProductRequest, BranchProduct
 
 
@@ -15,6 +16,9 @@ class BranchProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = BranchProduct
         fields = ['id', 'product_name', 'product_sku', 'product_barcode', 'product_category', 'product_brand', 'quantity', 'status', 'last_updated']
+        # Quantity changes go through the update_quantity action so they are
+        # applied by the stock ledger.
+        read_only_fields = ['quantity']
 
 
 class UpdateBranchProductQuantitySerializer(serializers.ModelSerializer):
@@ -22,6 +26,10 @@ class UpdateBranchProductQuantitySerializer(serializers.ModelSerializer):
         model = BranchProduct
         fields = ['quantity']
 
+    def update(self, instance, validated_data):
+        stock.set_branch_stock(instance, validated_data['quantity'])
+        return instance
+
 
 class ProductRequestSerializer(serializers.ModelSerializer):
     branch_name = serializers.CharField(source='branch.name', read_only=True)
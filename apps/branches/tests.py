@@ -1,3 +1,109 @@
+from datetime import timedelta
 from django.test import TestCase
+from django.utils import timezone
+from django.urls import reverse
+from rest_framework.test import APIClient
+from apps.core.tests.factories import (
+    create_admin,
+    create_branch,
+    create_manager,
+    create_product,
+)
+from apps.users.models import User
+from apps.products.models import Category, Brand
+from apps.reports.models import ProductOutflow
+from .models import ProductRequest
 
-# Create your tests here.
+
+class BranchQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = create_manager()
+        branch = create_branch(manager=cls.manager)
+        category = Category.objects.create(name="Category")
+        brand = Brand.objects.create(name="Brand")
+        for i in range(5):
+            product = create_product(
+                name=f"Product {i}", sku=f"SKU-{i}", category=category, brand=brand
+            )
+            ProductOutflow.objects.create(
+                product=product, branch=branch, quantity_sent=5
+            )
+            ProductRequest.objects.create(branch=branch, product=product, quantity=5)
+
+    def setUp(self):
+        self.client = APIClient()
+        # Fresh from the database, as the authentication backend would load it.
+        self.client.force_authenticate(User.objects.get(pk=self.manager.pk))
+
+    def test_branch_product_list(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse("branch_products-list"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 5)
+        self.assertEqual(response.data["results"][0]["product_category"], "Category")
+
+    def test_product_request_list(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("product_requests-list"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 5)
+
+    def test_product_request_pages_keep_sub_millisecond_ties(self):
+        moment = timezone.now().replace(microsecond=500000)
+        for i, request in enumerate(ProductRequest.objects.order_by("pk")):
+            ProductRequest.objects.filter(pk=request.pk).update(
+                date_requested=moment + timedelta(microseconds=i)
+            )
+        seen = []
+        url = reverse("product_requests-list") + "?page_size=1"
+        while url:
+            response = self.client.get(url)
+            seen += [row["id"] for row in response.data["results"]]
+            url = response.data["next"]
+        self.assertEqual(
+            seen,
+            list(ProductRequest.objects.order_by("-pk").values_list("pk", flat=True)),
+        )
+
+
+class ProductRequestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = create_manager()
+        cls.branch = create_branch(manager=cls.manager)
+        cls.product = create_product()
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def create(self, branch):
+        return self.client.post(
+            reverse("product_requests-list"),
+            {"branch": branch.pk, "product": self.product.pk, "quantity": 3},
+        )
+
+    def test_managers_request_for_their_own_branch(self):
+        self.client.force_authenticate(self.manager)
+        response = self.create(create_branch("Other"))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            (response.data["branch"], response.data["branch_name"]),
+            (self.branch.pk, "Main"),
+        )
+
+    def test_manager_without_a_branch(self):
+        self.client.force_authenticate(create_manager(username="other"))
+        response = self.create(self.branch)
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post(reverse("product_requests-from-suggestions"))
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(ProductRequest.objects.exists())
+
+    def test_admin_requests_from_the_suggestions_of_a_branch(self):
+        self.client.force_authenticate(create_admin())
+        url = reverse("product_requests-from-suggestions")
+        self.assertEqual(self.client.post(url, {"branch": "x"}).status_code, 400)
+        response = self.client.post(url, {"branch": self.branch.pk})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, [])
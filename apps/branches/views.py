@@ -1,6 +1,7 @@
 from rest_framework import viewsets, permissions, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from django.db import transaction
 from django.core.exceptions import PermissionDenied
 from .serializers import (
     BranchSerializer,
@@ -9,6 +10,13 @@ from .serializers import (
     UpdateBranchProductQuantitySerializer,
 )
 from .models import Branch, ProductRequest, BranchProduct
+from apps.core.pagination import KeysetPagination
+from apps.users.authentication import managed_branch_id
+
+
+class ProductRequestPagination(KeysetPagination):
+    ordering = ("-date_requested", "-id")
+    max_page_size = 200
 
 
 class BranchViewSet(viewsets.ModelViewSet):
@@ -34,8 +42,9 @@ class BranchProductViewSet(viewsets.ModelViewSet):
     serializer_class = BranchProductSerializer
 
     def get_queryset(self):
-        branch = self.request.user.managed_branch
-        return BranchProduct.objects.filter(branch=branch)
+        return BranchProduct.objects.filter(
+            branch=managed_branch_id(self.request)
+        ).select_related("product__category", "product__brand")
 
     @action(detail=True, methods=["post"])
     def update_quantity(self, request, pk=None):
@@ -52,16 +61,74 @@ class BranchProductViewSet(viewsets.ModelViewSet):
 class ProductRequestViewSet(viewsets.ModelViewSet):
     serializer_class = ProductRequestSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ProductRequestPagination
 
     def get_queryset(self):
         user = self.request.user
         if user.role == "branch_manager":
-            return ProductRequest.objects.filter(branch=user.managed_branch)
-        return ProductRequest.objects.all()
+            queryset = ProductRequest.objects.filter(
+                branch=managed_branch_id(self.request)
+            )
+        else:
+            queryset = ProductRequest.objects.all()
+        return queryset.select_related("branch", "product")
 
     def perform_create(self, serializer):
         user = self.request.user
         if user.role == "branch_manager":
-            serializer.save(branch=user.managed_branch)
+            serializer.save(
+                branch=Branch.objects.get(pk=managed_branch_id(self.request))
+            )
         else:
             serializer.save()
+
+    @action(detail=False, methods=["post"], url_path="from-suggestions")
+    def from_suggestions(self, request):
+        """Request what the last reorder refresh suggests for the branch, or
+        for the listed ``products`` of it only."""
+        from apps.reports.models import ReorderSuggestion
+
+        user = request.user
+        if user.role == "branch_manager":
+            branch = Branch.objects.get(pk=managed_branch_id(request))
+        else:
+            branch_id = str(request.data.get("branch", ""))
+            branch = branch_id.isdigit() and Branch.objects.filter(pk=branch_id).first()
+            if not branch:
+                return Response({"error": "A valid branch is required."}, status=400)
+
+        suggestions = ReorderSuggestion.objects.filter(
+            branch=branch, suggested_quantity__gt=0
+        )
+        products = request.data.get("products")
+        if products is not None:
+            if not isinstance(products, list) or not all(
+                isinstance(product, int) for product in products
+            ):
+                return Response(
+                    {"error": "products must be a list of product ids."}, status=400
+                )
+            suggestions = suggestions.filter(product__in=products)
+
+        with transaction.atomic():
+            suggestions = list(suggestions.select_for_update().order_by("pk"))
+            requests = []
+            for suggestion in suggestions:
+                requests.append(
+                    ProductRequest.objects.create(
+                        branch=branch,
+                        product_id=suggestion.product_id,
+                        quantity=suggestion.suggested_quantity,
+                    )
+                )
+                # Now on order, until the next refresh recomputes the pair.
+                suggestion.on_order += suggestion.suggested_quantity
+                suggestion.suggested_quantity = 0
+            ReorderSuggestion.objects.bulk_update(
+                suggestions, ["on_order", "suggested_quantity"]
+            )
+
+        return Response(
+            ProductRequestSerializer(requests, many=True).data,
+            status=status.HTTP_201_CREATED,
+        )
@@ -0,0 +1,12 @@
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+# Backends whose entries only the process that stored them can see
+LOCAL_BACKENDS = (LocMemCache, DummyCache)
+
+
+def is_shared(alias):
+    """Whether what one process stores in cache ``alias`` reaches the
+    others, so that a version bump there expires their copies too."""
+    return not isinstance(caches[alias], LOCAL_BACKENDS)
@@ -0,0 +1,376 @@
+import heapq
+import json
+import logging
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+# Per-route request metrics: a latency histogram, and the SQL queries, query
+# time, rows and response bytes behind each route, labelled by URL name.
+# Queries are counted by an execute wrapper on every database connection
+# that charges them to the request in progress, found through a context
+# variable so it also follows async views into their database threads and
+# dashboards into their query pool (apps/reports/parallel.py).
+#
+# Each process keeps its own figures and copies them to the shared Django
+# cache every METRICS_PUBLISH_INTERVAL seconds, into a numbered slot of its
+# own; /metrics adds up those of every slot, in Prometheus' text format.
+# With the default LocMemCache that is only the process that serves the
+# scrape.
+#
+# Streamed responses, such as the report exports, run most of their queries
+# while the body is sent, after the middleware has returned. They are
+# recorded once the body has been produced; latency is to the headers.
+#
+# Requests slower than METRICS_SLOW_REQUEST_MS are logged as JSON together
+# with their slowest statements.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# The number of slots handed out so far
+SLOTS_KEY = "metrics:slots"
+# A slot is kept a day after its process last published, so the process'
+# counts do not drop out of the totals while it is idle, and is then free
+# for another process to claim.
+SLOT_TIMEOUT = 86400
+# Routes without a URL name, such as static files and 404s
+UNMATCHED = "<unmatched>"
+
+logger = logging.getLogger(__name__)
+current = ContextVar("metrics_request", default=None)
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_time", "rows", "statements", "lock")
+
+    def __init__(self):
+        # Dashboard queries of one request run in several threads.
+        self.lock = threading.Lock()
+        self.queries = 0
+        self.db_time = 0.0
+        self.rows = 0
+        # (seconds, sql) of each statement
+        self.statements = []
+
+
+def record_query(execute, sql, params, many, context):
+    stats = current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        # Not reported for SELECTs by every backend, SQLite among them
+        rowcount = max(context["cursor"].rowcount, 0)
+        with stats.lock:
+            stats.queries += 1
+            stats.db_time += elapsed
+            stats.statements.append((elapsed, sql))
+            stats.rows += rowcount
+
+
+def instrument(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(instrument)
+
+
+class Registry:
+    def __init__(self, publish_interval):
+        self.publish_interval = publish_interval
+        self.id = uuid.uuid4().hex
+        self.slot = None
+        self.lock = threading.Lock()
+        # (route, method, status) -> [requests, seconds, queries, query
+        # seconds, rows, response bytes, *requests per latency bucket]
+        self.routes = {}
+        self.published = time.monotonic()
+
+    def observe(self, route, method, status, elapsed, stats, size):
+        bucket = next(
+            (i for i, bound in enumerate(LATENCY_BUCKETS) if elapsed <= bound),
+            len(LATENCY_BUCKETS),
+        )
+        key = (route, method, status)
+        with self.lock:
+            values = self.routes.get(key)
+            if values is None:
+                values = self.routes[key] = [0] * (7 + len(LATENCY_BUCKETS))
+            values[0] += 1
+            values[1] += elapsed
+            values[2] += stats.queries
+            values[3] += stats.db_time
+            values[4] += stats.rows
+            values[5] += size
+            values[6 + bucket] += 1
+            due = time.monotonic() - self.published >= self.publish_interval
+            if due:
+                self.published = time.monotonic()
+        if due:
+            self.publish()
+
+    def snapshot(self):
+        with self.lock:
+            return {key: list(values) for key, values in self.routes.items()}
+
+    def publish(self):
+        cache = get_cache()
+        # (process, figures); only the process holding a slot sets it, the
+        # others can only add to a free one. A slot that expired while its
+        # process was idle may have gone to another, so the process then
+        # claims a new one.
+        entry = (self.id, self.snapshot())
+        held = self.slot is not None and cache.get(_slot_key(self.slot))
+        if held and held[0] == self.id:
+            cache.set(_slot_key(self.slot), entry, timeout=SLOT_TIMEOUT)
+        else:
+            self.slot = self.claim(cache, entry)
+
+    def claim(self, cache, entry):
+        """Store ``entry`` in a free slot and return its number, or None if
+        the cache keeps no count of the slots."""
+        cache.add(SLOTS_KEY, 0, timeout=None)
+        count = cache.get(SLOTS_KEY) or 0
+        taken = cache.get_many([_slot_key(slot) for slot in range(1, count + 1)])
+        for slot in range(1, count + 1):
+            if _slot_key(slot) not in taken and cache.add(
+                _slot_key(slot), entry, timeout=SLOT_TIMEOUT
+            ):
+                return slot
+        while True:
+            try:
+                slot = cache.incr(SLOTS_KEY)
+            except ValueError:
+                return None
+            if cache.add(_slot_key(slot), entry, timeout=SLOT_TIMEOUT):
+                return slot
+
+    def collect(self):
+        """Return the figures of every process, this one's as of now."""
+        cache = get_cache()
+        count = cache.get(SLOTS_KEY) or 0
+        found = cache.get_many([_slot_key(slot) for slot in range(1, count + 1)])
+        snapshots = [figures for id, figures in found.values() if id != self.id]
+        totals = {}
+        for snapshot in [*snapshots, self.snapshot()]:
+            for key, values in snapshot.items():
+                if key in totals:
+                    totals[key] = [a + b for a, b in zip(totals[key], values)]
+                else:
+                    totals[key] = list(values)
+        return totals
+
+    def render(self):
+        """Return the metrics in Prometheus' text exposition format."""
+        totals = self.collect()
+        by_route = {}
+        for (route, method, status), values in totals.items():
+            if (route, method) in by_route:
+                by_route[route, method] = [
+                    a + b for a, b in zip(by_route[route, method], values)
+                ]
+            else:
+                by_route[route, method] = list(values)
+
+        lines = [
+            "# HELP http_requests_total Requests served, by route, method and status.",
+            "# TYPE http_requests_total counter",
+        ]
+        for (route, method, status), values in sorted(totals.items()):
+            labels = _labels(route=route, method=method, status=status)
+            lines.append(f"http_requests_total{{{labels}}} {values[0]}")
+
+        lines += [
+            "# HELP http_request_duration_seconds Request latency, by route and method.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for (route, method), values in sorted(by_route.items()):
+            labels = _labels(route=route, method=method)
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, values[6:]):
+                cumulative += count
+                lines.append(
+                    f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} '
+                    f"{cumulative}"
+                )
+            lines += [
+                f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} '
+                f"{values[0]}",
+                f"http_request_duration_seconds_sum{{{labels}}} {values[1]:.6f}",
+                f"http_request_duration_seconds_count{{{labels}}} {values[0]}",
+            ]
+
+        for name, index, description in [
+            ("db_queries_total", 2, "SQL queries run"),
+            ("db_query_duration_seconds_total", 3, "Time spent in SQL"),
+            ("db_rows_total", 4, "Rows reported by the database"),
+            ("http_response_bytes_total", 5, "Response bytes sent"),
+        ]:
+            lines += [
+                f"# HELP {name} {description}, by route and method.",
+                f"# TYPE {name} counter",
+            ]
+            for (route, method), values in sorted(by_route.items()):
+                value = values[index]
+                value = f"{value:.6f}" if isinstance(value, float) else value
+                lines.append(f"{name}{{{_labels(route=route, method=method)}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self.lock:
+            self.routes = {}
+
+
+class MetricsMiddleware:
+    """Time each request and the SQL it runs, record them in the registry
+    and report them in a Server-Timing header."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        # Connections made before this module was loaded missed the signal.
+        for alias in connections:
+            instrument(connections[alias])
+        stats = RequestStats()
+        token = current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current.reset(token)
+        self.finish(request, response, stats, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current.reset(token)
+        self.finish(request, response, stats, time.perf_counter() - started)
+        return response
+
+    def finish(self, request, response, stats, elapsed):
+        match = request.resolver_match
+        route = (match.view_name if match else None) or UNMATCHED
+        # Up to the headers only, for a streamed response
+        response["Server-Timing"] = (
+            f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} queries", '
+            f"total;dur={elapsed * 1000:.1f}"
+        )
+        if not response.streaming:
+            self.record(request, route, response, stats, elapsed, len(response.content))
+            return
+
+        def done(size):
+            self.record(request, route, response, stats, elapsed, size)
+
+        stream = self.astream if response.is_async else self.stream
+        response.streaming_content = stream(response.streaming_content, stats, done)
+
+    def stream(self, content, stats, done):
+        # Each chunk is produced with the request's stats current, so the
+        # queries behind it are charged to the request. Recorded once the
+        # body is sent, or the client has gone.
+        size = 0
+        try:
+            content = iter(content)
+            while True:
+                token = current.set(stats)
+                try:
+                    chunk = next(content, None)
+                finally:
+                    current.reset(token)
+                if chunk is None:
+                    break
+                size += len(chunk)
+                yield chunk
+        finally:
+            done(size)
+
+    async def astream(self, content, stats, done):
+        size = 0
+        try:
+            content = aiter(content)
+            while True:
+                token = current.set(stats)
+                try:
+                    chunk = await anext(content, None)
+                finally:
+                    current.reset(token)
+                if chunk is None:
+                    break
+                size += len(chunk)
+                yield chunk
+        finally:
+            done(size)
+
+    def record(self, request, route, response, stats, elapsed, size):
+        registry.observe(
+            route, request.method, response.status_code, elapsed, stats, size
+        )
+        if elapsed * 1000 >= settings.METRICS_SLOW_REQUEST_MS:
+            record = {
+                "route": route,
+                "method": request.method,
+                "path": request.path,
+                "status": response.status_code,
+                "duration_ms": round(elapsed * 1000, 1),
+                "queries": stats.queries,
+                "db_ms": round(stats.db_time * 1000, 1),
+                "rows": stats.rows,
+                "response_bytes": size,
+                "slowest": [
+                    {"ms": round(seconds * 1000, 2), "sql": sql[:2000]}
+                    for seconds, sql in heapq.nlargest(
+                        settings.METRICS_SLOW_QUERIES,
+                        stats.statements,
+                        key=lambda statement: statement[0],
+                    )
+                ],
+            }
+            logger.warning(
+                "Slow request %s", json.dumps(record), extra={"metrics": record}
+            )
+
+
+def _labels(**labels):
+    return ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels.items())
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _slot_key(slot):
+    return f"metrics:process:{slot}"
+
+
+def get_cache():
+    return caches[settings.METRICS_CACHE_ALIAS]
+
+
+registry = Registry(settings.METRICS_PUBLISH_INTERVAL)
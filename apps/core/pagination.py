@@ -0,0 +1,140 @@
+import datetime
+import json
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    # Cursor pagination whose cursor holds the values of every ordering field
+    # of the last row seen, so each page is a single indexed range scan with
+    # no COUNT(*) and no OFFSET, however deep the client has walked. An id
+    # tie-breaker is appended to the ordering so rows sharing a date or name
+    # are never skipped or repeated.
+    page_size_query_param = "page_size"
+    max_page_size = 100
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if not any(field.lstrip("-") in ("id", "pk") for field in ordering):
+            ordering += ("-id" if ordering[0].startswith("-") else "id",)
+        return ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+
+        # Walking backwards is the same scan with every direction flipped.
+        ordering = (
+            tuple(flip(field) for field in self.ordering) if reverse else self.ordering
+        )
+        queryset = queryset.order_by(*ordering)
+        if self.cursor is not None and self.cursor.position is not None:
+            queryset = queryset.filter(
+                self.after(
+                    ordering,
+                    self.decode_position(self.cursor.position, queryset.model),
+                )
+            )
+
+        results = list(queryset[: self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[: self.page_size]
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.cursor is not None
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(
+            Cursor(
+                offset=0, reverse=False, position=self.encode_position(self.page[-1])
+            )
+        )
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=True, position=self.encode_position(self.page[0]))
+        )
+
+    def after(self, ordering, position):
+        # Expands (a, b, c) > (x, y, z) into
+        # a > x OR (a = x AND (b > y OR (b = y AND c > z))), with each
+        # comparison following its field's direction. The leading a >= x bound
+        # lets the database start the index scan at the cursor.
+        condition = None
+        for field in reversed(ordering):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            beyond = Q(**{f"{name}__{lookup}": position[name]})
+            if condition is not None:
+                beyond |= Q(**{name: position[name]}) & condition
+            condition = beyond
+
+        first = ordering[0].lstrip("-")
+        bound = "lte" if ordering[0].startswith("-") else "gte"
+        return Q(**{f"{first}__{bound}": position[first]}) & condition
+
+    def encode_position(self, instance):
+        values = {}
+        for field in self.ordering:
+            name = field.lstrip("-")
+            values[name] = (
+                instance[name]
+                if isinstance(instance, dict)
+                else getattr(instance, name)
+            )
+        return json.dumps(values, cls=PositionEncoder, separators=(",", ":"))
+
+    def decode_position(self, position, model):
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        # A cursor only makes sense for the ordering it was issued under.
+        if not isinstance(values, dict) or list(values) != [
+            field.lstrip("-") for field in self.ordering
+        ]:
+            raise NotFound(self.invalid_cursor_message)
+        for name, value in values.items():
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                # An annotation, compared as given
+                continue
+            try:
+                values[name] = field.to_python(value)
+            except ValidationError:
+                raise NotFound(self.invalid_cursor_message)
+        return values
+
+
+class PositionEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder cuts times to milliseconds, which would skip rows
+    # that only differ below that.
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+def flip(field):
+    return field[1:] if field.startswith("-") else f"-{field}"
@@ -0,0 +1,40 @@
+from apps.branches.models import Branch
+from apps.products.models import Product
+from apps.suppliers.models import Supplier
+from apps.users.models import User
+
+# Rows the tests of every app start from. Users log in with PASSWORD.
+
+PASSWORD = "password"
+
+
+def create_admin(username="admin"):
+    return User.objects.create_user(username=username, password=PASSWORD, role="admin")
+
+
+def create_manager(username="manager"):
+    return User.objects.create_user(
+        username=username, password=PASSWORD, role="branch_manager"
+    )
+
+
+def create_branch(name="Main", manager=None):
+    return Branch.objects.create(
+        name=name, location="-", contact_details="-", manager=manager
+    )
+
+
+def create_supplier(name="Supplier"):
+    return Supplier.objects.create(
+        name=name,
+        contact_person="-",
+        phone_number="-",
+        email="supplier@example.com",
+        location="-",
+    )
+
+
+def create_product(name="Product", price=10, quantity=100, **fields):
+    """Create a product whose opening stock is its ``quantity`` unless given."""
+    fields.setdefault("opening_stock", quantity)
+    return Product.objects.create(name=name, price=price, quantity=quantity, **fields)
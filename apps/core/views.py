@@ -0,0 +1,60 @@
+import asyncio
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.utils.crypto import constant_time_compare
+from django.views import View
+from rest_framework.views import APIView
+from . import metrics
+
+
+class AsyncAPIView(APIView):
+    # An APIView whose handlers are coroutines, so Django runs it on the
+    # event loop under ASGI. Authentication, permissions and throttling are
+    # synchronous in DRF and run in a worker thread first, which also loads
+    # request.user; exceptions are turned into responses as usual.
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(
+                    self, request.method.lower(), self.http_method_not_allowed
+                )
+            else:
+                handler = self.http_method_not_allowed
+            response = handler(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+
+class MetricsView(View):
+    """Request metrics for Prometheus to scrape, behind the METRICS_TOKEN
+    bearer token. Refused while no token is set."""
+
+    def get(self, request):
+        token = settings.METRICS_TOKEN
+        if not token:
+            return JsonResponse(
+                {"error": "Metrics are disabled until METRICS_TOKEN is set."},
+                status=403,
+            )
+        if not constant_time_compare(
+            request.headers.get("Authorization", ""), f"Bearer {token}"
+        ):
+            return JsonResponse({"error": "Invalid metrics token."}, status=401)
+        return HttpResponse(
+            metrics.registry.render(),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
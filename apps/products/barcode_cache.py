@@ -0,0 +1,63 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from importlib.metadata import version
+from pathlib import Path
+from django.conf import settings
+from . import barcodes
+
+# Rendered labels are cached in two tiers: a per-process LRU bounded by
+# total bytes, and a content-addressed directory shared by all processes.
+# Keys cover everything that affects the output, including the renderer
+# version, so an entry never needs invalidating.
+
+RENDERER = f"python-barcode {version('python-barcode')}"
+
+
+class LabelCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, sku, fmt, size):
+        """Return ``(content, etag)`` for a label, rendering it on a miss."""
+        key = hashlib.sha256(f"{RENDERER}\0{sku}\0{fmt}\0{size}".encode()).hexdigest()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return entry
+
+        path = self.directory / key[:2] / f"{key}.{fmt}"
+        try:
+            content = path.read_bytes()
+        except FileNotFoundError:
+            content = barcodes.render(sku, fmt, size)
+            self.write(path, content)
+
+        entry = (content, f'"{hashlib.sha256(content).hexdigest()}"')
+        with self.lock:
+            if key not in self.entries and len(content) <= self.max_bytes:
+                self.entries[key] = entry
+                self.size += len(content)
+                while self.size > self.max_bytes:
+                    _, (evicted, _) = self.entries.popitem(last=False)
+                    self.size -= len(evicted)
+        return entry
+
+    def write(self, path, content):
+        # Written to a temporary file and renamed, so a concurrent reader
+        # never sees a partial label.
+        path.parent.mkdir(parents=True, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=path.parent)
+        with os.fdopen(descriptor, "wb") as file:
+            file.write(content)
+        os.replace(temporary, path)
+
+
+labels = LabelCache(settings.BARCODE_CACHE_DIR, settings.BARCODE_CACHE_MAX_BYTES)
@@ -0,0 +1,93 @@
+import re
+from io import BytesIO
+from barcode import Code128
+from barcode.writer import ImageWriter, SVGWriter
+from PIL import Image
+
+# Rendering stays free of Django and the database so that it can run in the
+# worker processes of the process_barcode_jobs command.
+
+FORMATS = {"svg": "image/svg+xml", "png": "image/png"}
+
+SIZES = {
+    "small": {"module_width": 0.2, "module_height": 10.0, "font_size": 8},
+    "medium": {"module_width": 0.2, "module_height": 15.0, "font_size": 10},
+    "large": {"module_width": 0.33, "module_height": 20.0, "font_size": 12},
+}
+
+SVG_ROOT = re.compile(rb'<svg [^>]*width="([\d.]+)mm" height="([\d.]+)mm">')
+
+
+def render(sku, fmt="png", size="medium"):
+    writer = SVGWriter() if fmt == "svg" else ImageWriter()
+    buffer = BytesIO()
+    Code128(sku, writer=writer).write(buffer, options=SIZES[size])
+    return buffer.getvalue()
+
+
+def render_png(sku):
+    return render(sku)
+
+
+def try_render_png(sku):
+    # For process pools: a failure comes back as a value so that one bad SKU
+    # does not abort the rest of the batch.
+    try:
+        return render_png(sku), None
+    except Exception as error:
+        return None, f"{type(error).__name__}: {error}"
+
+
+def sheet(labels, fmt, columns):
+    """Lay rendered labels out in a grid of ``columns`` on a single image."""
+    if fmt == "svg":
+        return _svg_sheet(labels, columns)
+    return _png_sheet(labels, columns)
+
+
+def _svg_sheet(labels, columns):
+    # Each label becomes a nested <svg> positioned in its cell; the labels
+    # already use millimetre units throughout.
+    cells = []
+    for label in labels:
+        start = label.index(b"<svg ")
+        width, height = SVG_ROOT.match(label, start).groups()
+        cells.append((float(width), float(height), label[start:]))
+
+    cell_width = max(width for width, _, _ in cells)
+    cell_height = max(height for _, height, _ in cells)
+    rows = -(-len(cells) // columns)
+    parts = [
+        b'<?xml version="1.0" encoding="UTF-8"?>\n'
+        b'<svg version="1.1" xmlns="http://www.w3.org/2000/svg" '
+        + f'width="{cell_width * min(columns, len(cells)):.3f}mm" '
+        f'height="{cell_height * rows:.3f}mm">\n'.encode()
+    ]
+    for index, (_, _, label) in enumerate(cells):
+        row, column = divmod(index, columns)
+        parts.append(
+            label.replace(
+                b"<svg ",
+                f'<svg x="{column * cell_width:.3f}mm" '
+                f'y="{row * cell_height:.3f}mm" '.encode(),
+                1,
+            )
+        )
+    parts.append(b"</svg>\n")
+    return b"".join(parts)
+
+
+def _png_sheet(labels, columns):
+    images = [Image.open(BytesIO(label)) for label in labels]
+    cell_width = max(image.width for image in images)
+    cell_height = max(image.height for image in images)
+    rows = -(-len(images) // columns)
+    page = Image.new(
+        "RGB", (cell_width * min(columns, len(images)), cell_height * rows), "white"
+    )
+    for index, image in enumerate(images):
+        row, column = divmod(index, columns)
+        page.paste(image, (column * cell_width, row * cell_height))
+    buffer = BytesIO()
+    page.save(buffer, "PNG")
+    return buffer.getvalue()
@@ -0,0 +1,200 @@
+import csv
+import io
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from apps.reports import dashboard_cache, stock
+from .models import Product, Category, Brand, BarcodeJob
+
+# Bulk catalog import. Rows are read one at a time from the file, validated
+# with the model fields' own rules and saved with bulk_create in batches;
+# category and brand names are resolved from maps loaded once, and SKUs are
+# generated a batch at a time. Invalid rows are skipped and reported by
+# their line in the file (the header is line 1). Batches commit as they
+# fill, so a file that becomes unreadable part way keeps the rows before
+# that point; the report gives the count created and the line it stopped at.
+
+FIELDS = ["name", "sku", "description", "price", "quantity", "opening_stock"]
+
+
+class CatalogError(Exception):
+    pass
+
+
+def read_rows(file, filename):
+    """Yield each data row of a CSV or XLSX file as a dict keyed by the
+    normalised header."""
+    if filename.lower().endswith(".xlsx"):
+        try:
+            import openpyxl
+        except ImportError:
+            raise CatalogError("XLSX import needs the openpyxl package.")
+        workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [_column(value) for value in next(rows, ())]
+        for values in rows:
+            yield dict(zip(header, values))
+        workbook.close()
+    else:
+        reader = csv.reader(io.TextIOWrapper(file, encoding="utf-8-sig", newline=""))
+        header = [_column(value) for value in next(reader, ())]
+        for values in reader:
+            yield dict(zip(header, values))
+
+
+class CatalogImporter:
+    def __init__(self, batch_size=2000, max_errors=1000):
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+
+    def run(self, rows):
+        self.created = 0
+        self.error_count = 0
+        self.errors = []
+        self.skus = set()
+        self.categories = _name_map(Category)
+        self.brands = _name_map(Brand)
+
+        batch = []
+        line = 1
+        rows = iter(rows)
+        while True:
+            try:
+                row = next(rows, None)
+            except UnicodeDecodeError as error:
+                self.report(line + 1, {"file": [f"Could not read the file: {error}"]})
+                break
+            if row is None:
+                break
+            line += 1
+            if not any(value not in (None, "") for value in row.values()):
+                continue
+            parsed = self.parse(line, row)
+            if parsed:
+                batch.append(parsed)
+            if len(batch) >= self.batch_size:
+                self.save(batch)
+                batch = []
+        if batch:
+            self.save(batch)
+
+        return {
+            "created": self.created,
+            "error_count": self.error_count,
+            "errors": sorted(self.errors, key=lambda error: error["line"]),
+        }
+
+    def parse(self, line, row):
+        values = {}
+        errors = {}
+        for name in FIELDS:
+            field = Product._meta.get_field(name)
+            value = row.get(name)
+            if isinstance(value, str):
+                value = value.strip()
+            if value in (None, ""):
+                value = None
+                if name in ("name", "price"):
+                    errors[name] = ["This field is required."]
+            try:
+                values[name] = field.clean(value, None)
+            except ValidationError as error:
+                if value is not None:
+                    errors[name] = error.messages
+                values[name] = None
+
+        if values["quantity"] is None and "quantity" not in errors:
+            values["quantity"] = 0
+        if values["opening_stock"] is None and "opening_stock" not in errors:
+            values["opening_stock"] = values["quantity"]
+        for name in ("category", "brand"):
+            if len(_name(row.get(name)) or "") > 100:
+                errors[name] = ["Ensure this value has at most 100 characters."]
+        if values["sku"] in self.skus:
+            errors["sku"] = ["Duplicate SKU in this file."]
+
+        if errors:
+            self.report(line, errors)
+            return None
+        # Only accepted rows claim their SKU.
+        if values["sku"]:
+            self.skus.add(values["sku"])
+        return (
+            line,
+            Product(**values),
+            _name(row.get("category")),
+            _name(row.get("brand")),
+        )
+
+    def save(self, batch):
+        existing = set(
+            Product.objects.filter(
+                sku__in=[product.sku for _, product, _, _ in batch if product.sku]
+            ).values_list("sku", flat=True)
+        )
+        valid = []
+        for line, product, category, brand in batch:
+            if product.sku in existing:
+                self.report(line, {"sku": ["A product with this SKU already exists."]})
+            else:
+                valid.append((line, product, category, brand))
+        if not valid:
+            return
+
+        categories, brands = dict(self.categories), dict(self.brands)
+        try:
+            with transaction.atomic():
+                self.resolve(Category, self.categories, valid, 2, "category")
+                self.resolve(Brand, self.brands, valid, 3, "brand")
+                products = [product for _, product, _, _ in valid]
+                Product.assign_skus(products, reserved=self.skus)
+                self.skus.update(product.sku for product in products)
+
+                products = Product.objects.bulk_create(products)
+                stock.record_opening(products)
+                BarcodeJob.objects.bulk_create(
+                    BarcodeJob(product=product) for product in products
+                )
+                dashboard_cache.invalidate()
+        except IntegrityError as error:
+            # Most likely a SKU taken by a concurrent write; the batch was
+            # rolled back as a whole, including new categories and brands.
+            self.categories, self.brands = categories, brands
+            for line, _, _, _ in valid:
+                self.report(line, {"non_field_errors": [str(error)]})
+            return
+        self.created += len(products)
+
+    def resolve(self, model, names, batch, position, field):
+        # Categories and brands named in the file but not yet in the
+        # database are created, once each.
+        missing = {}
+        for entry in batch:
+            if entry[position] and entry[position].lower() not in names:
+                missing.setdefault(entry[position].lower(), entry[position])
+        for instance in model.objects.bulk_create(
+            model(name=name) for name in missing.values()
+        ):
+            names[instance.name.lower()] = instance.pk
+        for entry in batch:
+            if entry[position]:
+                setattr(entry[1], f"{field}_id", names[entry[position].lower()])
+
+    def report(self, line, errors):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line, "errors": errors})
+
+
+def _column(value):
+    return str(value or "").strip().lower().replace(" ", "_")
+
+
+def _name(value):
+    return str(value).strip() if value not in (None, "") else None
+
+
+def _name_map(model):
+    names = {}
+    for pk, name in model.objects.order_by("pk").values_list("pk", "name"):
+        names.setdefault(name.lower(), pk)
+    return names
@@ -0,0 +1,35 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from apps.products.catalog import CatalogError, CatalogImporter, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Import products from a CSV or XLSX file with the columns name, sku, "
+        "description, price, quantity, opening_stock, category and brand."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--batch-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        importer = CatalogImporter(batch_size=options["batch_size"])
+        try:
+            with open(options["path"], "rb") as file:
+                report = importer.run(read_rows(file, options["path"]))
+        except (OSError, CatalogError, UnicodeDecodeError) as error:
+            raise CommandError(error)
+
+        for error in report["errors"]:
+            self.stderr.write(f"Line {error['line']}: {json.dumps(error['errors'])}")
+        if report["error_count"] > len(report["errors"]):
+            self.stderr.write(
+                f"... and {report['error_count'] - len(report['errors'])} more."
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {report['created']} products, "
+                f"skipped {report['error_count']} rows."
+            )
+        )
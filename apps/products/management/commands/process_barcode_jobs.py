@@ -0,0 +1,127 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from apps.products.barcodes import try_render_png
+from apps.products.models import Product, BarcodeJob
+
+
+class Command(BaseCommand):
+    help = (
+        "Render queued product barcodes in a pool of worker processes. Several "
+        "workers can run at once; each claims its own batch of jobs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=os.cpu_count())
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--poll-interval", type=float, default=2.0)
+        parser.add_argument("--max-attempts", type=int, default=3)
+        parser.add_argument(
+            "--lease-seconds",
+            type=int,
+            default=300,
+            help="Reclaim running jobs older than this; their worker is "
+            "assumed to have died.",
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="Exit once the queue is empty."
+        )
+
+    def handle(self, *args, **options):
+        rendered = failed = 0
+        # Spawned rather than forked, so the children never share this
+        # process's database connection.
+        with ProcessPoolExecutor(
+            options["processes"], mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            while True:
+                jobs = self.claim(options["batch_size"], options["lease_seconds"])
+                if not jobs:
+                    if options["once"]:
+                        break
+                    time.sleep(options["poll_interval"])
+                    continue
+
+                results = pool.map(
+                    try_render_png,
+                    [job.product.sku for job in jobs],
+                    chunksize=max(1, len(jobs) // (options["processes"] * 4)),
+                )
+                self.finish(jobs, results, options["max_attempts"])
+                rendered += sum(job.status == "done" for job in jobs)
+                failed += sum(job.status == "failed" for job in jobs)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Rendered {rendered} barcodes, {failed} failed.")
+        )
+
+    def claim(self, batch_size, lease_seconds):
+        now = timezone.now()
+        with transaction.atomic():
+            jobs = list(
+                BarcodeJob.objects.select_for_update(skip_locked=True, of=("self",))
+                .select_related("product")
+                .filter(
+                    Q(status="queued")
+                    | Q(
+                        status="running",
+                        started_at__lt=now - timedelta(seconds=lease_seconds),
+                    )
+                )
+                .order_by("id")[:batch_size]
+            )
+            BarcodeJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+                status="running", started_at=now, attempts=F("attempts") + 1
+            )
+        for job in jobs:
+            job.attempts += 1
+        return jobs
+
+    def finish(self, jobs, results, max_attempts):
+        field = Product._meta.get_field("barcode_image")
+        now = timezone.now()
+        skus = dict(
+            Product.objects.filter(pk__in=[job.product_id for job in jobs]).values_list(
+                "pk", "sku"
+            )
+        )
+        products = []
+        replaced = []
+        for job, (image, error) in zip(jobs, results):
+            product = job.product
+            job.finished_at = now
+            if skus.get(product.pk) != product.sku:
+                # The SKU changed while this one was rendered; render it again.
+                job.status = "queued"
+                continue
+            if image is None:
+                job.error = error
+                if job.attempts < max_attempts:
+                    job.status = "queued"
+                    continue
+                job.status = "failed"
+                product.barcode_status = "failed"
+            else:
+                if product.barcode_image:
+                    replaced.append(product.barcode_image.name)
+                product.barcode_image = field.storage.save(
+                    field.generate_filename(product, f"{product.sku}.png"),
+                    ContentFile(image),
+                )
+                product.barcode_status = "ready"
+                job.status = "done"
+                job.error = ""
+            products.append(product)
+
+        with transaction.atomic():
+            Product.objects.bulk_update(products, ["barcode_image", "barcode_status"])
+            BarcodeJob.objects.bulk_update(jobs, ["status", "error", "finished_at"])
+        for name in replaced:
+            field.storage.delete(name)
@@ -0,0 +1,111 @@
+import random
+import statistics
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Max, Min
+from rest_framework import filters
+from rest_framework.test import APIRequestFactory
+from apps.products.models import Product
+from apps.products.search import ProductSearchFilter
+from apps.products.views import ProductViewSet
+
+# Search backends compared, by the name printed in the results
+BACKENDS = {
+    "indexed": ProductSearchFilter,
+    "icontains": filters.SearchFilter,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Time ?search= on the product list with the indexed search and with "
+        "plain icontains, over terms sampled from the catalog, and print "
+        "latency percentiles per kind of term."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--warmup", type=int, default=20)
+        parser.add_argument("--page-size", type=int, default=20)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--backend", choices=list(BACKENDS), action="append", dest="backends"
+        )
+
+    def handle(self, *args, **options):
+        bounds = Product.objects.aggregate(low=Min("id"), high=Max("id"))
+        if bounds["low"] is None:
+            raise CommandError("There are no products; run seed_stock_dataset first.")
+
+        self.random = random.Random(options["seed"])
+        self.bounds = bounds
+        terms = [self.sample_term() for _ in range(options["queries"])]
+        factory = APIRequestFactory()
+
+        self.stdout.write(
+            f"{Product.objects.count()} products on {connection.vendor}, "
+            f"{len(terms)} queries per backend"
+        )
+        for backend in options["backends"] or list(BACKENDS):
+            view = ProductViewSet.as_view(
+                {"get": "list"},
+                filter_backends=[BACKENDS[backend], filters.OrderingFilter],
+            )
+            for kind, term in terms[: options["warmup"]]:
+                self.run(factory, view, term, options["page_size"])
+
+            timings = {}
+            for kind, term in terms:
+                elapsed = self.run(factory, view, term, options["page_size"])
+                timings.setdefault(kind, []).append(elapsed)
+                timings.setdefault("all", []).append(elapsed)
+
+            for kind, values in sorted(timings.items()):
+                self.stdout.write(
+                    f"{backend:<10} {kind:<12} n={len(values):<5} "
+                    f"p50={percentile(values, 50):8.1f}ms "
+                    f"p95={percentile(values, 95):8.1f}ms "
+                    f"p99={percentile(values, 99):8.1f}ms "
+                    f"max={max(values):8.1f}ms"
+                )
+
+    def run(self, factory, view, term, page_size):
+        request = factory.get(
+            "/api/products/", {"search": term, "page_size": page_size}
+        )
+        started = time.perf_counter()
+        response = view(request)
+        elapsed = (time.perf_counter() - started) * 1000
+        if response.status_code != 200:
+            raise CommandError(f"Search for {term!r} returned {response.status_code}.")
+        return elapsed
+
+    def sample_term(self):
+        product = (
+            Product.objects.filter(
+                id__gte=self.random.randint(self.bounds["low"], self.bounds["high"])
+            )
+            .order_by("id")
+            .values("name", "sku", "description")
+            .first()
+        )
+        words = [word for word in product["name"].split() if word.isalpha()]
+        kind = self.random.choice(["sku", "prefix", "word", "typo", "description"])
+        if kind == "sku" and product["sku"]:
+            return kind, product["sku"]
+        if kind == "description" and product["description"]:
+            return kind, self.random.choice(product["description"].split())
+        word = self.random.choice(words or [product["name"]])
+        if kind == "prefix":
+            return kind, word[: self.random.randint(2, 4)]
+        if kind == "typo" and len(word) > 4:
+            drop = self.random.randrange(1, len(word) - 1)
+            return kind, word[:drop] + word[drop + 1 :]
+        return "word", word
+
+
+def percentile(values, percent):
+    if len(values) < 2:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[percent - 1]
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from apps.products.models import Product, BarcodeJob
+
+
+class Command(BaseCommand):
+    help = (
+        "Queue barcode jobs for products that have no barcode image, or for "
+        "every product with --all. Run process_barcode_jobs to render them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Re-render existing barcodes as well.",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(
+            barcode_jobs__status__in=["queued", "running"]
+        )
+        if not options["all"]:
+            products = products.filter(
+                Q(barcode_image__isnull=True) | Q(barcode_image="")
+            )
+
+        product_ids = list(products.order_by("id").values_list("id", flat=True))
+        batch_size = options["batch_size"]
+        for start in range(0, len(product_ids), batch_size):
+            batch = product_ids[start : start + batch_size]
+            with transaction.atomic():
+                BarcodeJob.objects.bulk_create(
+                    [BarcodeJob(product_id=product_id) for product_id in batch],
+                    ignore_conflicts=True,
+                )
+                Product.objects.filter(pk__in=batch).update(barcode_status="pending")
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Queued barcode jobs for {len(product_ids)} products.")
+        )
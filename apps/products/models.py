@@ -1,9 +1,7 @@
 import uuid
-from io import BytesIO
-from barcode import Code128
-from barcode.writer import ImageWriter
-from django.db import models
-from django.core.files import File
+from django.contrib.postgres.search import SearchVectorField
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
 
 
 class Category(models.Model):
@@ -25,6 +23,11 @@ class Brand(models.Model):
 
 
 class Product(models.Model):
+    BARCODE_STATUS_CHOICES = [
+        ("pending", "Pending"),
+        ("ready", "Ready"),
+        ("failed", "Failed"),
+    ]
     name = models.CharField(max_length=255)
     sku = models.CharField(max_length=100, unique=True, null=True, blank=True)
     description = models.TextField(null=True, blank=True)
@@ -38,28 +41,130 @@ class Product(models.Model):
     )
     opening_stock = models.PositiveIntegerField()
     barcode_image = models.ImageField(upload_to="barcodes/", null=True, blank=True)
+    barcode_status = models.CharField(
+        max_length=10, choices=BARCODE_STATUS_CHOICES, default="pending"
+    )
+    # Maintained by a database trigger on PostgreSQL, see search.py
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         ordering = ("name",)
+        indexes = [models.Index(fields=["name", "id"], name="product_name_id_idx")]
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The SKU as stored, to tell when a save changes the barcode.
+        instance._saved_sku = instance.__dict__.get("sku")
+        return instance
+
     def save(self, *args, **kwargs):
+        from apps.reports import stock
+
+        adding = self._state.adding
         if not self.sku:
-            self.sku = self.generate_sku()
-        super().save(*args, **kwargs)
+            Product.assign_skus([self])
+        sku_changed = not adding and self.sku != getattr(self, "_saved_sku", self.sku)
+        if sku_changed:
+            self.barcode_status = "pending"
+
+        if not adding and kwargs.get("update_fields") is None:
+            # Stock levels change only through the stock ledger, so catalog
+            # edits must not write back a stale quantity. The search vector
+            # is maintained by the database.
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in ("quantity", "search_vector")
+            ]
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                stock.record_opening([self])
+            # Rendered by the process_barcode_jobs worker
+            if (adding and not self.barcode_image) or sku_changed:
+                BarcodeJob.queue(self)
+        self._saved_sku = self.sku
 
     def generate_sku(self):
         return f"{self.name[:3].upper()}-{uuid.uuid4().hex[:6].upper()}"
 
-    def generate_barcode(self):
-        if not self.barcode_image:
-            code128 = Code128(self.sku, writer=ImageWriter())
-            buffer = BytesIO()
-            code128.write(buffer)
-            self.barcode_image.save(f"{self.sku}.png", File(buffer), save=False)
-            buffer.close()
+    @classmethod
+    def assign_skus(cls, products, reserved=()):
+        # Generated SKUs are random, so check each round of candidates
+        # against the table, each other and ``reserved`` in one query and
+        # redraw the ones that collide.
+        pending = [product for product in products if not product.sku]
+        while pending:
+            for product in pending:
+                product.sku = product.generate_sku()
+            taken = set(reserved)
+            taken.update(
+                cls.objects.filter(
+                    sku__in=[product.sku for product in pending]
+                ).values_list("sku", flat=True)
+            )
+            retry = []
+            for product in pending:
+                if product.sku in taken:
+                    retry.append(product)
+                else:
+                    taken.add(product.sku)
+            pending = retry
+
+
+class BarcodeJob(models.Model):
+    JOB_STATUS_CHOICES = [
+        ("queued", "Queued"),
+        ("running", "Running"),
+        ("done", "Done"),
+        ("failed", "Failed"),
+    ]
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="barcode_jobs"
+    )
+    status = models.CharField(max_length=10, choices=JOB_STATUS_CHOICES, default="queued")
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ("id",)
+        indexes = [models.Index(fields=["status", "id"], name="barcodejob_status_idx")]
+        constraints = [
+            # At most one outstanding job per product
+            models.UniqueConstraint(
+                fields=["product"],
+                condition=models.Q(status__in=["queued", "running"]),
+                name="barcodejob_one_active_per_product",
+            )
+        ]
+
+    def __str__(self):
+        return f"Barcode for {self.product} ({self.status})"
+
+    @classmethod
+    def queue(cls, product):
+        # A job that is already queued renders the current SKU; one that is
+        # running for an older SKU is queued again by the worker.
+        outstanding = cls.objects.filter(
+            product=product, status__in=["queued", "running"]
+        )
+        if outstanding.exists():
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(product=product)
+        except IntegrityError:
+            # Queued concurrently
+            pass
 
 
 class DamagedProduct(models.Model):
@@ -68,6 +173,9 @@ class DamagedProduct(models.Model):
     )
     quantity = models.PositiveIntegerField()
     reason = models.TextField()
+    # Lot the units were written off from, the soonest expiring one when
+    # they came from several; undoing the report puts them back there.
+    expiry_date = models.DateField(null=True, blank=True)
     date_reported = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -77,7 +185,62 @@ class DamagedProduct(models.Model):
         return f"{self.quantity} x {self.product.name}"
     
     def save(self, *args, **kwargs):
-        # Deduct the damaged quantity from the product's quantity
-        self.product.quantity -= self.quantity
-        self.product.save()
-        super().save(*args, **kwargs)
+        # The stock ledger lives in the reports app, which depends on this one.
+        from apps.reports import stock
+        from apps.reports.models import DailyStockRollup
+
+        with transaction.atomic():
+            changes = {self.product_id: -self.quantity}
+            lots = {(None, self.product_id, self.expiry_date): -self.quantity}
+            if not self._state.adding:
+                # Only the difference to the previous report is applied.
+                previous = DamagedProduct.objects.select_for_update().get(pk=self.pk)
+                changes = stock.net(changes, {previous.product_id: previous.quantity})
+                lots = stock.net(
+                    lots,
+                    {
+                        (None, previous.product_id, previous.expiry_date): (
+                            previous.quantity
+                        )
+                    },
+                )
+                previous.revert_rollup()
+            elif self.expiry_date is None:
+                # Soonest expiry first unless the report names a lot
+                lots = None
+
+            # Deduct the damaged quantity from the product's quantity
+            taken = stock.change_central_stock(changes, "damage", lots)
+            if self.expiry_date is None:
+                self.expiry_date = stock.soonest_expiry(taken, None, self.product_id)
+            super().save(*args, **kwargs)
+
+            DailyStockRollup.record(
+                timezone.localdate(self.date_reported),
+                self.product,
+                quantity_damaged=self.quantity,
+            )
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            DamagedProduct.objects.select_for_update().get(pk=self.pk).revert_stock()
+            return super().delete(*args, **kwargs)
+
+    def revert_stock(self):
+        from apps.reports import stock
+
+        stock.add_central_stock(
+            {self.product_id: self.quantity},
+            "damage",
+            {(None, self.product_id, self.expiry_date): self.quantity},
+        )
+        self.revert_rollup()
+
+    def revert_rollup(self):
+        from apps.reports.models import DailyStockRollup
+
+        DailyStockRollup.record(
+            timezone.localdate(self.date_reported),
+            self.product,
+            quantity_damaged=-self.quantity,
+        )
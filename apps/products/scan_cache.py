@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F
+from apps.core.caches import is_shared
+
+# Scanned SKUs are resolved from a per-process LRU of compact product
+# records. Catalog writes bump a version kept in the Django cache; the
+# writing process drops its entries as soon as the write commits. When that
+# cache is shared, every other process drops them when it next compares
+# versions, at most ``check_interval`` seconds later. A per-process cache
+# such as the default LocMemCache never shows them the bump, so there each
+# record is only served for ``local_ttl`` seconds after it was loaded. Stock
+# levels are not cached.
+
+VERSION_KEY = "products:scan:version"
+
+
+class ScanCache:
+    def __init__(self, max_entries, check_interval, local_ttl):
+        self.max_entries = max_entries
+        self.check_interval = check_interval
+        self.local_ttl = local_ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.version = None
+        self.checked = 0.0
+        self.local = True
+
+    def get_many(self, skus):
+        """Return ``{sku: record}`` for the known SKUs among ``skus``, loading
+        the ones not cached yet in one query."""
+        self.sync()
+        now = time.monotonic()
+        found = {}
+        missing = []
+        with self.lock:
+            for sku in skus:
+                entry = self.entries.get(sku)
+                if entry is None or entry[1] <= now:
+                    missing.append(sku)
+                else:
+                    self.entries.move_to_end(sku)
+                    found[sku] = entry[0]
+            generation = self.generation
+        if not missing:
+            return found
+
+        loaded = {record["sku"]: record for record in load(missing)}
+        expires = now + self.local_ttl if self.local else float("inf")
+        with self.lock:
+            # Records read while a write committed may already be stale.
+            if generation == self.generation:
+                for sku, record in loaded.items():
+                    self.entries[sku] = (record, expires)
+                    self.entries.move_to_end(sku)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        found.update(loaded)
+        return found
+
+    def invalidate(self):
+        transaction.on_commit(self.bump)
+
+    def bump(self):
+        self.clear()
+        cache = get_cache()
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.set(VERSION_KEY, _new_version(), timeout=None)
+
+    def sync(self):
+        now = time.monotonic()
+        if now - self.checked < self.check_interval:
+            return
+        self.checked = now
+        self.local = not is_shared(settings.PRODUCT_SCAN_CACHE_ALIAS)
+        version = get_cache().get_or_set(VERSION_KEY, _new_version, timeout=None)
+        if version != self.version:
+            self.clear()
+            self.version = version
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.generation += 1
+
+
+def load(skus):
+    from .models import Product
+
+    for record in Product.objects.filter(sku__in=skus).values(
+        "id",
+        "sku",
+        "name",
+        "price",
+        category_name=F("category__name"),
+        brand_name=F("brand__name"),
+    ):
+        record["price"] = str(record["price"])
+        yield record
+
+
+def get_cache():
+    return caches[settings.PRODUCT_SCAN_CACHE_ALIAS]
+
+
+def _new_version():
+    return time.time_ns() // 1000
+
+
+products = ScanCache(
+    settings.PRODUCT_SCAN_CACHE_SIZE,
+    settings.PRODUCT_SCAN_CACHE_CHECK_INTERVAL,
+    settings.PRODUCT_SCAN_CACHE_LOCAL_TTL,
+)
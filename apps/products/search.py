@@ -0,0 +1,157 @@
+import logging
+
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    TrigramWordSimilarity,
+)
+from django.db import DatabaseError, connections, transaction
+from django.db.models import Case, F, FloatField, Q, Value, When
+from django.db.models.functions import Coalesce, Greatest, Upper
+from rest_framework import filters
+
+# Product search. On PostgreSQL names and SKUs are matched through pg_trgm
+# GIN indexes on UPPER(name) and UPPER(sku), and names and descriptions
+# through a tsvector column kept current by a trigger; results carry a
+# search_rank the product pagination orders by. Other databases, and
+# PostgreSQL servers where migrate could not create pg_trgm (it needs a role
+# allowed to create extensions), fall back to DRF's icontains search with a
+# coarse rank. Whether pg_trgm is there is read once per process.
+
+TEXT_SEARCH_CONFIG = "english"
+
+# Created after every migrate, since none of it can be declared portably on
+# the model. Each statement is idempotent.
+TRIGRAM_SETUP = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS product_name_trgm_idx ON products_product "
+    "USING gin (UPPER(name) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS product_sku_trgm_idx ON products_product "
+    "USING gin (UPPER(sku) gin_trgm_ops)",
+]
+POSTGRES_SETUP = [
+    # Prefix matches of terms too short for a trigram
+    "CREATE INDEX IF NOT EXISTS product_name_prefix_idx ON products_product "
+    "(UPPER(name) text_pattern_ops)",
+    "CREATE INDEX IF NOT EXISTS product_search_vector_idx ON products_product "
+    "USING gin (search_vector)",
+    "DROP TRIGGER IF EXISTS product_search_vector_update ON products_product",
+    "CREATE TRIGGER product_search_vector_update "
+    "BEFORE INSERT OR UPDATE OF name, description ON products_product "
+    "FOR EACH ROW EXECUTE FUNCTION tsvector_update_trigger("
+    f"search_vector, 'pg_catalog.{TEXT_SEARCH_CONFIG}', name, description)",
+    # Rows written before the trigger existed
+    "UPDATE products_product SET search_vector = to_tsvector("
+    f"'pg_catalog.{TEXT_SEARCH_CONFIG}', "
+    "coalesce(name, '') || ' ' || coalesce(description, '')) "
+    "WHERE search_vector IS NULL",
+]
+
+
+logger = logging.getLogger(__name__)
+
+# Database alias -> whether pg_trgm is installed there
+trigram_support = {}
+
+
+def install(sender, using, **kwargs):
+    connection = connections[using]
+    if connection.vendor != "postgresql":
+        return
+    with connection.cursor() as cursor:
+        try:
+            with transaction.atomic(using=using):
+                for statement in TRIGRAM_SETUP:
+                    cursor.execute(statement)
+            trigram_support[using] = True
+        except DatabaseError as error:
+            logger.warning(
+                "Could not set up pg_trgm, product search will use icontains: %s",
+                error,
+            )
+            trigram_support[using] = False
+        for statement in POSTGRES_SETUP:
+            cursor.execute(statement)
+
+
+def has_trigrams(using):
+    if using not in trigram_support:
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                "SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')"
+            )
+            trigram_support[using] = cursor.fetchone()[0]
+    return trigram_support[using]
+
+
+class ProductSearchFilter(filters.SearchFilter):
+    # Below this length a term has no full trigram to look up, so only name
+    # prefixes are searched, through an index of their own.
+    min_trigram_length = 3
+    # Ranks a product whose SKU is the whole term, as sent by barcode
+    # scanners, above any text match.
+    exact_sku_rank = 100.0
+
+    def filter_queryset(self, request, queryset, view):
+        text = request.query_params.get(self.search_param, "").strip()
+        if not text:
+            return queryset
+
+        exact_sku = Q(sku=text)
+        if len(text) < self.min_trigram_length:
+            if connections[queryset.db].vendor == "postgresql":
+                queryset = queryset.alias(name_upper=Upper("name"))
+                prefix = Q(name_upper__startswith=text.upper())
+            else:
+                prefix = Q(name__istartswith=text)
+            return queryset.filter(exact_sku | prefix).annotate(
+                search_rank=self.rank(text, Value(1.0))
+            )
+
+        if connections[queryset.db].vendor != "postgresql" or not has_trigrams(
+            queryset.db
+        ):
+            return self.fallback(request, queryset, view, text)
+
+        term = text.upper()
+        queryset = queryset.alias(name_upper=Upper("name"), sku_upper=Upper("sku"))
+        query = SearchQuery(text, config=TEXT_SEARCH_CONFIG, search_type="websearch")
+        return queryset.filter(
+            Q(name_upper__contains=term)
+            | Q(name_upper__trigram_word_similar=term)
+            | Q(sku_upper__contains=term)
+            | Q(search_vector=query)
+        ).annotate(
+            search_rank=self.rank(
+                text,
+                Greatest(
+                    TrigramWordSimilarity(Value(term), "name_upper"),
+                    Coalesce(SearchRank(F("search_vector"), query), 0.0),
+                    output_field=FloatField(),
+                ),
+            )
+        )
+
+    def fallback(self, request, queryset, view, text):
+        return (
+            super()
+            .filter_queryset(request, queryset, view)
+            .annotate(
+                search_rank=self.rank(
+                    text,
+                    Case(
+                        When(name__iexact=text, then=3.0),
+                        When(name__istartswith=text, then=2.0),
+                        default=1.0,
+                        output_field=FloatField(),
+                    ),
+                )
+            )
+        )
+
+    def rank(self, text, rank):
+        return Case(
+            When(sku=text, then=Value(self.exact_sku_rank)),
+            default=rank,
+            output_field=FloatField(),
+        )
@@ -1,4 +1,6 @@
 from rest_framework import serializers
+from apps.reports import stock
+from . import barcodes
 from .models import Product, DamagedProduct
 
 
@@ -15,19 +17,18 @@ class ProductSerializer(serializers.ModelSerializer):
             "category",
             "brand",
             "opening_stock",
-            "barcode_image"
+            "barcode_image",
+            "barcode_status",
         ]
-        read_only_fields = ["id", "barcode_image"]
-    
-    def create(self, validated_data):
-        # Create the product instance
-        product = Product.objects.create(**validated_data)
-        
-        # Generate the barcode after the initial save
-        product.generate_barcode()
-        
-        # Save the product again with the generated barcode image
-        product.save()
+        read_only_fields = ["id", "barcode_image", "barcode_status"]
+
+    def update(self, instance, validated_data):
+        quantity = validated_data.pop("quantity", None)
+        product = super().update(instance, validated_data)
+
+        # A changed quantity is a stock count, recorded as an adjustment
+        if quantity is not None and quantity != product.quantity:
+            stock.set_central_stock(product, quantity)
 
         return product
 
@@ -37,5 +38,21 @@ class DamagedProductSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = DamagedProduct
-        fields = ['id', 'product', 'product_name', 'quantity', 'reason', 'date_reported']
+        fields = ['id', 'product', 'product_name', 'quantity', 'reason', 'expiry_date', 'date_reported']
         read_only_fields = ['id', 'date_reported']
+
+
+class BarcodeSheetSerializer(serializers.Serializer):
+    skus = serializers.ListField(child=serializers.CharField(), allow_empty=False)
+    size = serializers.ChoiceField(choices=list(barcodes.SIZES), default="medium")
+    columns = serializers.IntegerField(min_value=1, max_value=20, default=3)
+
+    def validate_skus(self, skus):
+        max_labels = self.context.get("max_labels")
+        if max_labels and len(skus) > max_labels:
+            raise serializers.ValidationError(f"At most {max_labels} labels per sheet.")
+        known = set(Product.objects.filter(sku__in=skus).values_list("sku", flat=True))
+        unknown = sorted(set(skus) - known)
+        if unknown:
+            raise serializers.ValidationError(f"Unknown SKUs: {', '.join(unknown)}")
+        return skus
@@ -0,0 +1,11 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import Brand, Category, Product
+from .scan_cache import products
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Brand)
+def expire_scan_cache(sender, instance, **kwargs):
+    products.invalidate()
@@ -1,3 +1,344 @@
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from apps.core.tests.factories import (
+    create_admin,
+    create_branch,
+    create_manager,
+    create_product,
+)
+from apps.users.authentication import add_claims
+from apps.users.models import User
+from apps.branches.models import BranchProduct
+from .management.commands.process_barcode_jobs import Command as BarcodeWorker
+from .models import BarcodeJob, Product, DamagedProduct, Category, Brand
+from .barcode_cache import labels
+from .views import ProductViewSet
+from . import scan_cache as scan_cache_module
+from . import search
+from .scan_cache import products as scan_cache
 
-# Create your tests here.
+
+class ProductQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        for i in range(5):
+            product = create_product(name=f"Product {i}")
+            DamagedProduct.objects.create(product=product, quantity=1, reason="-")
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_product_list(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("products-list"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 5)
+
+    def test_damaged_product_list(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("damaged_products-list"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 5)
+
+
+class BarcodeJobTests(TestCase):
+    def setUp(self):
+        self.product = create_product(name="Milk", sku="MLK-1", quantity=0)
+
+    def test_sku_change_queues_a_new_barcode(self):
+        job = BarcodeJob.objects.get(product=self.product)
+        job.status = "done"
+        job.save()
+
+        product = Product.objects.get(pk=self.product.pk)
+        product.name = "Whole milk"
+        product.save()
+        self.assertEqual(BarcodeJob.objects.filter(status="queued").count(), 0)
+
+        product.sku = "MLK-2"
+        product.save()
+        self.assertEqual(BarcodeJob.objects.filter(status="queued").count(), 1)
+        product.refresh_from_db()
+        self.assertEqual(product.barcode_status, "pending")
+
+    def test_job_for_an_old_sku_is_queued_again(self):
+        jobs = BarcodeWorker().claim(10, 300)
+        Product.objects.filter(pk=self.product.pk).update(sku="MLK-2")
+        BarcodeWorker().finish(jobs, [(b"png", None)], 3)
+        job = BarcodeJob.objects.get(product=self.product)
+        self.assertEqual(job.status, "queued")
+        self.assertFalse(Product.objects.get(pk=self.product.pk).barcode_image)
+
+
+class BarcodeViewTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        patcher = mock.patch.object(labels, "directory", self.directory)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = APIClient()
+        self.client.force_authenticate(
+            User.objects.create_user(username="user", password="password")
+        )
+        create_product(name="Milk", sku="MLK-1", quantity=0)
+        self.url = reverse("barcode", kwargs={"sku": "MLK-1", "fmt": "svg"})
+
+    def test_label(self):
+        response = self.client.get(self.url, {"size": "small"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/svg+xml")
+        self.assertTrue(response.content.startswith(b"<?xml"))
+        self.assertIn("private", response["Cache-Control"])
+        self.assertIn("max-age=86400", response["Cache-Control"])
+        self.assertTrue(response["ETag"])
+        self.assertEqual(len(list(self.directory.glob("*/*.svg"))), 1)
+
+    def test_matching_etag_is_not_modified(self):
+        etag = self.client.get(self.url)["ETag"]
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH='"other"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_unknown_labels_are_not_rendered(self):
+        response = self.client.get(
+            reverse("barcode", kwargs={"sku": "NOPE", "fmt": "svg"})
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.client.get(self.url, {"size": "huge"}).status_code, 400)
+        self.assertFalse(list(self.directory.iterdir()))
+
+    def test_requires_authentication(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+        self.assertFalse(list(self.directory.iterdir()))
+
+
+class BarcodeSheetTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch.object(labels, "directory", Path(directory.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = APIClient()
+        self.client.force_authenticate(
+            User.objects.create_user(username="user", password="password")
+        )
+        create_product(name="Milk", sku="MLK-1", quantity=0)
+
+    def post(self, fmt, count):
+        return self.client.post(
+            reverse("barcode-sheet", kwargs={"fmt": fmt}),
+            {"skus": ["MLK-1"] * count, "size": "large"},
+            format="json",
+        )
+
+    def test_png_sheets_are_capped(self):
+        response = self.post("png", 101)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["skus"], ["At most 100 labels per sheet."])
+        self.assertEqual(self.post("png", 2)["Content-Type"], "image/png")
+        self.assertEqual(self.post("svg", 101).status_code, 200)
+
+
+class CatalogImportTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(create_admin())
+        Category.objects.create(name="Fruit")
+        create_product(name="Apple", sku="APL-1", price=2, quantity=0)
+
+    def post(self, text):
+        upload = SimpleUploadedFile(
+            "catalog.csv", text if isinstance(text, bytes) else text.encode()
+        )
+        return self.client.post(
+            reverse("products-import-catalog"), {"file": upload}, format="multipart"
+        )
+
+    def test_import(self):
+        response = self.post(
+            "name,sku,price,quantity,category,brand\n"
+            "Banana,,1.50,10,fruit,Acme\n"
+            "Cherry,CHR-1,2,,Berries,acme\n"
+            ",X-1,2,1,,\n"
+            "Date,CHR-1,3,1,,\n"
+            "Fig,APL-1,3,1,,\n"
+            "Grape,,abc,1,,\n"
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["created"], 2)
+        self.assertEqual(
+            [
+                (error["line"], list(error["errors"]))
+                for error in response.data["errors"]
+            ],
+            [(4, ["name"]), (5, ["sku"]), (6, ["sku"]), (7, ["price"])],
+        )
+
+        banana = Product.objects.get(name="Banana")
+        self.assertTrue(banana.sku.startswith("BAN-"))
+        self.assertEqual(banana.quantity, 10)
+        self.assertEqual(banana.category.name, "Fruit")
+        self.assertEqual(Product.objects.get(sku="CHR-1").brand, banana.brand)
+        self.assertEqual(Category.objects.count(), 2)
+        self.assertEqual(Brand.objects.count(), 1)
+
+    def test_rejected_rows_do_not_claim_their_sku(self):
+        response = self.post("name,sku,price\nPear,PER-1,abc\nPear,PER-1,2\n")
+        self.assertEqual(response.data["created"], 1)
+        self.assertEqual(
+            [
+                (error["line"], list(error["errors"]))
+                for error in response.data["errors"]
+            ],
+            [(2, ["price"])],
+        )
+
+    def test_unreadable_file_keeps_the_batches_before(self):
+        rows = "".join(f"Item {i},ITM-{i},1\n" for i in range(1000))
+        with mock.patch.object(ProductViewSet, "import_batch_size", 10):
+            response = self.post(f"name,sku,price\n{rows}".encode() + b"\xff\n")
+        self.assertEqual(response.status_code, 201)
+        created = response.data["created"]
+        self.assertGreater(created, 0)
+        self.assertEqual(Product.objects.count(), created + 1)
+        [error] = response.data["errors"]
+        self.assertEqual(list(error["errors"]), ["file"])
+
+    def test_missing_file(self):
+        response = self.client.post(
+            reverse("products-import-catalog"), {}, format="multipart"
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class ProductSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for name, sku in [
+            ("Green Apple Juice", "GAJ-1"),
+            ("Apple", "APL-1"),
+            ("Red Apples", "RAP-1"),
+            ("Banana", "BAN-1"),
+        ]:
+            create_product(name=name, sku=sku, price=1, quantity=0)
+
+    def search(self, term, **params):
+        response = APIClient().get(reverse("products-list"), {"search": term, **params})
+        self.assertEqual(response.status_code, 200)
+        return [product["name"] for product in response.data["results"]]
+
+    def test_ranked(self):
+        self.assertEqual(self.search("apple")[0], "Apple")
+        self.assertEqual(
+            sorted(self.search("apple")), ["Apple", "Green Apple Juice", "Red Apples"]
+        )
+
+    def test_exact_sku(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.search("RAP-1"), ["Red Apples"])
+        # Ranked first among the products it also matches by text
+        create_product(name="Sweet Apple", sku="APPLE", price=1, quantity=0)
+        self.assertEqual(self.search("APPLE")[0], "Sweet Apple")
+
+    def test_short_terms_match_name_prefixes(self):
+        self.assertEqual(self.search("ap"), ["Apple"])
+        self.assertEqual(self.search("b"), ["Banana"])
+
+    def test_explicit_ordering(self):
+        self.assertEqual(
+            self.search("apple", ordering="-name"),
+            ["Red Apples", "Green Apple Juice", "Apple"],
+        )
+
+    def test_without_trigrams(self):
+        # A PostgreSQL server where migrate could not create pg_trgm
+        with mock.patch.dict(search.trigram_support, {"default": False}):
+            self.assertEqual(self.search("apple")[0], "Apple")
+            self.assertEqual(self.search("RAP-1"), ["Red Apples"])
+
+
+class ProductScanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = create_manager()
+        branch = create_branch(manager=cls.manager)
+        cls.apple = create_product(name="Apple", sku="APL-1", price=2, quantity=10)
+        create_product(name="Pear", sku="PER-1", price=3, quantity=10)
+        BranchProduct.objects.create(branch=branch, product=cls.apple, quantity=4)
+
+    def setUp(self):
+        scan_cache.clear()
+        self.client = APIClient()
+        # The branch is read from the token's claims, not the user
+        self.client.force_authenticate(
+            self.manager,
+            token=add_claims(AccessToken.for_user(self.manager), self.manager),
+        )
+
+    def test_scan(self):
+        url = reverse("products-scan", kwargs={"sku": "APL-1"})
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["name"], "Apple")
+        self.assertEqual(response.data["branch_quantity"], 4)
+
+        # Served from the cache; only the branch stock is read.
+        with self.assertNumQueries(1):
+            self.client.get(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.apple.name = "Green Apple"
+            self.apple.save()
+        self.assertEqual(self.client.get(url).data["name"], "Green Apple")
+
+    def test_per_process_entries_expire(self):
+        url = reverse("products-scan", kwargs={"sku": "APL-1"})
+        self.client.get(url)
+        # Renamed by another process, whose version bump this one cannot see
+        Product.objects.filter(pk=self.apple.pk).update(name="Green Apple")
+        self.assertEqual(self.client.get(url).data["name"], "Apple")
+        with mock.patch.object(
+            scan_cache_module.time,
+            "monotonic",
+            return_value=time.monotonic() + scan_cache.local_ttl + 1,
+        ):
+            self.assertEqual(self.client.get(url).data["name"], "Green Apple")
+
+    def test_scan_batch(self):
+        response = self.client.get(
+            reverse("products-scan-batch"), {"skus": "PER-1,NOPE,APL-1"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [
+                (record["sku"], record["branch_quantity"])
+                for record in response.data["results"]
+            ],
+            [("PER-1", 0), ("APL-1", 4)],
+        )
+        self.assertEqual(response.data["missing"], ["NOPE"])
+
+    def test_unknown_sku(self):
+        response = self.client.get(reverse("products-scan", kwargs={"sku": "NOPE"}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_manager_without_a_branch(self):
+        self.client.force_authenticate(create_manager(username="other"))
+        response = self.client.get(reverse("products-scan", kwargs={"sku": "APL-1"}))
+        self.assertEqual(response.status_code, 403)
@@ -1,24 +1,204 @@
+import json
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets, permissions, filters
-from .serializers import ProductSerializer, DamagedProductSerializer
+from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.throttling import UserRateThrottle
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from .serializers import (
+    ProductSerializer,
+    DamagedProductSerializer,
+    BarcodeSheetSerializer,
+)
 from .models import Product, DamagedProduct
+from apps.branches.models import BranchProduct
+from . import barcodes
+from .catalog import CatalogError, CatalogImporter, read_rows
+from .search import ProductSearchFilter
+from .scan_cache import products as scan_cache
+from .barcode_cache import labels
+from apps.core.pagination import KeysetPagination
+from apps.users.authentication import managed_branch_id
+
+
+class ProductPagination(KeysetPagination):
+    # ?ordering=price is still honoured; the cursor then keys on price, id.
+    ordering = ("name", "id")
+    max_page_size = 200
+
+    def get_ordering(self, request, queryset, view):
+        # Search results come best match first unless ?ordering= is given.
+        if "search_rank" in queryset.query.annotations and not (
+            request.query_params.get(api_settings.ORDERING_PARAM)
+        ):
+            return ("-search_rank", "name", "id")
+        return super().get_ordering(request, queryset, view)
+
+
+class ScanRateThrottle(UserRateThrottle):
+    # A lane scans all day, so scans are limited per minute instead.
+    scope = "scan"
 
 
 class ProductViewSet(viewsets.ModelViewSet):
-    queryset = Product.objects.all()
+    queryset = Product.objects.defer("search_vector")
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     filter_backends = [
         DjangoFilterBackend,
-        filters.SearchFilter,
+        ProductSearchFilter,
         filters.OrderingFilter,
     ]
     filterset_fields = ["name"]
     search_fields = ["name", "description", "sku"]
     ordering_fields = ["name", "price"]
+    pagination_class = ProductPagination
+    import_batch_size = 2000
+    max_scan_skus = 200
+
+    @action(
+        detail=False,
+        methods=["post"],
+        url_path="import",
+        parser_classes=[MultiPartParser],
+    )
+    def import_catalog(self, request):
+        upload = request.FILES.get("file")
+        if upload is None:
+            return Response({"error": "Upload the catalog as 'file'"}, status=400)
+        importer = CatalogImporter(batch_size=self.import_batch_size)
+        try:
+            report = importer.run(read_rows(upload, upload.name))
+        except CatalogError as error:
+            return Response({"error": str(error)}, status=400)
+        return Response(report, status=201 if report["created"] else 400)
+
+    # Scanner lookups skip the filter and pagination stack and are served
+    # from the per-process SKU cache; only the branch stock is read live.
+    @action(
+        detail=False,
+        methods=["get"],
+        url_path=r"scan/(?P<sku>[^/]+)",
+        throttle_classes=[ScanRateThrottle],
+    )
+    def scan(self, request, sku):
+        records = self.scan_records(request, [sku])
+        if not records:
+            return Response({"error": "Unknown SKU"}, status=404)
+        return Response(records[0])
+
+    @action(
+        detail=False,
+        methods=["get"],
+        url_path="scan",
+        throttle_classes=[ScanRateThrottle],
+    )
+    def scan_batch(self, request):
+        skus = list(
+            dict.fromkeys(
+                sku.strip()
+                for sku in request.query_params.get("skus", "").split(",")
+                if sku.strip()
+            )
+        )
+        if not skus:
+            return Response({"error": "Pass the SKUs as ?skus=a,b"}, status=400)
+        if len(skus) > self.max_scan_skus:
+            return Response(
+                {"error": f"At most {self.max_scan_skus} SKUs per request"},
+                status=400,
+            )
+        records = self.scan_records(request, skus)
+        found = {record["sku"] for record in records}
+        return Response(
+            {"results": records, "missing": [sku for sku in skus if sku not in found]}
+        )
+
+    def scan_records(self, request, skus):
+        cached = scan_cache.get_many(skus)
+        records = [cached[sku] for sku in skus if sku in cached]
+        stock = None
+        if records and getattr(request.user, "role", None) == "branch_manager":
+            stock = dict(
+                BranchProduct.objects.filter(
+                    branch_id=managed_branch_id(request),
+                    product_id__in=[record["id"] for record in records],
+                ).values_list("product_id", "quantity")
+            )
+        return [
+            {
+                **record,
+                "branch_quantity": (
+                    None if stock is None else stock.get(record["id"], 0)
+                ),
+            }
+            for record in records
+        ]
 
 
 class DamagedProductViewSet(viewsets.ModelViewSet):
-    queryset = DamagedProduct.objects.all()
+    queryset = DamagedProduct.objects.select_related("product")
     serializer_class = DamagedProductSerializer
     permission_classes = [permissions.IsAuthenticated]
+
+
+class LabelRenderer(BaseRenderer):
+    # Lets clients ask for image/png or image/svg+xml explicitly; the label
+    # views return the image bytes themselves and only errors get here.
+    media_type = "image/*"
+    format = "label"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data).encode()
+
+
+class BarcodeView(APIView):
+    # Rendering writes to the shared label directory, so it is not open to
+    # anonymous callers; labels exist only for catalog SKUs in three sizes.
+    permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = [JSONRenderer, LabelRenderer]
+    cache_max_age = 24 * 60 * 60
+
+    def get(self, request, sku, fmt):
+        size = request.query_params.get("size", "medium")
+        if size not in barcodes.SIZES:
+            return Response(
+                {"error": f"Invalid size, expected one of {', '.join(barcodes.SIZES)}"},
+                status=400,
+            )
+        if not Product.objects.filter(sku=sku).exists():
+            return Response({"error": "Unknown SKU"}, status=404)
+
+        content, etag = labels.get(sku, fmt, size)
+        response = HttpResponse(content, content_type=barcodes.FORMATS[fmt])
+        response["ETag"] = etag
+        patch_cache_control(response, private=True, max_age=self.cache_max_age)
+        return get_conditional_response(request, etag=etag, response=response)
+
+
+class BarcodeSheetView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = [JSONRenderer, LabelRenderer]
+    # A PNG sheet is one bitmap held in memory, about 0.5 MB per large label.
+    max_labels = {"svg": 5000, "png": 100}
+
+    def post(self, request, fmt):
+        serializer = BarcodeSheetSerializer(
+            data=request.data, context={"max_labels": self.max_labels[fmt]}
+        )
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        content = barcodes.sheet(
+            [labels.get(sku, fmt, data["size"])[0] for sku in data["skus"]],
+            fmt,
+            data["columns"],
+        )
+        response = HttpResponse(content, content_type=barcodes.FORMATS[fmt])
+        response["Content-Disposition"] = f'inline; filename="labels.{fmt}"'
+        return response
@@ -1,6 +1,25 @@
 from django.contrib import admin
-from .models import ProductInflow, ProductOutflow
+from .models import (
+    ProductInflow,
+    ProductOutflow,
+    DailyStockRollup,
+    StockMovement,
+    StockSnapshot,
+    BranchInventorySummary,
+    ReorderSetting,
+    ReorderSuggestion,
+    ReorderRun,
+    StockLot,
+)
 
 
 admin.site.register(ProductInflow)
 admin.site.register(ProductOutflow)
+admin.site.register(DailyStockRollup)
+admin.site.register(StockMovement)
+admin.site.register(StockSnapshot)
+admin.site.register(BranchInventorySummary)
+admin.site.register(ReorderSetting)
+admin.site.register(ReorderSuggestion)
+admin.site.register(ReorderRun)
+admin.site.register(StockLot)
@@ -0,0 +1,128 @@
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from apps.core.caches import is_shared
+
+# Dashboard responses are cached under a version number per scope: "all" for
+# the admin dashboard and "branch:<id>" for each branch dashboard. Writes
+# bump the versions they affect once their transaction commits, so a cached
+# response is never served after the data behind it has changed; the timeout
+# only bounds how long unused entries linger.
+#
+# That holds for the processes that share the cache. A per-process cache
+# such as the default LocMemCache only sees the bumps of its own process, so
+# there entries are kept for at most DASHBOARD_LOCAL_CACHE_TIMEOUT seconds,
+# which bounds how stale the other workers' dashboards can get.
+
+ALL = "all"
+
+
+def branch_scope(branch_id):
+    return f"branch:{branch_id}"
+
+
+def fetch(name, scope, params, compute):
+    """Return ``(data, hit)`` for a dashboard, computing and storing it on a
+    miss. ``params`` distinguishes variants of the same dashboard."""
+    key, data = _lookup(name, scope, params)
+    if data is not None:
+        return data, True
+    data = compute()
+    _store(name, key, data)
+    return data, False
+
+
+async def afetch(name, scope, params, compute):
+    """fetch() for async views, where ``compute`` is a coroutine function."""
+    key, data = await sync_to_async(_lookup)(name, scope, params)
+    if data is not None:
+        return data, True
+    data = await compute()
+    await sync_to_async(_store)(name, key, data)
+    return data, False
+
+
+def invalidate(branch_ids=()):
+    """Expire the admin dashboard and the given branches' dashboards when
+    the current transaction commits."""
+    scopes = [ALL, *{branch_scope(branch_id) for branch_id in branch_ids}]
+    transaction.on_commit(lambda: _bump(scopes))
+
+
+def stats(names):
+    cache = get_cache()
+    counts = cache.get_many(
+        [_stat_key(name, kind) for name in names for kind in ("hits", "misses")]
+    )
+    result = {}
+    for name in names:
+        hits = counts.get(_stat_key(name, "hits"), 0)
+        misses = counts.get(_stat_key(name, "misses"), 0)
+        result[name] = {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else None,
+        }
+    return result
+
+
+def get_cache():
+    return caches[settings.DASHBOARD_CACHE_ALIAS]
+
+
+def timeout():
+    if is_shared(settings.DASHBOARD_CACHE_ALIAS):
+        return settings.DASHBOARD_CACHE_TIMEOUT
+    return min(settings.DASHBOARD_CACHE_TIMEOUT, settings.DASHBOARD_LOCAL_CACHE_TIMEOUT)
+
+
+def _lookup(name, scope, params):
+    cache = get_cache()
+    # The version is read before computing, so a write that lands meanwhile
+    # leaves this result under a version nobody asks for again.
+    version = cache.get_or_set(_version_key(scope), _new_version, timeout=None)
+    key = f"dashboard:{name}:{scope}:{version}:{params}"
+    data = cache.get(key)
+    if data is not None:
+        _count(name, "hits")
+    return key, data
+
+
+def _store(name, key, data):
+    get_cache().set(key, data, timeout())
+    _count(name, "misses")
+
+
+def _bump(scopes):
+    cache = get_cache()
+    for scope in scopes:
+        try:
+            cache.incr(_version_key(scope))
+        except ValueError:
+            # Not cached yet or evicted. A time based version cannot collide
+            # with one used before, so old entries stay unreachable.
+            cache.set(_version_key(scope), _new_version(), timeout=None)
+
+
+def _count(name, kind):
+    cache = get_cache()
+    key = _stat_key(name, kind)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+def _new_version():
+    return time.time_ns() // 1000
+
+
+def _version_key(scope):
+    return f"dashboard:version:{scope}"
+
+
+def _stat_key(name, kind):
+    return f"dashboard:stats:{name}:{kind}"
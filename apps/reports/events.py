@@ -0,0 +1,235 @@
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+from django.conf import settings
+from django.core import signing
+from django.db import connections, transaction
+
+# Live stock and request changes for the dashboards, streamed as server-sent
+# events. Each process keeps the open streams as subscriptions keyed by
+# branch id, or ALL for streams that follow every branch, and writers
+# publish events when their transaction commits. With STOCK_EVENTS_BACKEND
+# set to "postgres" events go out through NOTIFY instead, and a listener
+# thread in every process hands them to that process's subscriptions, so a
+# change made behind one worker reaches the streams held by all of them.
+#
+# The streams are async views and are only served over ASGI: the Procfile
+# runs config/asgi.py under uvicorn. A WSGI deployment answers 501, and its
+# dashboards have to keep polling.
+#
+# EventSource cannot send an Authorization header, so browsers first trade
+# their access token for a ticket: a signed user id that only opens a stream
+# and expires after STOCK_EVENTS_TICKET_MAX_AGE seconds.
+
+ALL = "all"
+
+# Events are kept under the 8000 byte NOTIFY payload limit by splitting
+# large stock changes.
+MAX_CHANGES = 100
+
+RESYNC = {"type": "resync"}
+
+TICKET_SALT = "apps.reports.events.ticket"
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    def __init__(self, keys, max_pending):
+        self.keys = keys
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(max_pending)
+        self.overflowed = False
+
+    def put(self, event):
+        # Called from whichever thread committed the change.
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # The loop is gone; the stream is being torn down.
+            pass
+
+    def resync(self):
+        self.put(RESYNC)
+
+    async def get(self, timeout):
+        """Return the next event, or None after ``timeout`` seconds without
+        one."""
+        try:
+            event = await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if event is RESYNC:
+            self.overflowed = False
+        return event
+
+    def _put(self, event):
+        # A client that fell behind, or may have missed events, gets a single
+        # resync event telling it to reload instead of the backlog.
+        if self.overflowed:
+            return
+        if event is RESYNC or self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+            self.overflowed = True
+        else:
+            self.queue.put_nowait(event)
+
+
+class Broker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = {}
+        self.listener = None
+
+    def subscribe(self, keys):
+        subscription = Subscription(keys, settings.STOCK_EVENTS_MAX_PENDING)
+        with self.lock:
+            for key in keys:
+                self.subscriptions.setdefault(key, set()).add(subscription)
+            if settings.STOCK_EVENTS_BACKEND == "postgres" and self.listener is None:
+                self.listener = Listener(self, settings.STOCK_EVENTS_CHANNEL)
+                self.listener.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for key in subscription.keys:
+                subscribers = self.subscriptions.get(key, set())
+                subscribers.discard(subscription)
+                if not subscribers:
+                    self.subscriptions.pop(key, None)
+
+    def deliver(self, event):
+        with self.lock:
+            targets = set(self.subscriptions.get(ALL, ()))
+            if event.get("branch") is not None:
+                targets.update(self.subscriptions.get(event["branch"], ()))
+        for subscription in targets:
+            subscription.put(event)
+
+    def resync(self):
+        with self.lock:
+            targets = set().union(*self.subscriptions.values())
+        for subscription in targets:
+            subscription.resync()
+
+
+class Listener(threading.Thread):
+    daemon = True
+    retry_delay = 1.0
+    poll_interval = 5.0
+
+    def __init__(self, broker, channel, using="default"):
+        super().__init__(name="stock-events-listener")
+        self.broker = broker
+        self.channel = channel
+        self.using = using
+
+    def run(self):
+        while True:
+            try:
+                self.listen()
+            except Exception:
+                logger.exception("Stock event listener lost its connection")
+            time.sleep(self.retry_delay)
+            # Anything sent while reconnecting is lost.
+            self.broker.resync()
+
+    def listen(self):
+        connection = connections.create_connection(self.using)
+        try:
+            connection.ensure_connection()
+            connection.set_autocommit(True)
+            raw = connection.connection
+            with raw.cursor() as cursor:
+                cursor.execute(f"LISTEN {connection.ops.quote_name(self.channel)}")
+            while True:
+                if select.select([raw], [], [], self.poll_interval)[0]:
+                    raw.poll()
+                while raw.notifies:
+                    self.broker.deliver(json.loads(raw.notifies.pop(0).payload))
+        finally:
+            connection.close()
+
+
+def publish(events):
+    """Send ``events`` to the streams once the current transaction commits;
+    they are dropped if it rolls back."""
+    if not events:
+        return
+    if settings.STOCK_EVENTS_BACKEND != "postgres":
+        transaction.on_commit(lambda: [broker.deliver(event) for event in events])
+        return
+    # NOTIFY is itself transactional: Postgres sends it on commit.
+    with transaction.get_connection().cursor() as cursor:
+        cursor.execute(
+            "SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) AS payload",
+            [settings.STOCK_EVENTS_CHANNEL, [encode(event) for event in events]],
+        )
+
+
+def stock_events(kind, quantities):
+    """Build the events for a stock change; ``quantities`` maps (branch id or
+    None for the central store, product id) to the signed change."""
+    changes = {}
+    for (branch_id, product_id), quantity in sorted(
+        quantities.items(), key=lambda item: (item[0][0] or 0, item[0][1])
+    ):
+        if quantity:
+            changes.setdefault(branch_id, []).append(
+                {"product": product_id, "quantity": quantity}
+            )
+    return [
+        {
+            "type": "stock",
+            "kind": kind,
+            "branch": branch_id,
+            "changes": branch_changes[start : start + MAX_CHANGES],
+        }
+        for branch_id, branch_changes in changes.items()
+        for start in range(0, len(branch_changes), MAX_CHANGES)
+    ]
+
+
+async def stream(keys):
+    """Yield the text of a server-sent event stream for the branches in
+    ``keys`` until the client goes away."""
+    subscription = broker.subscribe(keys)
+    try:
+        yield f"retry: {settings.STOCK_EVENTS_RETRY_MS}\n\n"
+        while True:
+            event = await subscription.get(settings.STOCK_EVENTS_HEARTBEAT)
+            if event is None:
+                yield ": heartbeat\n\n"
+            else:
+                yield f"event: {event['type']}\ndata: {encode(event)}\n\n"
+    finally:
+        broker.unsubscribe(subscription)
+
+
+def encode(event):
+    return json.dumps(event, separators=(",", ":"))
+
+
+def issue_ticket(user):
+    """Return a ticket that opens a stream as ``user``."""
+    return signing.dumps(user.pk, salt=TICKET_SALT)
+
+
+def ticket_user_id(ticket):
+    """Return the id of the user ``ticket`` was issued to, or None if it is
+    forged or has expired."""
+    try:
+        return signing.loads(
+            ticket, salt=TICKET_SALT, max_age=settings.STOCK_EVENTS_TICKET_MAX_AGE
+        )
+    except signing.BadSignature:
+        return None
+
+
+broker = Broker()
@@ -0,0 +1,99 @@
+from collections import defaultdict
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Sum, F, DecimalField
+from django.db.models.functions import TruncDate
+from apps.products.models import DamagedProduct
+from apps.reports.models import ProductInflow, ProductOutflow, DailyStockRollup
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily stock rollup from the inflow, outflow and damage ledgers."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", type=date.fromisoformat, help="YYYY-MM-DD")
+        parser.add_argument("--end", type=date.fromisoformat, help="YYYY-MM-DD")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        start, end = options["start"], options["end"]
+        if start and end and start > end:
+            raise CommandError("--start must not be after --end.")
+
+        buckets = defaultdict(
+            lambda: {
+                "quantity_in": 0,
+                "quantity_out": 0,
+                "value_in": 0,
+                "value_out": 0,
+                "quantity_damaged": 0,
+            }
+        )
+
+        inflows = self.in_range(
+            ProductInflow.objects.all(), "date_received", start, end
+        )
+        for row in inflows.values("date_received", "product", "supplier").annotate(
+            quantity=Sum("quantity_received"),
+            value=Sum(
+                F("quantity_received") * F("product__price"),
+                output_field=DecimalField(),
+            ),
+        ):
+            bucket = buckets[
+                (row["date_received"], row["product"], None, row["supplier"])
+            ]
+            bucket["quantity_in"] += row["quantity"]
+            bucket["value_in"] += row["value"]
+
+        outflows = self.in_range(ProductOutflow.objects.all(), "date_sent", start, end)
+        for row in outflows.values("date_sent", "product", "branch").annotate(
+            quantity=Sum("quantity_sent"),
+            value=Sum(
+                F("quantity_sent") * F("product__price"),
+                output_field=DecimalField(),
+            ),
+        ):
+            bucket = buckets[(row["date_sent"], row["product"], row["branch"], None)]
+            bucket["quantity_out"] += row["quantity"]
+            bucket["value_out"] += row["value"]
+
+        damages = self.in_range(
+            DamagedProduct.objects.annotate(day=TruncDate("date_reported")),
+            "day",
+            start,
+            end,
+        )
+        for row in damages.values("day", "product").annotate(quantity=Sum("quantity")):
+            buckets[(row["day"], row["product"], None, None)][
+                "quantity_damaged"
+            ] += row["quantity"]
+
+        rollups = [
+            DailyStockRollup(
+                day=day,
+                product_id=product_id,
+                branch_id=branch_id,
+                supplier_id=supplier_id,
+                **amounts,
+            )
+            for (day, product_id, branch_id, supplier_id), amounts in buckets.items()
+        ]
+
+        with transaction.atomic():
+            self.in_range(DailyStockRollup.objects.all(), "day", start, end).delete()
+            DailyStockRollup.objects.bulk_create(
+                rollups, batch_size=options["batch_size"]
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt {len(rollups)} daily rollup rows.")
+        )
+
+    def in_range(self, queryset, field, start, end):
+        if start:
+            queryset = queryset.filter(**{f"{field}__gte": start})
+        if end:
+            queryset = queryset.filter(**{f"{field}__lte": end})
+        return queryset
@@ -0,0 +1,299 @@
+import asyncio
+import json
+import platform
+import statistics
+import subprocess
+import time
+import django
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.urls import NoReverseMatch, resolve, reverse
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.tokens import AccessToken
+from apps.core import metrics
+from apps.products.models import DamagedProduct, Product
+from apps.branches.models import Branch, BranchProduct, ProductRequest
+from apps.users.authentication import add_claims
+from apps.users.models import User
+from apps.reports import dashboard_cache
+from apps.reports.models import ProductInflow, ProductOutflow
+
+# (URL name, role of the user making the request, query parameters). Detail
+# routes are called for the first row of the matching list route.
+ENDPOINTS = [
+    ("products-list", "admin", {}),
+    ("products-detail", "admin", {}),
+    ("products-list", "admin", {"search": "organic apple"}),
+    ("damaged_products-list", "admin", {}),
+    ("damaged_products-detail", "admin", {}),
+    ("suppliers-list", "admin", {}),
+    ("suppliers-detail", "admin", {}),
+    ("product_inflow-list", "admin", {}),
+    ("product_inflow-detail", "admin", {}),
+    ("product_outflow-list", "admin", {}),
+    ("product_outflow-detail", "admin", {}),
+    ("branches-list", "admin", {}),
+    ("branches-detail", "admin", {}),
+    ("users-list", "admin", {}),
+    ("users-detail", "admin", {}),
+    ("reorder_settings-list", "admin", {}),
+    ("reorder_suggestions-list", "admin", {}),
+    ("branch_products-list", "branch_manager", {}),
+    ("branch_products-detail", "branch_manager", {}),
+    ("product_requests-list", "branch_manager", {}),
+    ("product_requests-detail", "branch_manager", {}),
+    ("reorder_suggestions-list", "branch_manager", {}),
+    ("inward-qty-report", "admin", {}),
+    ("outward-qty-report", "admin", {}),
+    ("branch-wise-qty-report", "admin", {}),
+    ("expired-product-report", "admin", {}),
+    ("supplier-wise-product-report", "admin", {}),
+    ("opened-product-report", "admin", {}),
+    ("closed-product-report", "admin", {}),
+    ("daily-report", "admin", {}),
+    ("product-details-report", "admin", {}),
+    ("branch-daily-report", "branch_manager", {}),
+    ("branch-product-details-report", "branch_manager", {}),
+    ("branch-expired-product-report", "branch_manager", {}),
+    ("dashboard", "admin", {"period": "daily"}),
+    ("dashboard", "admin", {"period": "monthly"}),
+    ("dashboard-async", "admin", {"period": "monthly"}),
+    ("branch-dashboard", "branch_manager", {}),
+    ("branch-dashboard-async", "branch_manager", {}),
+    ("branch-inventory-levels", "branch_manager", {}),
+]
+
+# Tables whose size is recorded with the results
+TABLES = [
+    Product,
+    Branch,
+    BranchProduct,
+    ProductInflow,
+    ProductOutflow,
+    DamagedProduct,
+    ProductRequest,
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Call every ViewSet, report and dashboard endpoint as an admin or a "
+        "branch manager with a bearer token, and record the p50/p95/p99 "
+        "latency, queries and response size of each in a JSON file, together "
+        "with the commit and table sizes. --compare prints the change against "
+        "an earlier file. Run it on a seed_stock_dataset database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=50)
+        parser.add_argument("--warmup", type=int, default=3)
+        parser.add_argument(
+            "--cold",
+            action="store_true",
+            help="Expire the dashboard cache before every request.",
+        )
+        parser.add_argument("--output", help="JSON file to write the results to.")
+        parser.add_argument("--compare", help="JSON file of an earlier run.")
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=10.0,
+            help="Percent slower at p95 that counts as a regression.",
+        )
+        parser.add_argument(
+            "--fail-on-regression",
+            action="store_true",
+            help="Exit with an error if any endpoint regressed.",
+        )
+        parser.add_argument("endpoints", nargs="*", help="URL names to call.")
+
+    def handle(self, *args, **options):
+        manager = (
+            User.objects.filter(role="branch_manager", managed_branch__isnull=False)
+            .select_related("managed_branch")
+            .first()
+        )
+        users = {
+            "admin": User.objects.filter(role="admin").first(),
+            "branch_manager": manager,
+        }
+        if None in users.values():
+            raise CommandError(
+                "There is no admin or no branch manager; run seed_stock_dataset first."
+            )
+        endpoints = [
+            endpoint
+            for endpoint in ENDPOINTS
+            if not options["endpoints"] or endpoint[0] in options["endpoints"]
+        ]
+        if not endpoints:
+            raise CommandError(
+                "Unknown endpoint; choose from "
+                + ", ".join(sorted({name for name, _, _ in ENDPOINTS}))
+            )
+
+        # As issued at login
+        headers = {
+            role: f"Bearer {add_claims(AccessToken.for_user(user), user)}"
+            for role, user in users.items()
+        }
+        self.factory = APIRequestFactory()
+        results = {}
+        for name, role, params in endpoints:
+            path = self.path(name, headers[role])
+            if path is None:
+                self.stderr.write(f"Skipping {name}: nothing to show.")
+                continue
+            key = label(name, role, params)
+            timings, counts, size = [], [], 0
+            for i in range(options["warmup"] + options["requests"]):
+                if options["cold"]:
+                    # Outside a transaction this takes effect at once.
+                    dashboard_cache.invalidate([manager.managed_branch.pk])
+                elapsed, queries, response = self.call(path, params, headers[role])
+                if response.status_code != 200:
+                    raise CommandError(f"{key} returned {response.status_code}.")
+                if i >= options["warmup"]:
+                    timings.append(elapsed)
+                    counts.append(queries)
+                    size = len(response.content)
+
+            results[key] = {
+                "path": path,
+                "role": role,
+                "params": params,
+                "requests": len(timings),
+                "p50_ms": round(percentile(timings, 50), 3),
+                "p95_ms": round(percentile(timings, 95), 3),
+                "p99_ms": round(percentile(timings, 99), 3),
+                "mean_ms": round(statistics.mean(timings), 3),
+                "queries": max(counts),
+                "response_bytes": size,
+            }
+            self.stdout.write(
+                f"{key:<55} p50={results[key]['p50_ms']:8.2f}ms "
+                f"p95={results[key]['p95_ms']:8.2f}ms "
+                f"p99={results[key]['p99_ms']:8.2f}ms "
+                f"queries={results[key]['queries']:3}"
+            )
+
+        run = {
+            "meta": {
+                "commit": commit(),
+                "started_at": timezone.now().isoformat(),
+                "database": connection.vendor,
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "requests": options["requests"],
+                "warmup": options["warmup"],
+                "cold": options["cold"],
+                "rows": {model._meta.label: model.objects.count() for model in TABLES},
+            },
+            "endpoints": results,
+        }
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                json.dump(run, output, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}."))
+        if options["compare"]:
+            with open(options["compare"]) as baseline:
+                regressions = self.compare(json.load(baseline), run, options)
+            if regressions and options["fail_on_regression"]:
+                raise CommandError(f"{regressions} endpoints regressed.")
+
+    def path(self, name, header):
+        if not name.endswith("-detail"):
+            return reverse(name)
+        # The first row the list shows this user
+        list_path = reverse(name.replace("-detail", "-list"))
+        response = self.call(list_path, {}, header)[2]
+        rows = json.loads(response.content)
+        rows = rows.get("results", rows) if isinstance(rows, dict) else rows
+        if not rows:
+            return None
+        try:
+            return reverse(name, kwargs={"pk": rows[0]["id"]})
+        except (KeyError, NoReverseMatch):
+            return None
+
+    def call(self, path, params, header):
+        """Return the milliseconds and queries taken by a GET of ``path``, and
+        its rendered response."""
+        func = resolve(path).func
+        initkwargs = {**getattr(func, "initkwargs", {}), "throttle_classes": []}
+        if getattr(func, "actions", None):
+            view = func.cls.as_view(func.actions, **initkwargs)
+        else:
+            view = func.cls.as_view(**initkwargs)
+        request = self.factory.get(path, params, HTTP_AUTHORIZATION=header)
+        kwargs = resolve(path).kwargs
+        # Counted by the metrics collector rather than on this thread's
+        # connection, so the queries the dashboards run in their pool count.
+        for alias in connections:
+            metrics.instrument(connections[alias])
+        stats = metrics.RequestStats()
+        token = metrics.current.set(stats)
+        try:
+            started = time.perf_counter()
+            response = view(request, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = async_to_sync(wait)(response)
+            if hasattr(response, "render"):
+                response.render()
+            elapsed = (time.perf_counter() - started) * 1000
+        finally:
+            metrics.current.reset(token)
+        return elapsed, stats.queries, response
+
+    def compare(self, baseline, run, options):
+        self.stdout.write(
+            f"\nAgainst {baseline['meta'].get('commit') or 'unknown commit'} "
+            f"({baseline['meta'].get('database')}):"
+        )
+        regressions = 0
+        for key, result in run["endpoints"].items():
+            before = baseline["endpoints"].get(key)
+            if before is None:
+                self.stdout.write(f"{key:<55} new")
+                continue
+            change = (result["p95_ms"] / before["p95_ms"] - 1) * 100
+            queries = result["queries"] - before["queries"]
+            regressed = change > options["threshold"] or queries > 0
+            regressions += regressed
+            self.stdout.write(
+                f"{key:<55} p95 {before['p95_ms']:8.2f} -> {result['p95_ms']:8.2f}ms "
+                f"({change:+6.1f}%) queries {before['queries']:3} -> "
+                f"{result['queries']:3}" + ("  REGRESSED" if regressed else "")
+            )
+        return regressions
+
+
+def label(name, role, params):
+    query = "&".join(f"{key}={value}" for key, value in sorted(params.items()))
+    return f"{name} ({role}{', ' + query if query else ''})"
+
+
+async def wait(awaitable):
+    return await awaitable
+
+
+def commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentile(values, percent):
+    if len(values) < 2:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[percent - 1]
@@ -0,0 +1,166 @@
+import asyncio
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import ThreadSensitiveContext
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import AsyncRequestFactory
+from rest_framework.test import APIRequestFactory, force_authenticate
+from apps.branches.models import Branch
+from apps.reports import dashboard_cache
+from apps.reports.views import (
+    AsyncBranchDashboardView,
+    AsyncDashboardView,
+    BranchDashboardView,
+    DashboardView,
+)
+
+# Dashboards compared, by the name printed in the results
+DASHBOARDS = {
+    "dashboard": (DashboardView, AsyncDashboardView, "/api/dashboard/"),
+    "branch": (BranchDashboardView, AsyncBranchDashboardView, "/api/branch-dashboard/"),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Time uncached dashboard requests through the sync views, as gunicorn's "
+        "sync workers in the Procfile serve them, and through the async views "
+        "that query their sections concurrently, and print latency "
+        "percentiles for each."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--warmup", type=int, default=10)
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=1,
+            help="Requests in flight at once: sync worker threads, or "
+            "coroutines on one event loop.",
+        )
+        parser.add_argument("--period", default="monthly")
+        parser.add_argument(
+            "--dashboard", choices=list(DASHBOARDS), action="append", dest="dashboards"
+        )
+
+    def handle(self, *args, **options):
+        branch = Branch.objects.exclude(manager=None).select_related("manager").first()
+        if branch is None:
+            raise CommandError(
+                "There is no branch with a manager; run seed_stock_dataset first."
+            )
+        # Either dashboard only needs an authenticated user.
+        user = branch.manager
+
+        self.stdout.write(
+            f"{connection.vendor}, {options['requests']} requests per path, "
+            f"concurrency {options['concurrency']}"
+        )
+        for name in options["dashboards"] or list(DASHBOARDS):
+            sync_view, async_view, path = DASHBOARDS[name]
+            # The benchmark would soon run into the per-user throttle.
+            sync_view = sync_view.as_view(throttle_classes=[])
+            async_view = async_view.as_view(throttle_classes=[])
+            params = {"period": options["period"]}
+            timings = {
+                "sync": self.run_sync(sync_view, path, params, user, options),
+                "async": asyncio.run(
+                    self.run_async(async_view, path, params, user, options)
+                ),
+            }
+            for kind, values in timings.items():
+                self.stdout.write(
+                    f"{name:<10} {kind:<6} n={len(values):<5} "
+                    f"p50={percentile(values, 50):8.1f}ms "
+                    f"p95={percentile(values, 95):8.1f}ms "
+                    f"p99={percentile(values, 99):8.1f}ms "
+                    f"max={max(values):8.1f}ms"
+                )
+
+    def run_sync(self, view, path, params, user, options):
+        factory = APIRequestFactory()
+        timings = []
+        lock = threading.Lock()
+
+        def call(measure):
+            request = factory.get(path, params)
+            force_authenticate(request, user)
+            # Every request is a cache miss.
+            dashboard_cache.invalidate([user.managed_branch.pk])
+            started = time.perf_counter()
+            response = view(request)
+            elapsed = (time.perf_counter() - started) * 1000
+            check(response)
+            if measure:
+                with lock:
+                    timings.append(elapsed)
+
+        def worker(count, measure):
+            try:
+                for _ in range(count):
+                    call(measure)
+            finally:
+                connections.close_all()
+
+        self.spread(worker, options)
+        return timings
+
+    async def run_async(self, view, path, params, user, options):
+        factory = AsyncRequestFactory()
+        timings = []
+
+        async def call(measure):
+            request = factory.get(path, params)
+            force_authenticate(request, user)
+            await asyncio.to_thread(
+                dashboard_cache.invalidate, [user.managed_branch.pk]
+            )
+            started = time.perf_counter()
+            # As the ASGI handler does, so each request's sync code gets a
+            # thread of its own.
+            async with ThreadSensitiveContext():
+                response = await view(request)
+            elapsed = (time.perf_counter() - started) * 1000
+            check(response)
+            if measure:
+                timings.append(elapsed)
+
+        async def worker(count, measure):
+            for _ in range(count):
+                await call(measure)
+
+        concurrency = options["concurrency"]
+        await worker(options["warmup"], False)
+        await asyncio.gather(
+            *(worker(count, True) for count in split(options["requests"], concurrency))
+        )
+        return timings
+
+    def spread(self, worker, options):
+        concurrency = options["concurrency"]
+        with ThreadPoolExecutor(concurrency) as pool:
+            pool.submit(worker, options["warmup"], False).result()
+            for future in [
+                pool.submit(worker, count, True)
+                for count in split(options["requests"], concurrency)
+            ]:
+                future.result()
+
+
+def check(response):
+    if response.status_code != 200:
+        raise CommandError(f"Dashboard returned {response.status_code}.")
+
+
+def split(total, parts):
+    return [total // parts + (i < total % parts) for i in range(parts)]
+
+
+def percentile(values, percent):
+    if len(values) < 2:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[percent - 1]
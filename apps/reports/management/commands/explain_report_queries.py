@@ -0,0 +1,85 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from rest_framework.test import APIRequestFactory, force_authenticate
+from apps.users.models import User
+
+# (URL name, role of the user making the request)
+ENDPOINTS = [
+    ("dashboard", "admin"),
+    ("branch-dashboard", "branch_manager"),
+    ("daily-report", "admin"),
+    ("expired-product-report", "admin"),
+    ("opened-product-report", "admin"),
+    ("closed-product-report", "admin"),
+    ("branch-daily-report", "branch_manager"),
+    ("branch-expired-product-report", "branch_manager"),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Call the report and dashboard endpoints and print the query plan of "
+        "every SELECT they run, to check which indexes the database uses."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--analyze",
+            action="store_true",
+            help="Run the queries and report actual row counts (PostgreSQL).",
+        )
+        parser.add_argument("endpoints", nargs="*", help="URL names to explain.")
+
+    def handle(self, *args, **options):
+        users = {
+            "admin": User.objects.filter(role="admin").first(),
+            "branch_manager": User.objects.filter(
+                role="branch_manager", managed_branch__isnull=False
+            ).first(),
+        }
+        endpoints = [
+            (name, role)
+            for name, role in ENDPOINTS
+            if not options["endpoints"] or name in options["endpoints"]
+        ]
+        if not endpoints:
+            raise CommandError(
+                "Unknown endpoint; choose from "
+                + ", ".join(name for name, _ in ENDPOINTS)
+            )
+
+        if connection.vendor == "postgresql":
+            explain = (
+                "EXPLAIN (ANALYZE, BUFFERS) " if options["analyze"] else "EXPLAIN "
+            )
+        elif connection.vendor == "sqlite":
+            explain = "EXPLAIN QUERY PLAN "
+        else:
+            explain = "EXPLAIN "
+
+        factory = APIRequestFactory()
+        for name, role in endpoints:
+            if users[role] is None:
+                self.stderr.write(f"Skipping {name}: no {role} user with a branch.")
+                continue
+
+            url = reverse(name)
+            request = factory.get(url)
+            force_authenticate(request, user=users[role])
+            with CaptureQueriesContext(connection) as queries:
+                response = resolve(url).func(request)
+            if response.status_code != 200:
+                raise CommandError(f"{name} returned {response.status_code}.")
+
+            self.stdout.write(f"== {name} ({url}), {len(queries)} queries")
+            for query in queries:
+                if not query["sql"].lstrip().upper().startswith("SELECT"):
+                    continue
+                self.stdout.write(f"\n{query['sql']}\n")
+                with connection.cursor() as cursor:
+                    cursor.execute(explain + query["sql"])
+                    for row in cursor.fetchall():
+                        self.stdout.write("  " + " ".join(str(value) for value in row))
+            self.stdout.write("")
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from apps.branches.models import Branch
+from apps.reports.models import BranchInventorySummary
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the branch inventory summaries from the branch products and "
+        "product requests, for every branch or the given branch ids."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("branches", nargs="*", type=int)
+
+    def handle(self, *args, **options):
+        branch_ids = options["branches"] or list(
+            Branch.objects.values_list("pk", flat=True)
+        )
+        with transaction.atomic():
+            BranchInventorySummary.objects.filter(pk__in=branch_ids).delete()
+            BranchInventorySummary.lock(branch_ids)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt {len(branch_ids)} branch summaries.")
+        )
@@ -0,0 +1,83 @@
+from collections import defaultdict
+from itertools import chain
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+from apps.products.models import Product
+from apps.branches.models import BranchProduct
+from apps.reports.models import ProductInflow, ProductOutflow, StockLot
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the stock lots from the current quantities. Lots are taken "
+        "soonest expiry first, so what each store still holds is assumed to be "
+        "its undated receipts and then the ones that expire last: inflows and "
+        "opening stock for the central store, outflows for a branch. Run it "
+        "while no stock is moving."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        # (branch id or None, product id) -> expiry date or None -> units
+        received = defaultdict(lambda: defaultdict(int))
+        for product_id, opening_stock in Product.objects.values_list(
+            "pk", "opening_stock"
+        ):
+            received[(None, product_id)][None] += opening_stock
+        for row in ProductInflow.objects.values("product", "expiry_date").annotate(
+            quantity=Sum("quantity_received")
+        ):
+            received[(None, row["product"])][row["expiry_date"]] += row["quantity"]
+        for row in ProductOutflow.objects.values(
+            "branch", "product", "expiry_date"
+        ).annotate(quantity=Sum("quantity_sent")):
+            received[(row["branch"], row["product"])][row["expiry_date"]] += row[
+                "quantity"
+            ]
+
+        held = chain(
+            (
+                ((None, product_id), quantity)
+                for product_id, quantity in Product.objects.values_list(
+                    "pk", "quantity"
+                )
+            ),
+            (
+                ((branch_id, product_id), quantity)
+                for branch_id, product_id, quantity in BranchProduct.objects.values_list(
+                    "branch", "product", "quantity"
+                )
+            ),
+        )
+        with transaction.atomic():
+            StockLot.objects.all().delete()
+            lots = StockLot.objects.bulk_create(
+                self.lots(held, received), batch_size=options["batch_size"]
+            )
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(lots)} stock lots."))
+
+    def lots(self, held, received):
+        for (branch_id, product_id), quantity in held:
+            receipts = received.get((branch_id, product_id), {})
+            lots = defaultdict(int)
+            for expiry_date in sorted(
+                receipts,
+                key=lambda day: (day is not None, -day.toordinal() if day else 0),
+            ):
+                units = min(quantity, receipts[expiry_date])
+                lots[expiry_date] += units
+                quantity -= units
+            # Stock beyond the receipts came from adjustments.
+            lots[None] += quantity
+            for expiry_date, units in lots.items():
+                if units:
+                    yield StockLot(
+                        branch_id=branch_id,
+                        product_id=product_id,
+                        expiry_date=expiry_date,
+                        quantity=units,
+                    )
@@ -0,0 +1,23 @@
+import time
+from django.core.management.base import BaseCommand
+from apps.reports import reorder
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the reorder suggestions for the pairs whose stock, requests "
+        "or settings changed since the last run, or all of them with --full."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        written = reorder.refresh(full=options["full"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Wrote {written} reorder suggestions in "
+                f"{time.perf_counter() - started:.1f}s."
+            )
+        )
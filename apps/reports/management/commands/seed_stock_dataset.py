@@ -0,0 +1,342 @@
+import csv
+import io
+import random
+import time as clock
+from array import array
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from itertools import accumulate, groupby
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from apps.users.models import User
+from apps.products.models import DamagedProduct, Product
+from apps.branches.models import Branch, BranchProduct, ProductRequest
+from apps.suppliers.models import Supplier
+from apps.reports.models import ProductInflow, ProductOutflow
+
+# Product names and descriptions are drawn from these so that searches over
+# the seeded catalog behave like searches over a real one.
+ADJECTIVES = """
+Organic Fresh Frozen Dried Smoked Spicy Sweet Salted Roasted Whole Sliced
+Premium Classic Golden Wild Crispy Creamy Light Natural Mild
+""".split()
+NOUNS = """
+Apple Banana Cherry Mango Tomato Potato Carrot Onion Garlic Pepper Almond
+Cashew Walnut Coffee Tea Rice Flour Sugar Honey Butter Cheese Yogurt Chicken
+Salmon Tuna Pasta Noodles Biscuits Crackers Juice
+""".split()
+USES = """
+baking snacking breakfast salads soups grilling desserts sandwiches curries
+smoothies
+""".split()
+REASONS = ["Broken packaging", "Spoiled", "Water damage", "Crushed in transit"]
+
+# Fields written for each table, in the order the rows are given; the date
+# field, if any, is the last one.
+COLUMNS = {
+    ProductInflow: (
+        "product_id",
+        "supplier_id",
+        "quantity_received",
+        "expiry_date",
+        "date_received",
+    ),
+    ProductOutflow: ("product_id", "branch_id", "quantity_sent", "date_sent"),
+    DamagedProduct: ("product_id", "quantity", "reason", "date_reported"),
+    ProductRequest: ("branch_id", "product_id", "quantity", "status", "date_requested"),
+    BranchProduct: ("branch_id", "product_id", "quantity", "status", "last_updated"),
+}
+# Set by auto_now_add, so bulk inserts need them put back afterwards.
+DATED = {ProductInflow, ProductOutflow, DamagedProduct, ProductRequest}
+
+# Requests older than this are mostly fulfilled.
+OPEN_REQUEST_DAYS = 14
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill an empty database with a large synthetic catalog and ledger, for "
+        "query plans and benchmarks. A few products and branches account for "
+        "most movements, and stock only leaves the central store once it has "
+        "arrived. The ledger is written one day at a time, with COPY on "
+        "PostgreSQL and bulk inserts elsewhere, so e.g. --branches 200 "
+        "--products 100000 and 50M movements fit in memory. The same options "
+        "and --today give the same data. Never run it against real data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=5000)
+        parser.add_argument("--branches", type=int, default=25)
+        parser.add_argument("--suppliers", type=int, default=50)
+        parser.add_argument("--inflows", type=int, default=200000)
+        parser.add_argument("--outflows", type=int, default=200000)
+        parser.add_argument("--damaged", type=int, default=2000)
+        parser.add_argument("--requests", type=int, default=50000)
+        parser.add_argument("--days", type=int, default=365)
+        parser.add_argument(
+            "--today",
+            type=date.fromisoformat,
+            help="Last day of the period, YYYY-MM-DD; defaults to today.",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if Product.objects.exists():
+            raise CommandError("The database already has products; use an empty one.")
+
+        started = clock.perf_counter()
+        self.random = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        days = options["days"]
+        today = options["today"] or timezone.localdate()
+
+        with transaction.atomic():
+            supplier_ids = [
+                supplier.pk
+                for supplier in Supplier.objects.bulk_create(
+                    Supplier(
+                        name=f"Supplier {i}",
+                        contact_person="-",
+                        phone_number="-",
+                        email=f"supplier{i}@example.com",
+                        location="-",
+                    )
+                    for i in range(options["suppliers"])
+                )
+            ]
+            # bulk_create skips User.save, which sets the admin flags.
+            User.objects.create(
+                username="seed-admin",
+                password="!",
+                role="admin",
+                is_staff=True,
+                is_superuser=True,
+            )
+            managers = User.objects.bulk_create(
+                User(
+                    username=f"seed-manager-{i}",
+                    password="!",
+                    role="branch_manager",
+                )
+                for i in range(options["branches"])
+            )
+            branch_ids = [
+                branch.pk
+                for branch in Branch.objects.bulk_create(
+                    Branch(
+                        name=f"Branch {i}",
+                        branch_code=f"SEED-{i:05d}",
+                        location="-",
+                        contact_details="-",
+                        manager=manager,
+                    )
+                    for i, manager in enumerate(managers)
+                )
+            ]
+            products = Product.objects.bulk_create(
+                (
+                    Product(
+                        name=f"{self.random.choice(ADJECTIVES)} "
+                        f"{self.random.choice(NOUNS)} {i:06d}",
+                        description=f"{self.random.choice(ADJECTIVES)} pick for "
+                        f"{self.random.choice(USES)}",
+                        sku=f"SEED-{i:06d}",
+                        price=self.random.randint(100, 100000) / 100,
+                        quantity=0,
+                        opening_stock=self.random.randint(0, 500),
+                    )
+                    for i in range(options["products"])
+                ),
+                batch_size=self.batch_size,
+            )
+            product_ids = [product.pk for product in products]
+
+            # Stock on hand in the central store and each branch, by position
+            available = [product.opening_stock for product in products]
+            delivered = array("i", bytes(4 * len(branch_ids) * len(product_ids)))
+            pick_product = self.popularity(len(product_ids), 0.8)
+            pick_branch = self.popularity(len(branch_ids), 0.5)
+            writer = LedgerWriter(self.batch_size)
+
+            for offset in range(days):
+                day = today - timedelta(days=days - 1 - offset)
+                moment = timezone.make_aware(datetime.combine(day, time(12)))
+
+                for index in pick_product(share(options["inflows"], offset, days)):
+                    quantity = self.random.randint(1, 200)
+                    available[index] += quantity
+                    expiry_date = None
+                    if self.random.random() < 0.5:
+                        expiry_date = day + timedelta(days=self.random.randint(7, 540))
+                    writer.add(
+                        ProductInflow,
+                        (
+                            product_ids[index],
+                            self.random.choice(supplier_ids),
+                            quantity,
+                            expiry_date,
+                            day,
+                        ),
+                    )
+
+                count = share(options["outflows"], offset, days)
+                for index, branch in zip(pick_product(count), pick_branch(count)):
+                    quantity = min(self.random.randint(1, 50), available[index])
+                    if not quantity:
+                        continue
+                    available[index] -= quantity
+                    delivered[branch * len(product_ids) + index] += quantity
+                    writer.add(
+                        ProductOutflow,
+                        (product_ids[index], branch_ids[branch], quantity, day),
+                    )
+
+                for index in pick_product(share(options["damaged"], offset, days)):
+                    quantity = min(self.random.randint(1, 10), available[index])
+                    if not quantity:
+                        continue
+                    available[index] -= quantity
+                    writer.add(
+                        DamagedProduct,
+                        (
+                            product_ids[index],
+                            quantity,
+                            self.random.choice(REASONS),
+                            moment,
+                        ),
+                    )
+
+                count = share(options["requests"], offset, days)
+                for index, branch in zip(pick_product(count), pick_branch(count)):
+                    if days - offset > OPEN_REQUEST_DAYS and self.random.random() < 0.9:
+                        status = "fulfilled"
+                    else:
+                        status = self.random.choice(
+                            ["pending", "acknowledged", "fulfilled"]
+                        )
+                    writer.add(
+                        ProductRequest,
+                        (
+                            branch_ids[branch],
+                            product_ids[index],
+                            self.random.randint(1, 100),
+                            status,
+                            moment,
+                        ),
+                    )
+
+            now = timezone.now()
+            for position, quantity in enumerate(delivered):
+                if quantity:
+                    branch, index = divmod(position, len(product_ids))
+                    writer.add(
+                        BranchProduct,
+                        (
+                            branch_ids[branch],
+                            product_ids[index],
+                            quantity,
+                            self.random.choice(["active", "inactive"]),
+                            now,
+                        ),
+                    )
+            writer.flush()
+
+            for product, quantity in zip(products, available):
+                product.quantity = quantity
+            Product.objects.bulk_update(
+                products, ["quantity"], batch_size=self.batch_size
+            )
+
+        # Journal the seeded quantities and build the reporting rollup, stock
+        # lots, branch summaries and reorder suggestions the same way an
+        # existing database is brought up to date.
+        call_command("take_stock_snapshot", seed=True, settle_seconds=0)
+        call_command("backfill_stock_rollup", batch_size=self.batch_size)
+        call_command("rebuild_stock_lots", batch_size=self.batch_size)
+        call_command("rebuild_branch_summaries")
+        call_command("refresh_reorder_suggestions", full=True)
+        written = writer.written
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Seeded {len(products)} products, {written[ProductInflow]} "
+                f"inflows, {written[ProductOutflow]} outflows, "
+                f"{written[DamagedProduct]} damaged and {written[ProductRequest]} "
+                f"requests in {clock.perf_counter() - started:.1f}s."
+            )
+        )
+
+    def popularity(self, size, skew):
+        """Return a function drawing ``count`` positions out of ``size``,
+        weighted 1 / rank ** ``skew`` over a shuffled ranking."""
+        ranking = list(range(size))
+        self.random.shuffle(ranking)
+        weights = list(accumulate(1 / (rank + 1) ** skew for rank in range(size)))
+
+        def pick(count):
+            return self.random.choices(ranking, cum_weights=weights, k=count)
+
+        return pick
+
+
+class LedgerWriter:
+    """Insert rows, given as tuples of COLUMNS[model], in batches: with COPY
+    on PostgreSQL and bulk_create elsewhere."""
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.copy = connection.vendor == "postgresql"
+        self.rows = defaultdict(list)
+        self.written = defaultdict(int)
+
+    def add(self, model, row):
+        rows = self.rows[model]
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            self.flush(model)
+
+    def flush(self, model=None):
+        for model in [model] if model else list(self.rows):
+            rows, self.rows[model] = self.rows[model], []
+            if not rows:
+                continue
+            if self.copy:
+                self.copy_rows(model, rows)
+            else:
+                self.create(model, rows)
+            self.written[model] += len(rows)
+
+    def copy_rows(self, model, rows):
+        buffer = io.StringIO()
+        # Empty unquoted fields are NULL.
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        columns = ", ".join(
+            model._meta.get_field(name).column for name in COLUMNS[model]
+        )
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY {model._meta.db_table} ({columns}) FROM STDIN WITH (FORMAT csv)",
+                buffer,
+            )
+
+    def create(self, model, rows):
+        columns = COLUMNS[model]
+        objects = model.objects.bulk_create(
+            model(**dict(zip(columns, row))) for row in rows
+        )
+        if model not in DATED:
+            return
+        # Rows of a batch get consecutive ids, in order.
+        for moment, group in groupby(zip(objects, rows), key=lambda pair: pair[1][-1]):
+            group = [instance.pk for instance, _ in group]
+            model.objects.filter(pk__gte=group[0], pk__lte=group[-1]).update(
+                **{columns[-1]: moment}
+            )
+
+
+def share(total, offset, days):
+    """The part of ``total`` that falls on day ``offset`` of ``days``."""
+    return total * (offset + 1) // days - total * offset // days
@@ -0,0 +1,110 @@
+import multiprocessing
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from apps.products.models import Product
+from apps.branches.models import Branch, BranchProduct
+from apps.suppliers.models import Supplier
+from apps.reports.models import ProductInflow, ProductOutflow
+from apps.reports.stock import InsufficientStock
+
+
+def run_worker(args):
+    product_id, branch_id, supplier_id, operations = args
+    received = sent = rejected = 0
+    try:
+        for i in range(operations):
+            if i % 3 == 2:
+                try:
+                    ProductOutflow.objects.create(
+                        product_id=product_id, branch_id=branch_id, quantity_sent=2
+                    )
+                    sent += 2
+                except InsufficientStock:
+                    rejected += 1
+            else:
+                ProductInflow.objects.create(
+                    product_id=product_id,
+                    supplier_id=supplier_id,
+                    quantity_received=1,
+                )
+                received += 1
+    finally:
+        connections.close_all()
+    return received, sent, rejected
+
+
+class Command(BaseCommand):
+    help = (
+        "Hammer one product with concurrent inflows and outflows from several "
+        "processes and check that no stock update was lost. Needs PostgreSQL."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=8)
+        parser.add_argument("--operations", type=int, default=300)
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError(
+                "The benchmark needs row-level locking; run it against PostgreSQL."
+            )
+
+        supplier = Supplier.objects.create(
+            name="Benchmark supplier",
+            contact_person="-",
+            phone_number="-",
+            email="benchmark@example.com",
+            location="-",
+        )
+        branch = Branch.objects.create(
+            name="Benchmark branch", location="-", contact_details="-"
+        )
+        product = Product.objects.create(
+            name="Benchmark product", price=1, quantity=0, opening_stock=0
+        )
+
+        try:
+            workers = options["workers"]
+            jobs = [
+                (product.pk, branch.pk, supplier.pk, options["operations"])
+                for _ in range(workers)
+            ]
+
+            # Each forked worker must open its own database connection.
+            connections.close_all()
+            started = time.perf_counter()
+            with multiprocessing.get_context("fork").Pool(workers) as pool:
+                results = pool.map(run_worker, jobs)
+            elapsed = time.perf_counter() - started
+
+            received = sum(result[0] for result in results)
+            sent = sum(result[1] for result in results)
+            rejected = sum(result[2] for result in results)
+
+            product.refresh_from_db()
+            branch_quantity = (
+                BranchProduct.objects.filter(branch=branch, product=product)
+                .values_list("quantity", flat=True)
+                .first()
+                or 0
+            )
+
+            operations = workers * options["operations"]
+            self.stdout.write(
+                f"{operations} movements from {workers} workers in {elapsed:.2f}s "
+                f"({operations / elapsed:.0f}/s), {rejected} rejected for "
+                "insufficient stock."
+            )
+            self.stdout.write(
+                f"Central stock {product.quantity} (expected {received - sent}), "
+                f"branch stock {branch_quantity} (expected {sent})."
+            )
+
+            if product.quantity != received - sent or branch_quantity != sent:
+                raise CommandError("Lost updates detected.")
+            self.stdout.write(self.style.SUCCESS("No lost updates."))
+        finally:
+            product.delete()
+            branch.delete()
+            supplier.delete()
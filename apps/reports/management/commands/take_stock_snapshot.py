@@ -0,0 +1,125 @@
+from collections import defaultdict
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max, Sum
+from django.utils import timezone
+from apps.products.models import Product
+from apps.branches.models import BranchProduct
+from apps.reports.models import StockMovement, StockSnapshot, StockSnapshotLine
+
+
+class Command(BaseCommand):
+    help = (
+        "Record a snapshot of every product's stock from the movement journal, "
+        "so point-in-time stock queries only replay the entries since."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--settle-seconds",
+            type=int,
+            default=300,
+            help="Only include movements older than this, so entries from "
+            "transactions still in flight are not skipped.",
+        )
+        parser.add_argument(
+            "--seed",
+            action="store_true",
+            help="First journal the difference between the live quantities and "
+            "the journal as opening movements. Run once when the journal is "
+            "introduced on an existing database.",
+        )
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if options["seed"]:
+            self.seed(batch_size)
+
+        cutoff = timezone.now() - timedelta(seconds=options["settle_seconds"])
+        previous = StockSnapshot.objects.first()
+        last_movement_id = StockMovement.objects.filter(
+            created_at__lte=cutoff
+        ).aggregate(last=Max("id"))["last"]
+
+        if last_movement_id is None or (
+            previous and last_movement_id <= previous.last_movement_id
+        ):
+            self.stdout.write("No new movements since the last snapshot.")
+            return
+
+        quantities = defaultdict(int)
+        movements = StockMovement.objects.filter(id__lte=last_movement_id)
+        if previous:
+            for branch_id, product_id, quantity in previous.lines.values_list(
+                "branch", "product", "quantity"
+            ).iterator(chunk_size=batch_size):
+                quantities[(branch_id, product_id)] = quantity
+            movements = movements.filter(id__gt=previous.last_movement_id)
+
+        for row in (
+            movements.values("branch", "product")
+            .annotate(change=Sum("quantity"))
+            .order_by()
+        ):
+            quantities[(row["branch"], row["product"])] += row["change"]
+
+        with transaction.atomic():
+            snapshot = StockSnapshot.objects.create(
+                taken_at=cutoff, last_movement_id=last_movement_id
+            )
+            StockSnapshotLine.objects.bulk_create(
+                (
+                    StockSnapshotLine(
+                        snapshot=snapshot,
+                        branch_id=branch_id,
+                        product_id=product_id,
+                        quantity=quantity,
+                    )
+                    for (branch_id, product_id), quantity in quantities.items()
+                    if quantity
+                ),
+                batch_size=batch_size,
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Snapshot at {cutoff:%Y-%m-%d %H:%M:%S} covers movements up to "
+                f"#{last_movement_id}."
+            )
+        )
+
+    def seed(self, batch_size):
+        journalled = defaultdict(int)
+        for row in (
+            StockMovement.objects.values("branch", "product")
+            .annotate(total=Sum("quantity"))
+            .order_by()
+        ):
+            journalled[(row["branch"], row["product"])] = row["total"]
+
+        live = [
+            ((None, product_id), quantity)
+            for product_id, quantity in Product.objects.values_list(
+                "id", "quantity"
+            ).iterator(chunk_size=batch_size)
+        ] + [
+            ((branch_id, product_id), quantity)
+            for branch_id, product_id, quantity in BranchProduct.objects.values_list(
+                "branch", "product", "quantity"
+            ).iterator(chunk_size=batch_size)
+        ]
+
+        openings = [
+            StockMovement(
+                branch_id=branch_id,
+                product_id=product_id,
+                kind="opening",
+                quantity=quantity - journalled[(branch_id, product_id)],
+            )
+            for (branch_id, product_id), quantity in live
+            if quantity != journalled[(branch_id, product_id)]
+        ]
+        StockMovement.objects.bulk_create(openings, batch_size=batch_size)
+        self.stdout.write(f"Journalled {len(openings)} opening movements.")
@@ -1,8 +1,11 @@
-from django.db import models
-from django.db.models import F
+from collections import defaultdict
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Count, Q, Sum
+from django.db.models.functions import Coalesce
 from apps.products.models import Product, DamagedProduct
 from apps.suppliers.models import Supplier
-from apps.branches.models import Branch, BranchProduct
+from apps.branches.models import Branch, BranchProduct, ProductRequest
+from . import stock
 
 
 class ProductInflow(models.Model):
@@ -19,6 +22,22 @@ class ProductInflow(models.Model):
 
     class Meta:
         ordering = ("-date_received",)
+        indexes = [
+            models.Index(
+                fields=["-date_received", "-id"], name="inflow_date_received_id_idx"
+            ),
+            # Expiry reports only ever look at rows that have an expiry date.
+            models.Index(
+                fields=["expiry_date"],
+                name="inflow_expiry_date_idx",
+                condition=models.Q(expiry_date__isnull=False),
+            ),
+            models.Index(
+                fields=["product", "expiry_date"],
+                name="inflow_product_expiry_idx",
+                condition=models.Q(expiry_date__isnull=False),
+            ),
+        ]
 
     def __str__(self):
         return (
@@ -26,10 +45,87 @@ class ProductInflow(models.Model):
         )
 
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            changes = {self.product_id: self.quantity_received}
+            lots = {(None, self.product_id, self.expiry_date): self.quantity_received}
+            if not self._state.adding:
+                # Re-saving applies only the difference to the previous
+                # movement, so stock sent on since does not get in the way.
+                previous = type(self).objects.select_for_update().get(pk=self.pk)
+                changes = stock.net(
+                    changes, {previous.product_id: -previous.quantity_received}
+                )
+                lots = stock.net(
+                    lots,
+                    {
+                        (
+                            None,
+                            previous.product_id,
+                            previous.expiry_date,
+                        ): -previous.quantity_received
+                    },
+                )
+                previous.revert_rollup()
+
+            stock.change_central_stock(changes, "inflow", lots)
+            super().save(*args, **kwargs)
+
+            DailyStockRollup.record(
+                self.date_received,
+                self.product,
+                supplier=self.supplier,
+                quantity_in=self.quantity_received,
+                value_in=self.quantity_received * self.product.price,
+            )
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            type(self).objects.select_for_update().get(pk=self.pk).revert_stock()
+            return super().delete(*args, **kwargs)
+
+    def revert_stock(self):
+        # Taken back from the lot it went to as far as that lot still holds it
+        stock.remove_central_stock(
+            {self.product_id: self.quantity_received},
+            "inflow",
+            prefer={self.product_id: self.expiry_date},
+        )
+        self.revert_rollup()
+
+    def revert_rollup(self):
+        DailyStockRollup.record(
+            self.date_received,
+            self.product,
+            supplier=self.supplier,
+            quantity_in=-self.quantity_received,
+            value_in=-self.quantity_received * self.product.price,
+        )
 
-        self.product.quantity = F("quantity") + self.quantity_received
-        self.product.save()
+    @classmethod
+    def bulk_receive(cls, inflows):
+        # Set-based counterpart of save() for whole deliveries: one INSERT for
+        # all lines and one UPDATE for the stock of every product involved.
+        received = defaultdict(int)
+        lots = defaultdict(int)
+        for inflow in inflows:
+            received[inflow.product_id] += inflow.quantity_received
+            lot = (None, inflow.product_id, inflow.expiry_date)
+            lots[lot] += inflow.quantity_received
+
+        with transaction.atomic():
+            stock.add_central_stock(received, "inflow", lots)
+            inflows = cls.objects.bulk_create(inflows)
+
+            rollups = defaultdict(lambda: {"quantity_in": 0, "value_in": 0})
+            for inflow in inflows:
+                rollup = rollups[
+                    (inflow.date_received, inflow.product_id, None, inflow.supplier_id)
+                ]
+                rollup["quantity_in"] += inflow.quantity_received
+                rollup["value_in"] += inflow.quantity_received * inflow.product.price
+            DailyStockRollup.record_many(rollups)
+
+        return inflows
 
 
 class ProductOutflow(models.Model):
@@ -45,24 +141,546 @@ class ProductOutflow(models.Model):
 
     class Meta:
         ordering = ("-date_sent",)
+        indexes = [
+            models.Index(fields=["-date_sent", "-id"], name="outflow_date_sent_id_idx"),
+            models.Index(
+                fields=["branch", "date_sent"], name="outflow_branch_date_idx"
+            ),
+        ]
 
     def __str__(self):
         return f"{self.quantity_sent} x {self.product.name} to {self.branch.name}"
 
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            changes = {(self.branch_id, self.product_id): self.quantity_sent}
+            if not self._state.adding:
+                # As for inflows, only the difference is moved.
+                previous = type(self).objects.select_for_update().get(pk=self.pk)
+                changes = stock.net(
+                    changes,
+                    {
+                        (
+                            previous.branch_id,
+                            previous.product_id,
+                        ): -previous.quantity_sent
+                    },
+                )
+                previous.revert_rollup()
+
+            # Move the stock from the central store to the branch, and back
+            returned = {key: -units for key, units in changes.items() if units < 0}
+            if returned:
+                stock.recall(returned)
+            sent = {key: units for key, units in changes.items() if units > 0}
+            lots = stock.dispatch(sent) if sent else {}
+            if self.expiry_date is None:
+                self.expiry_date = stock.soonest_expiry(
+                    lots, self.branch_id, self.product_id
+                )
+            super().save(*args, **kwargs)
+
+            DailyStockRollup.record(
+                self.date_sent,
+                self.product,
+                branch=self.branch,
+                quantity_out=self.quantity_sent,
+                value_out=self.quantity_sent * self.product.price,
+            )
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            type(self).objects.select_for_update().get(pk=self.pk).revert_stock()
+            return super().delete(*args, **kwargs)
 
-        # Update or create BranchProduct
-        branch_product, created = BranchProduct.objects.get_or_create(
+    def revert_stock(self):
+        stock.recall({(self.branch_id, self.product_id): self.quantity_sent})
+        self.revert_rollup()
+
+    def revert_rollup(self):
+        DailyStockRollup.record(
+            self.date_sent,
+            self.product,
             branch=self.branch,
-            product=self.product,
-            defaults={"quantity": self.quantity_sent},
+            quantity_out=-self.quantity_sent,
+            value_out=-self.quantity_sent * self.product.price,
         )
 
-        if not created:
-            branch_product.quantity = F("quantity") + self.quantity_sent
-            branch_product.save()
+    @classmethod
+    def bulk_dispatch(cls, outflows):
+        # Set-based counterpart of save() for replenishment orders: the
+        # central stock is decremented in one statement and the branch stock
+        # upserted in another, all inside a single transaction.
+        delivered = defaultdict(int)
+        for outflow in outflows:
+            delivered[(outflow.branch_id, outflow.product_id)] += outflow.quantity_sent
+
+        with transaction.atomic():
+            lots = stock.dispatch(delivered)
+            for outflow in outflows:
+                if outflow.expiry_date is None:
+                    outflow.expiry_date = stock.soonest_expiry(
+                        lots, outflow.branch_id, outflow.product_id
+                    )
+            outflows = cls.objects.bulk_create(outflows)
+
+            rollups = defaultdict(lambda: {"quantity_out": 0, "value_out": 0})
+            for outflow in outflows:
+                rollup = rollups[
+                    (outflow.date_sent, outflow.product_id, outflow.branch_id, None)
+                ]
+                rollup["quantity_out"] += outflow.quantity_sent
+                rollup["value_out"] += outflow.quantity_sent * outflow.product.price
+            DailyStockRollup.record_many(rollups)
+
+        return outflows
+
+
+class DailyStockRollup(models.Model):
+    day = models.DateField()
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="daily_rollups"
+    )
+    branch = models.ForeignKey(
+        Branch,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="daily_rollups",
+    )
+    supplier = models.ForeignKey(
+        Supplier,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="daily_rollups",
+    )
+    quantity_in = models.IntegerField(default=0)
+    quantity_out = models.IntegerField(default=0)
+    value_in = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    value_out = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    quantity_damaged = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ("-day",)
+        indexes = [models.Index(fields=["day"])]
+        constraints = [
+            # One bucket per day, product, branch and supplier; the nullable
+            # columns are coalesced so that NULLs count as equal.
+            models.UniqueConstraint(
+                F("day"),
+                F("product"),
+                Coalesce("branch", 0, output_field=models.IntegerField()),
+                Coalesce("supplier", 0, output_field=models.IntegerField()),
+                name="daily_rollup_bucket_unique",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.product.name} on {self.day}"
+
+    @classmethod
+    def record(cls, day, product, branch=None, supplier=None, **amounts):
+        # Increment the day's bucket in place, creating it on first movement.
+        cls.add(
+            (day, product.pk, branch and branch.pk, supplier and supplier.pk),
+            amounts,
+        )
+
+    @classmethod
+    def add(cls, key, amounts):
+        day, product_id, branch_id, supplier_id = key
+        bucket = cls.objects.filter(
+            day=day, product=product_id, branch=branch_id, supplier=supplier_id
+        )
+        increments = {field: F(field) + value for field, value in amounts.items()}
+        if bucket.update(**increments):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(
+                    day=day,
+                    product_id=product_id,
+                    branch_id=branch_id,
+                    supplier_id=supplier_id,
+                    **amounts,
+                )
+        except IntegrityError:
+            # A concurrent first write created the bucket in the meantime.
+            bucket.update(**increments)
+
+    @classmethod
+    def record_many(cls, rollups):
+        # Batched record() for the bulk ledger paths. ``rollups`` maps
+        # (day, product_id, branch_id, supplier_id) to the amounts to add.
+        # Existing buckets are locked, so concurrent record() calls queue
+        # behind this transaction instead of being overwritten.
+        fields = sorted({field for amounts in rollups.values() for field in amounts})
+        with transaction.atomic():
+            existing = {}
+            for rollup in (
+                cls.objects.select_for_update()
+                .filter(
+                    day__in={day for day, _, _, _ in rollups},
+                    product__in={product_id for _, product_id, _, _ in rollups},
+                )
+                .order_by("pk")
+            ):
+                existing.setdefault(
+                    (
+                        rollup.day,
+                        rollup.product_id,
+                        rollup.branch_id,
+                        rollup.supplier_id,
+                    ),
+                    rollup,
+                )
+
+            to_update, to_create = [], []
+            for key, amounts in rollups.items():
+                if key in existing:
+                    rollup = existing[key]
+                    for field, value in amounts.items():
+                        setattr(rollup, field, getattr(rollup, field) + value)
+                    to_update.append(rollup)
+                else:
+                    day, product_id, branch_id, supplier_id = key
+                    to_create.append(
+                        cls(
+                            day=day,
+                            product_id=product_id,
+                            branch_id=branch_id,
+                            supplier_id=supplier_id,
+                            **amounts,
+                        )
+                    )
+
+            cls.objects.bulk_update(to_update, fields, batch_size=1000)
+            try:
+                with transaction.atomic():
+                    cls.objects.bulk_create(to_create, batch_size=1000)
+            except IntegrityError:
+                # Some were created concurrently since they were read.
+                for rollup in to_create:
+                    key = (
+                        rollup.day,
+                        rollup.product_id,
+                        rollup.branch_id,
+                        rollup.supplier_id,
+                    )
+                    cls.add(key, rollups[key])
+
+
+class BranchInventorySummary(models.Model):
+    # Counters behind the branch dashboard overview. The writes that change
+    # them apply their difference in the same transaction, after lock() so
+    # that concurrent writers to a branch take turns; rows missing for a
+    # branch are computed from the source tables on first use.
+    branch = models.OneToOneField(
+        Branch,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="inventory_summary",
+    )
+    total_products = models.IntegerField(default=0)
+    active_products = models.IntegerField(default=0)
+    total_units = models.BigIntegerField(default=0)
+    pending_requests = models.IntegerField(default=0)
+    acknowledged_requests = models.IntegerField(default=0)
+    fulfilled_requests = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = "Branch inventory summaries"
+
+    def __str__(self):
+        return f"Inventory summary of {self.branch.name}"
+
+    @property
+    def total_requests(self):
+        return sum(
+            getattr(self, request_field(status))
+            for status, _ in ProductRequest.REQUEST_STATUS
+        )
+
+    @classmethod
+    def for_branch(cls, branch_id):
+        summary = cls.objects.filter(pk=branch_id).first()
+        if summary is None:
+            [summary] = cls.compute([branch_id])
+            cls.objects.bulk_create([summary], ignore_conflicts=True)
+        return summary
+
+    @classmethod
+    def lock(cls, branch_ids):
+        """Lock the summaries of ``branch_ids`` until the end of the current
+        transaction, creating the missing ones."""
+        branch_ids = sorted(set(branch_ids))
+        existing = set(
+            cls.objects.filter(pk__in=branch_ids).values_list("pk", flat=True)
+        )
+        missing = [branch_id for branch_id in branch_ids if branch_id not in existing]
+        if missing:
+            cls.objects.bulk_create(cls.compute(missing), ignore_conflicts=True)
+        return list(
+            cls.objects.select_for_update().filter(pk__in=branch_ids).order_by("pk")
+        )
+
+    @classmethod
+    def apply(cls, branch_id, **changes):
+        changes = {field: change for field, change in changes.items() if change}
+        if changes:
+            cls.objects.filter(pk=branch_id).update(
+                **{field: F(field) + change for field, change in changes.items()}
+            )
+
+    @classmethod
+    def compute(cls, branch_ids):
+        summaries = {branch_id: cls(branch_id=branch_id) for branch_id in branch_ids}
+        for row in (
+            BranchProduct.objects.filter(branch__in=branch_ids)
+            .values("branch")
+            .annotate(
+                total=Count("id"),
+                active=Count("id", filter=Q(status="active")),
+                units=Sum("quantity"),
+            )
+            .order_by()
+        ):
+            summary = summaries[row["branch"]]
+            summary.total_products = row["total"]
+            summary.active_products = row["active"]
+            summary.total_units = row["units"] or 0
+        for row in (
+            ProductRequest.objects.filter(branch__in=branch_ids)
+            .values("branch", "status")
+            .annotate(count=Count("id"))
+            .order_by()
+        ):
+            setattr(
+                summaries[row["branch"]], request_field(row["status"]), row["count"]
+            )
+        return list(summaries.values())
+
+
+def request_field(status):
+    return f"{status}_requests"
+
+
+class StockMovement(models.Model):
+    MOVEMENT_KINDS = [
+        ("opening", "Opening"),
+        ("inflow", "Inflow"),
+        ("outflow", "Outflow"),
+        ("damage", "Damage"),
+        ("adjustment", "Adjustment"),
+    ]
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="stock_movements"
+    )
+    # Null for the central store.
+    branch = models.ForeignKey(
+        Branch,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="stock_movements",
+    )
+    kind = models.CharField(max_length=20, choices=MOVEMENT_KINDS)
+    quantity = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ("-id",)
+        indexes = [models.Index(fields=["created_at"])]
+
+    def __str__(self):
+        return f"{self.quantity:+} x {self.product.name} ({self.kind})"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Stock movements are append-only.")
+        super().save(*args, **kwargs)
+
+
+class StockLot(models.Model):
+    # Units of a product held at the central store (branch null) or a branch
+    # that expire on the same date, or never when expiry_date is null. The
+    # stock service keeps them alongside the quantity counters: receipts add
+    # to a lot, removals take from the lots that expire first, and a lot is
+    # deleted once empty. Stock from before lots were kept is counted by
+    # Product.quantity and BranchProduct.quantity only, and is taken after
+    # every lot.
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="lots")
+    branch = models.ForeignKey(
+        Branch, on_delete=models.CASCADE, null=True, blank=True, related_name="lots"
+    )
+    expiry_date = models.DateField(null=True, blank=True)
+    quantity = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ("expiry_date", "id")
+        indexes = [
+            models.Index(
+                fields=["product", "branch", "expiry_date"], name="lot_product_idx"
+            ),
+            # Expiry reports: the dated lots of a store by expiry
+            models.Index(
+                fields=["branch", "expiry_date"],
+                name="lot_branch_expiry_idx",
+                condition=models.Q(expiry_date__isnull=False),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product.name} expiring {self.expiry_date}"
+
 
-        # Decrease quantity in central store
-        self.product.quantity = F("quantity") - self.quantity_sent
-        self.product.save()
+class StockSnapshot(models.Model):
+    # Quantities of every product at ``taken_at``: the journal up to and
+    # including ``last_movement_id``.
+    taken_at = models.DateTimeField()
+    last_movement_id = models.BigIntegerField()
+
+    class Meta:
+        ordering = ("-taken_at",)
+        indexes = [models.Index(fields=["taken_at"])]
+
+    def __str__(self):
+        return f"Stock snapshot at {self.taken_at}"
+
+    @classmethod
+    def quantities_as_of(cls, moment, central_only=False):
+        # Latest snapshot at or before ``moment`` plus the journal entries
+        # since, so the cost is bounded by the snapshot interval rather than
+        # the length of the history. Returns {(branch_id, product_id): qty}.
+        snapshot = cls.objects.filter(taken_at__lte=moment).first()
+
+        lines = StockSnapshotLine.objects.none()
+        movements = StockMovement.objects.filter(created_at__lte=moment)
+        if snapshot:
+            lines = snapshot.lines.all()
+            movements = movements.filter(id__gt=snapshot.last_movement_id)
+        if central_only:
+            lines = lines.filter(branch__isnull=True)
+            movements = movements.filter(branch__isnull=True)
+
+        quantities = defaultdict(int)
+        for branch_id, product_id, quantity in lines.values_list(
+            "branch", "product", "quantity"
+        ).iterator(chunk_size=5000):
+            quantities[(branch_id, product_id)] = quantity
+        for row in (
+            movements.values("branch", "product")
+            .annotate(change=models.Sum("quantity"))
+            .order_by()
+        ):
+            quantities[(row["branch"], row["product"])] += row["change"]
+        return quantities
+
+
+class StockSnapshotLine(models.Model):
+    snapshot = models.ForeignKey(
+        StockSnapshot, on_delete=models.CASCADE, related_name="lines"
+    )
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    branch = models.ForeignKey(
+        Branch, on_delete=models.CASCADE, null=True, blank=True, related_name="+"
+    )
+    quantity = models.IntegerField()
+
+    class Meta:
+        indexes = [models.Index(fields=["snapshot", "product"])]
+
+
+class ReorderSetting(models.Model):
+    # Overrides for the reorder engine, per product for the central store
+    # (no branch) or per product and branch. Empty fields fall back to the
+    # REORDER_* settings and the computed reorder point.
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="reorder_settings"
+    )
+    branch = models.ForeignKey(
+        Branch,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="reorder_settings",
+    )
+    reorder_point = models.PositiveIntegerField(null=True, blank=True)
+    lead_time_days = models.PositiveSmallIntegerField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["product", "branch"],
+                condition=Q(branch__isnull=False),
+                name="reorder_setting_branch_uniq",
+            ),
+            models.UniqueConstraint(
+                fields=["product"],
+                condition=Q(branch__isnull=True),
+                name="reorder_setting_central_uniq",
+            ),
+        ]
+
+    def __str__(self):
+        where = self.branch.name if self.branch else "central store"
+        return f"Reorder setting for {self.product.name} at {where}"
+
+
+class ReorderSuggestion(models.Model):
+    # Output of apps/reports/reorder.py, one row per product for the central
+    # store (no branch) and per product a branch stocks, was sent or
+    # requested. Rewritten by every refresh for the pairs it recomputes.
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="reorder_suggestions"
+    )
+    branch = models.ForeignKey(
+        Branch,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="reorder_suggestions",
+    )
+    on_hand = models.IntegerField()
+    # Open requests for a branch; nothing tracks purchase orders yet.
+    on_order = models.IntegerField(default=0)
+    daily_velocity = models.FloatField()
+    # Null when nothing moved in the velocity window.
+    days_of_cover = models.FloatField(null=True, blank=True)
+    reorder_point = models.IntegerField()
+    suggested_quantity = models.IntegerField()
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ("-suggested_quantity", "-id")
+        indexes = [
+            models.Index(
+                fields=["branch", "-suggested_quantity", "-id"],
+                name="reorder_branch_suggested_idx",
+            ),
+            models.Index(fields=["product", "branch"], name="reorder_product_idx"),
+        ]
+
+    def __str__(self):
+        where = self.branch.name if self.branch else "central store"
+        return f"Reorder {self.suggested_quantity} x {self.product.name} for {where}"
+
+
+class ReorderRun(models.Model):
+    # One row per refresh. The latest tells the next incremental refresh
+    # which inputs it has already seen.
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField()
+    window_start = models.DateField()
+    last_movement_id = models.BigIntegerField()
+    full = models.BooleanField(default=False)
+    suggestions = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ("-started_at",)
+
+    def __str__(self):
+        kind = "Full" if self.full else "Incremental"
+        return f"{kind} reorder refresh at {self.started_at}"
@@ -0,0 +1,81 @@
+import asyncio
+import contextvars
+import threading
+from asgiref.sync import sync_to_async
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import (
+    InterfaceError,
+    OperationalError,
+    close_old_connections,
+    connections,
+)
+
+# Runs a dashboard's independent, read-only queries at the same time on a
+# bounded pool of threads. Django connections are per thread, so each worker
+# uses its own and the number of extra connections per process is capped by
+# DASHBOARD_QUERY_WORKERS. No request cycle closes them, so each task does
+# what a request would: connections past CONN_MAX_AGE or left unusable are
+# closed before and after it runs. The queries
+# do not share a snapshot; a write committing meanwhile may show up in some
+# sections of a dashboard and not yet in others. Each task runs in a copy
+# of the caller's context, so context variables such as the request metrics
+# follow the queries into the pool. With no workers configured the queries
+# run one after another in the calling thread.
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def run(queries):
+    """Run ``queries``, a mapping of name to callable, and return a mapping of
+    name to result."""
+    pool = get_pool()
+    if pool is None:
+        return {name: query() for name, query in queries.items()}
+    futures = {
+        name: pool.submit(contextvars.copy_context().run, _call, query)
+        for name, query in queries.items()
+    }
+    return {name: future.result() for name, future in futures.items()}
+
+
+async def gather(queries):
+    """run() for async views: waits without blocking the event loop."""
+    pool = get_pool()
+    if pool is None:
+        return await sync_to_async(run)(queries)
+    loop = asyncio.get_running_loop()
+    results = await asyncio.gather(
+        *(
+            loop.run_in_executor(pool, contextvars.copy_context().run, _call, query)
+            for query in queries.values()
+        )
+    )
+    return dict(zip(queries, results))
+
+
+def get_pool():
+    global _pool
+    if not settings.DASHBOARD_QUERY_WORKERS:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                settings.DASHBOARD_QUERY_WORKERS, thread_name_prefix="dashboard-query"
+            )
+    return _pool
+
+
+def _call(query):
+    close_old_connections()
+    try:
+        return query()
+    except (InterfaceError, OperationalError):
+        # The connection this thread kept open may have been closed by the
+        # server in the meantime; the queries only read, so retry once on a
+        # fresh one.
+        connections.close_all()
+        return query()
+    finally:
+        close_old_connections()
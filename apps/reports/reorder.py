@@ -0,0 +1,334 @@
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from apps.products.models import Product
+from apps.branches.models import Branch, BranchProduct, ProductRequest
+from . import dashboard_cache
+from .models import (
+    DailyStockRollup,
+    ReorderRun,
+    ReorderSetting,
+    ReorderSuggestion,
+    StockMovement,
+)
+
+# Reorder suggestions for the central store and each branch. Velocity is
+# the units sent out per day over the last REORDER_VELOCITY_DAYS, read from
+# the daily rollup: what was dispatched to a branch for the branch, and what
+# was dispatched to any branch for the central store. A pair needs stock
+# once what it has on hand and on order falls to its reorder point, which is
+# velocity x (lead time + REORDER_SAFETY_DAYS) unless a ReorderSetting fixes
+# it, and is then topped up to REORDER_COVER_DAYS of cover past the lead
+# time.
+#
+# The database computes the suggestions in one INSERT ... SELECT over the
+# grouped inputs, so a full refresh is two statements whatever the number of
+# branches and products. An incremental refresh only revisits the pairs
+# whose inputs changed since the last run: stock movements, new requests,
+# edited settings and the days that left the velocity window.
+
+OPEN_REQUEST_STATUSES = ("pending", "acknowledged")
+
+# Past this many changed products in a store the whole store is recomputed,
+# rather than sending the ids to the database.
+MAX_LISTED_PRODUCTS = 2000
+
+# What the dashboards count as low stock while the suggestions are stale
+LOW_STOCK_QUANTITY = 10
+
+
+def refresh(full=False):
+    """Recompute reorder suggestions and return how many were written. Only
+    the pairs whose inputs changed since the last run are revisited, unless
+    ``full`` is set or there has been no run yet."""
+    started_at = timezone.now()
+    today = started_at.date()
+    window_start = today - timedelta(days=settings.REORDER_VELOCITY_DAYS)
+    # Movements after this id may or may not be seen by this run; the next
+    # one revisits them either way.
+    last_movement_id = StockMovement.objects.aggregate(last=Max("id"))["last"] or 0
+
+    with transaction.atomic():
+        # Runs take turns on the latest run row.
+        last_run = ReorderRun.objects.select_for_update().first()
+        full = full or last_run is None
+        if full:
+            stores = dict.fromkeys(Branch.objects.values_list("pk", flat=True))
+            written = refresh_all(today, window_start, started_at)
+        else:
+            stores = changed_since(last_run, window_start)
+            written = sum(
+                refresh_store(branch_id, product_ids, today, window_start, started_at)
+                for branch_id, product_ids in stores.items()
+            )
+
+        ReorderRun.objects.create(
+            started_at=started_at,
+            finished_at=timezone.now(),
+            window_start=window_start,
+            last_movement_id=last_movement_id,
+            full=full,
+            suggestions=written,
+        )
+        dashboard_cache.invalidate(
+            [branch_id for branch_id in stores if branch_id is not None]
+        )
+    return written
+
+
+def low_stock_count(branch_id):
+    """Return how many products the store, the central one when
+    ``branch_id`` is None, is low on. That is those the suggestions say need
+    stock if a refresh finished in the last REORDER_SUGGESTIONS_MAX_AGE
+    seconds, and otherwise those with at most LOW_STOCK_QUANTITY units."""
+    fresh_since = timezone.now() - timedelta(
+        seconds=settings.REORDER_SUGGESTIONS_MAX_AGE
+    )
+    if ReorderRun.objects.filter(finished_at__gte=fresh_since).exists():
+        return ReorderSuggestion.objects.filter(
+            branch=branch_id, suggested_quantity__gt=0
+        ).count()
+    if branch_id is None:
+        return Product.objects.filter(quantity__lte=LOW_STOCK_QUANTITY).count()
+    return BranchProduct.objects.filter(
+        branch=branch_id, quantity__lte=LOW_STOCK_QUANTITY
+    ).count()
+
+
+def changed_since(run, window_start):
+    """Return ``{branch id or None: product ids}`` of the pairs whose inputs
+    changed since ``run``; a None set stands for every product."""
+    stores = defaultdict(set)
+
+    def add(branch_id, product_id):
+        if product_id is None:
+            return
+        stores[branch_id].add(product_id)
+        # Anything sent to a branch also moves the central store's velocity.
+        stores[None].add(product_id)
+
+    for branch_id, product_id in (
+        StockMovement.objects.filter(id__gt=run.last_movement_id)
+        .values_list("branch", "product")
+        .distinct()
+    ):
+        add(branch_id, product_id)
+    for branch_id, product_id in (
+        ProductRequest.objects.filter(date_requested__gte=run.started_at)
+        .values_list("branch", "product")
+        .distinct()
+    ):
+        add(branch_id, product_id)
+    for branch_id, product_id in ReorderSetting.objects.filter(
+        updated_at__gte=run.started_at
+    ).values_list("branch", "product"):
+        add(branch_id, product_id)
+    for branch_id, product_id in (
+        DailyStockRollup.objects.filter(
+            day__gt=run.window_start, day__lte=window_start, branch__isnull=False
+        )
+        .values_list("branch", "product")
+        .distinct()
+    ):
+        add(branch_id, product_id)
+
+    return {
+        branch_id: product_ids if len(product_ids) <= MAX_LISTED_PRODUCTS else None
+        for branch_id, product_ids in stores.items()
+    }
+
+
+def refresh_store(branch_id, product_ids, today, window_start, computed_at):
+    """Rewrite the suggestions of one store, the central one when
+    ``branch_id`` is None, for ``product_ids`` or every product."""
+    suggestions = ReorderSuggestion.objects.filter(branch=branch_id)
+    if product_ids is not None:
+        suggestions = suggestions.filter(product__in=product_ids)
+    suggestions.delete()
+    if branch_id is None:
+        sql, params = central_sql(product_ids)
+    else:
+        sql, params = branch_sql([branch_id], product_ids)
+    return insert(sql, params, today, window_start, computed_at)
+
+
+def refresh_all(today, window_start, computed_at):
+    """Rewrite every store's suggestions."""
+    ReorderSuggestion.objects.all().delete()
+    return sum(
+        insert(sql, params, today, window_start, computed_at)
+        for sql, params in [central_sql(None), branch_sql(None, None)]
+    )
+
+
+# The statements are kept to SQL that PostgreSQL and SQLite both accept.
+
+INSERT_SQL = """
+INSERT INTO {suggestion} (
+    product_id, branch_id, on_hand, on_order, daily_velocity, days_of_cover,
+    reorder_point, suggested_quantity, computed_at
+)
+WITH {inputs},
+points AS (
+    SELECT inputs.*,
+        COALESCE(
+            fixed_point, CEILING(velocity * (lead_time + %(safety_days)s))
+        ) AS reorder_point
+    FROM inputs
+)
+SELECT product_id, branch_id, on_hand, on_order,
+    ROUND(CAST(velocity AS NUMERIC), 4),
+    CASE WHEN velocity > 0 THEN ROUND(CAST(on_hand / velocity AS NUMERIC), 1) END,
+    reorder_point,
+    -- Nothing above the reorder point; otherwise enough to last the cover
+    -- days past the lead time, and at least to clear the reorder point.
+    CASE
+        WHEN reorder_point <= 0 OR on_hand + on_order > reorder_point THEN 0
+        WHEN CEILING(velocity * (lead_time + %(cover_days)s)) > reorder_point
+            THEN CEILING(velocity * (lead_time + %(cover_days)s))
+                - on_hand - on_order
+        ELSE reorder_point + 1 - on_hand - on_order
+    END,
+    %(computed_at)s
+FROM points
+"""
+
+# Units sent to a branch over the window, per branch and product
+SENT_SQL = """
+sent AS (
+    SELECT branch_id, product_id, SUM(quantity_out) AS quantity
+    FROM {rollup}
+    WHERE day > %(window_start)s AND day <= %(today)s
+        AND branch_id IS NOT NULL {scope}
+    GROUP BY branch_id, product_id
+)"""
+
+BRANCH_INPUTS_SQL = SENT_SQL + """,
+stocked AS (
+    SELECT branch_id, product_id, quantity FROM {branch_product} WHERE {scope_only}
+),
+ordered AS (
+    SELECT branch_id, product_id, SUM(quantity) AS quantity
+    FROM {request}
+    WHERE status IN {open_statuses} AND product_id IS NOT NULL {scope}
+    GROUP BY branch_id, product_id
+),
+configured AS (
+    SELECT branch_id, product_id, reorder_point, lead_time_days
+    FROM {setting}
+    WHERE branch_id IS NOT NULL {scope}
+),
+pairs AS (
+    SELECT branch_id, product_id FROM stocked
+    UNION SELECT branch_id, product_id FROM sent
+    UNION SELECT branch_id, product_id FROM ordered
+    UNION SELECT branch_id, product_id FROM configured
+),
+inputs AS (
+    SELECT pairs.branch_id, pairs.product_id,
+        COALESCE(stocked.quantity, 0) AS on_hand,
+        COALESCE(ordered.quantity, 0) AS on_order,
+        CASE WHEN sent.quantity > 0 THEN sent.quantity ELSE 0 END
+            * 1.0 / %(window_days)s AS velocity,
+        COALESCE(configured.lead_time_days, %(lead_time_days)s) AS lead_time,
+        configured.reorder_point AS fixed_point
+    FROM pairs
+    LEFT JOIN stocked USING (branch_id, product_id)
+    LEFT JOIN sent USING (branch_id, product_id)
+    LEFT JOIN ordered USING (branch_id, product_id)
+    LEFT JOIN configured USING (branch_id, product_id)
+)"""
+
+# The central store's velocity is what it sent to every branch.
+CENTRAL_INPUTS_SQL = SENT_SQL + """,
+inputs AS (
+    SELECT CAST(NULL AS INTEGER) AS branch_id, product.id AS product_id,
+        product.quantity AS on_hand,
+        0 AS on_order,
+        CASE WHEN sent.quantity > 0 THEN sent.quantity ELSE 0 END
+            * 1.0 / %(window_days)s AS velocity,
+        COALESCE(configured.lead_time_days, %(lead_time_days)s) AS lead_time,
+        configured.reorder_point AS fixed_point
+    FROM {product} product
+    LEFT JOIN (
+        SELECT product_id, SUM(quantity) AS quantity FROM sent GROUP BY product_id
+    ) sent ON sent.product_id = product.id
+    LEFT JOIN {setting} configured
+        ON configured.product_id = product.id AND configured.branch_id IS NULL
+    WHERE {product_scope}
+)"""
+
+
+def branch_sql(branch_ids, product_ids):
+    """Return the statement and parameters for the branch stores, limited to
+    ``branch_ids`` and ``product_ids`` unless they are None."""
+    scope, params = [], {}
+    if branch_ids is not None:
+        scope.append(f"branch_id IN {in_list('branch', branch_ids, params)}")
+    if product_ids is not None:
+        scope.append(f"product_id IN {in_list('product', product_ids, params)}")
+    inputs = BRANCH_INPUTS_SQL.format(
+        scope="".join(f" AND {condition}" for condition in scope),
+        scope_only=" AND ".join(scope) or "1 = 1",
+        open_statuses=in_list("status", OPEN_REQUEST_STATUSES, params),
+        **tables(),
+    )
+    return INSERT_SQL.format(inputs=inputs, **tables()), params
+
+
+def central_sql(product_ids):
+    """Return the statement and parameters for the central store, limited to
+    ``product_ids`` unless it is None."""
+    scope, product_scope, params = "", "1 = 1", {}
+    if product_ids is not None:
+        products = in_list("product", product_ids, params)
+        scope = f" AND product_id IN {products}"
+        product_scope = f"product.id IN {products}"
+    inputs = CENTRAL_INPUTS_SQL.format(
+        scope=scope, product_scope=product_scope, **tables()
+    )
+    return INSERT_SQL.format(inputs=inputs, **tables()), params
+
+
+def in_list(name, values, params):
+    """Add ``values`` to ``params`` and return the placeholders for them."""
+    placeholders = []
+    for i, value in enumerate(values):
+        params[f"{name}_{i}"] = value
+        placeholders.append(f"%({name}_{i})s")
+    return f"({', '.join(placeholders)})"
+
+
+def insert(sql, params, today, window_start, computed_at):
+    connection = transaction.get_connection()
+    ops = connection.ops
+    params = {
+        **params,
+        "today": ops.adapt_datefield_value(today),
+        "window_start": ops.adapt_datefield_value(window_start),
+        "computed_at": ops.adapt_datetimefield_value(computed_at),
+        "window_days": settings.REORDER_VELOCITY_DAYS,
+        "lead_time_days": settings.REORDER_LEAD_TIME_DAYS,
+        "safety_days": settings.REORDER_SAFETY_DAYS,
+        "cover_days": settings.REORDER_COVER_DAYS,
+    }
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def tables():
+    return {
+        name: model._meta.db_table
+        for name, model in [
+            ("suggestion", ReorderSuggestion),
+            ("rollup", DailyStockRollup),
+            ("branch_product", BranchProduct),
+            ("request", ProductRequest),
+            ("setting", ReorderSetting),
+            ("product", Product),
+        ]
+    }
@@ -1,5 +1,9 @@
 from rest_framework import serializers
-from .models import ProductInflow, ProductOutflow
+from apps.products.models import Product
+from apps.branches.models import Branch
+from apps.suppliers.models import Supplier
+from .models import ProductInflow, ProductOutflow, ReorderSetting, ReorderSuggestion
+from . import stock
 
 
 class ProductInflowSerializer(serializers.ModelSerializer):
@@ -22,6 +26,64 @@ class ProductInflowSerializer(serializers.ModelSerializer):
         read_only_fields = ["id", "date_received"]
 
 
+class BulkLedgerListSerializer(serializers.ListSerializer):
+    def to_internal_value(self, data):
+        attrs = super().to_internal_value(data)
+
+        # Resolve every referenced object with one query per model instead
+        # of a lookup per line.
+        related_models = self.child.Meta.related_models
+        related = {
+            field: model.objects.in_bulk({line[field] for line in attrs})
+            for field, model in related_models.items()
+        }
+
+        errors = []
+        for line in attrs:
+            line_errors = {}
+            for field in related_models:
+                if line[field] not in related[field]:
+                    line_errors[field] = [
+                        f'Invalid pk "{line[field]}" - object does not exist.'
+                    ]
+            errors.append(line_errors)
+
+        if any(errors):
+            raise serializers.ValidationError(errors)
+
+        return [
+            {
+                **line,
+                **{field: related[field][line[field]] for field in related_models},
+            }
+            for line in attrs
+        ]
+
+
+class ProductInflowBulkListSerializer(BulkLedgerListSerializer):
+    def create(self, validated_data):
+        return ProductInflow.bulk_receive(
+            [ProductInflow(**line) for line in validated_data]
+        )
+
+
+class ProductInflowBulkSerializer(serializers.ModelSerializer):
+    product = serializers.IntegerField()
+    supplier = serializers.IntegerField()
+
+    class Meta:
+        model = ProductInflow
+        fields = [
+            "product",
+            "supplier",
+            "quantity_received",
+            "manufacturing_date",
+            "expiry_date",
+        ]
+        list_serializer_class = ProductInflowBulkListSerializer
+        related_models = {"product": Product, "supplier": Supplier}
+
+
 class ProductOutflowSerializer(serializers.ModelSerializer):
     product_name = serializers.CharField(source="product.name", read_only=True)
     branch_name = serializers.CharField(source="branch.name", read_only=True)
@@ -41,6 +103,38 @@ class ProductOutflowSerializer(serializers.ModelSerializer):
         read_only_fields = ["id", "date_sent"]
 
 
+class ProductOutflowBulkListSerializer(BulkLedgerListSerializer):
+    def create(self, validated_data):
+        try:
+            return ProductOutflow.bulk_dispatch(
+                [ProductOutflow(**line) for line in validated_data]
+            )
+        except stock.InsufficientStock as exc:
+            # Listed by line like the other errors, on every line of a
+            # product the central store is short of
+            raise serializers.ValidationError(
+                [
+                    (
+                        {"quantity_sent": [exc.products[line["product"].pk]]}
+                        if line["product"].pk in exc.products
+                        else {}
+                    )
+                    for line in validated_data
+                ]
+            )
+
+
+class ProductOutflowBulkSerializer(serializers.ModelSerializer):
+    product = serializers.IntegerField()
+    branch = serializers.IntegerField()
+
+    class Meta:
+        model = ProductOutflow
+        fields = ["product", "branch", "quantity_sent", "expiry_date"]
+        list_serializer_class = ProductOutflowBulkListSerializer
+        related_models = {"product": Product, "branch": Branch}
+
+
 class InwardQtyReportSerializer(serializers.Serializer):
     product__name = serializers.CharField()
     supplier__name = serializers.CharField()
@@ -129,8 +223,10 @@ class BranchExpiredProductReportSerializer(serializers.Serializer):
 class BranchOverviewSerializer(serializers.Serializer):
     total_products = serializers.IntegerField()
     active_products = serializers.IntegerField()
+    total_units = serializers.IntegerField()
     total_requests = serializers.IntegerField()
     pending_requests = serializers.IntegerField()
+    low_stock_products = serializers.IntegerField()
 
 
 class TopProductsSerializer(serializers.Serializer):
@@ -149,5 +245,41 @@ class ProductOutflowDashboardSerializer(serializers.Serializer):
 
 
 class BranchProductInventorySerializer(serializers.Serializer):
-    product__name = serializers.CharField()
+    product__name = serializers.CharField(source="product_name")
     quantity = serializers.IntegerField()
+
+
+class ReorderSuggestionSerializer(serializers.ModelSerializer):
+    product_name = serializers.CharField(source="product.name", read_only=True)
+    product_sku = serializers.CharField(source="product.sku", read_only=True)
+
+    class Meta:
+        model = ReorderSuggestion
+        fields = [
+            "id",
+            "product",
+            "product_name",
+            "product_sku",
+            "branch",
+            "on_hand",
+            "on_order",
+            "daily_velocity",
+            "days_of_cover",
+            "reorder_point",
+            "suggested_quantity",
+            "computed_at",
+        ]
+
+
+class ReorderSettingSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ReorderSetting
+        fields = [
+            "id",
+            "product",
+            "branch",
+            "reorder_point",
+            "lead_time_days",
+            "updated_at",
+        ]
+        read_only_fields = ["id", "updated_at"]
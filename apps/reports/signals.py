@@ -0,0 +1,105 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from apps.products.models import Product
+from apps.branches.models import Branch, BranchProduct, ProductRequest
+from . import dashboard_cache, events
+from .models import BranchInventorySummary, request_field
+
+# Stock movements expire the dashboards from the stock service; these cover
+# the remaining writes the dashboards read.
+
+
+@receiver([post_save, post_delete], sender=ProductRequest)
+@receiver([post_save, post_delete], sender=BranchProduct)
+def expire_branch_dashboard(sender, instance, **kwargs):
+    dashboard_cache.invalidate([instance.branch_id])
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Branch)
+def expire_dashboard(sender, instance, **kwargs):
+    dashboard_cache.invalidate()
+
+
+# Live events for the rows the stock service does not write. Stock changes
+# are published by the stock service itself.
+
+
+@receiver(post_save, sender=ProductRequest)
+@receiver(post_delete, sender=ProductRequest)
+def publish_request(sender, instance, created=False, **kwargs):
+    events.publish(
+        [
+            {
+                "type": "request",
+                "action": _action(created, kwargs["signal"]),
+                "branch": instance.branch_id,
+                "id": instance.pk,
+                "product": instance.product_id,
+                "quantity": instance.quantity,
+                "status": instance.status,
+            }
+        ]
+    )
+
+
+@receiver(post_save, sender=BranchProduct)
+@receiver(post_delete, sender=BranchProduct)
+def publish_branch_product(sender, instance, created=False, **kwargs):
+    events.publish(
+        [
+            {
+                "type": "branch_product",
+                "action": _action(created, kwargs["signal"]),
+                "branch": instance.branch_id,
+                "product": instance.product_id,
+                "quantity": instance.quantity,
+                "status": instance.status,
+            }
+        ]
+    )
+
+
+def _action(created, signal):
+    if signal is post_delete:
+        return "deleted"
+    return "created" if created else "updated"
+
+
+# Deletes, including cascades, take their rows out of the branch summary
+# before they go. Nothing needs doing when the branch itself is deleted.
+
+
+@receiver(pre_delete, sender=BranchProduct)
+def remove_branch_product(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Branch):
+        return
+    BranchInventorySummary.lock([instance.branch_id])
+    current = (
+        BranchProduct.objects.select_for_update()
+        .filter(pk=instance.pk)
+        .values("status", "quantity")
+        .first()
+    )
+    if current:
+        BranchInventorySummary.apply(
+            instance.branch_id,
+            total_products=-1,
+            active_products=-(current["status"] == "active"),
+            total_units=-current["quantity"],
+        )
+
+
+@receiver(pre_delete, sender=ProductRequest)
+def remove_product_request(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Branch):
+        return
+    BranchInventorySummary.lock([instance.branch_id])
+    current = (
+        ProductRequest.objects.select_for_update()
+        .filter(pk=instance.pk)
+        .values_list("status", flat=True)
+        .first()
+    )
+    if current:
+        BranchInventorySummary.apply(instance.branch_id, **{request_field(current): -1})
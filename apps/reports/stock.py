@@ -0,0 +1,527 @@
+from collections import defaultdict
+from datetime import date
+from django.db import transaction
+from django.db.models import (
+    F,
+    Q,
+    Case,
+    When,
+    Value,
+    IntegerField,
+    PositiveIntegerField,
+)
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from apps.products.models import Product
+from apps.branches.models import BranchProduct
+from . import dashboard_cache, events, models as ledger
+
+# Every change to Product.quantity or BranchProduct.quantity goes through
+# this module. Decrements are conditional UPDATEs (quantity >= n) so they
+# can never drive a counter negative, and multi-row changes lock their rows
+# in primary key order, central products before branch products, so two
+# batches touching the same rows cannot deadlock. Branch changes lock the
+# branches' inventory summaries in between, and keep them current. Each
+# change is also appended to the StockMovement journal under ``kind`` and
+# published to the live event streams.
+#
+# The counters are split into StockLot rows by expiry date. Stock is added
+# to the lots it arrived in, undated unless the caller says otherwise, and
+# removed from the lots that expire first (FEFO); a store's lots are only
+# touched while its counter row is locked. Lots are passed around as
+# ``{(branch id or None, product id, expiry date or None): units}``.
+
+
+class InsufficientStock(ValidationError):
+    default_code = "insufficient_stock"
+
+    def __init__(self, detail=None, code=None, products=None):
+        super().__init__(detail, code)
+        # Message of each short central product by id, for callers that
+        # point them at their own lines
+        self.products = products or {}
+
+
+def add_central_stock(quantities, kind, lots=None):
+    """Increase central stock; ``quantities`` maps product id to units and
+    ``lots`` says which lots they go to."""
+    with transaction.atomic():
+        if len(quantities) > 1:
+            _lock(Product.objects, quantities)
+        Product.objects.filter(pk__in=quantities).update(
+            quantity=F("quantity") + _by_pk(quantities)
+        )
+        changes = {(None, pk): quantity for pk, quantity in quantities.items()}
+        _add_lots(lots or _undated(changes))
+        _journal(kind, changes)
+
+
+def remove_central_stock(quantities, kind, prefer=None):
+    """Decrease central stock, failing if any product would go negative, and
+    return the lots taken from. ``prefer`` maps product id to the expiry date
+    of a lot to take from before the others."""
+    with transaction.atomic():
+        if len(quantities) == 1:
+            [(product_id, quantity)] = quantities.items()
+            updated = Product.objects.filter(
+                pk=product_id, quantity__gte=quantity
+            ).update(quantity=F("quantity") - quantity)
+            if not updated:
+                _raise_shortages(
+                    Product.objects.filter(pk=product_id), {product_id: quantity}
+                )
+        else:
+            products = _lock(Product.objects, quantities)
+            _raise_shortages(products, quantities)
+            Product.objects.filter(pk__in=quantities).update(
+                quantity=F("quantity") - _by_pk(quantities)
+            )
+        taken = _take_lots(
+            {(None, pk): quantity for pk, quantity in quantities.items()},
+            {(None, pk): expiry_date for pk, expiry_date in (prefer or {}).items()},
+        )
+        _journal(kind, {(None, pk): -quantity for pk, quantity in quantities.items()})
+    return taken
+
+
+def change_central_stock(changes, kind, lots=None):
+    """Apply signed changes to central stock in one conditional UPDATE,
+    failing if any product would go negative or does not exist, and return
+    the lots taken from. ``changes`` maps product id to units; ``lots`` maps
+    (None, product id, expiry date) to the signed change of each lot, units
+    taken preferably from the lot named."""
+    changes = {pk: change for pk, change in changes.items() if change}
+    with transaction.atomic():
+        if changes:
+            if len(changes) > 1:
+                _lock(Product.objects, changes)
+            removed = {pk: max(-change, 0) for pk, change in changes.items()}
+            updated = Product.objects.filter(
+                pk__in=changes, quantity__gte=_by_pk(removed)
+            ).update(quantity=F("quantity") + _by_pk(changes, IntegerField()))
+            if updated < len(changes):
+                _raise_shortages(Product.objects.filter(pk__in=changes), removed)
+
+        if lots is None:
+            lots = _undated({(None, pk): change for pk, change in changes.items()})
+            prefer = {}
+        else:
+            prefer = {
+                (branch_id, product_id): expiry_date
+                for (branch_id, product_id, expiry_date), units in lots.items()
+                if units < 0
+            }
+        taken = defaultdict(int)
+        for (branch_id, product_id, _), units in lots.items():
+            if units < 0:
+                taken[(branch_id, product_id)] -= units
+        # Taken before adding, so a lot is never refilled and emptied at once
+        taken = _take_lots(taken, prefer)
+        _add_lots({key: units for key, units in lots.items() if units > 0})
+        _journal(kind, {(None, pk): change for pk, change in changes.items()})
+    return taken
+
+
+def net(*changes):
+    """Add up dicts of signed changes, dropping the keys that cancel out."""
+    total = defaultdict(int)
+    for change in changes:
+        for key, units in change.items():
+            total[key] += units
+    return {key: units for key, units in total.items() if units}
+
+
+def add_branch_stock(quantities, kind, lots=None):
+    """Increase branch stock; ``quantities`` maps (branch id, product id) to
+    units and ``lots`` says which lots they go to. Missing BranchProduct rows
+    are created."""
+    with transaction.atomic():
+        _lock_summaries(quantities)
+        # Make sure every row exists first so it can be locked; a concurrent
+        # first delivery of the same pair then waits instead of colliding.
+        existing = set(
+            BranchProduct.objects.filter(
+                branch__in={branch_id for branch_id, _ in quantities},
+                product__in={product_id for _, product_id in quantities},
+            ).values_list("branch_id", "product_id")
+        )
+        created = [key for key in sorted(quantities) if key not in existing]
+        BranchProduct.objects.bulk_create(
+            [
+                BranchProduct(branch_id=branch_id, product_id=product_id, quantity=0)
+                for branch_id, product_id in created
+            ],
+            ignore_conflicts=True,
+        )
+
+        if len(quantities) == 1:
+            [((branch_id, product_id), quantity)] = quantities.items()
+            BranchProduct.objects.filter(
+                branch_id=branch_id, product_id=product_id
+            ).update(quantity=F("quantity") + quantity, last_updated=timezone.now())
+        else:
+            branch_products = _lock_branch_products(quantities)
+            now = timezone.now()
+            BranchProduct.objects.bulk_create(
+                [
+                    BranchProduct(
+                        branch_id=branch_product.branch_id,
+                        product_id=branch_product.product_id,
+                        quantity=branch_product.quantity
+                        + quantities[
+                            (branch_product.branch_id, branch_product.product_id)
+                        ],
+                        last_updated=now,
+                    )
+                    for branch_product in branch_products
+                ],
+                update_conflicts=True,
+                unique_fields=["branch", "product"],
+                update_fields=["quantity", "last_updated"],
+            )
+        _add_lots(lots or _undated(quantities))
+        _journal(kind, quantities)
+        _summarize(quantities, created)
+
+
+def remove_branch_stock(quantities, kind):
+    """Decrease branch stock, failing if any branch product would go
+    negative or does not exist, and return the lots taken from."""
+    with transaction.atomic():
+        _lock_summaries(quantities)
+        branch_products = _lock_branch_products(quantities)
+        found = {
+            (branch_product.branch_id, branch_product.product_id): branch_product
+            for branch_product in branch_products
+        }
+        shortages = [
+            _shortage_message(
+                found[key].product.name if key in found else f"product {key[1]}",
+                found[key].quantity if key in found else 0,
+                quantity,
+            )
+            for key, quantity in quantities.items()
+            if key not in found or found[key].quantity < quantity
+        ]
+        if shortages:
+            raise InsufficientStock(shortages)
+
+        now = timezone.now()
+        for branch_product in branch_products:
+            branch_product.quantity -= quantities[
+                (branch_product.branch_id, branch_product.product_id)
+            ]
+            branch_product.last_updated = now
+        BranchProduct.objects.bulk_update(
+            branch_products, ["quantity", "last_updated"], batch_size=1000
+        )
+        taken = _take_lots(quantities)
+        removed = {key: -quantity for key, quantity in quantities.items()}
+        _journal(kind, removed)
+        _summarize(removed)
+    return taken
+
+
+def set_branch_stock(branch_product, quantity):
+    """Overwrite a branch product's counted quantity and return the change
+    that was applied."""
+    with transaction.atomic():
+        ledger.BranchInventorySummary.lock([branch_product.branch_id])
+        current = (
+            BranchProduct.objects.select_for_update()
+            .values_list("quantity", flat=True)
+            .get(pk=branch_product.pk)
+        )
+        branch_product.quantity = quantity
+        branch_product.last_updated = timezone.now()
+        BranchProduct.objects.filter(pk=branch_product.pk).update(
+            quantity=quantity, last_updated=branch_product.last_updated
+        )
+        change = {
+            (branch_product.branch_id, branch_product.product_id): quantity - current
+        }
+        _adjust_lots(change)
+        _journal("adjustment", change)
+        _summarize(change)
+    return quantity - current
+
+
+def set_central_stock(product, quantity):
+    """Overwrite a product's counted central quantity and return the change
+    that was applied."""
+    with transaction.atomic():
+        current = (
+            Product.objects.select_for_update(no_key=True)
+            .values_list("quantity", flat=True)
+            .get(pk=product.pk)
+        )
+        product.quantity = quantity
+        Product.objects.filter(pk=product.pk).update(quantity=quantity)
+        change = {(None, product.pk): quantity - current}
+        _adjust_lots(change)
+        _journal("adjustment", change)
+    return quantity - current
+
+
+def record_opening(products):
+    """Journal the quantities products were created with, which do not go
+    through the functions above, as undated lots."""
+    opening = {(None, product.pk): product.quantity for product in products}
+    _add_lots(_undated(opening))
+    _journal("opening", opening)
+
+
+def dispatch(quantities):
+    """Move stock from the central store to branches, soonest expiry first,
+    and return the lots the branches received; ``quantities`` maps (branch
+    id, product id) to units."""
+    sent = {}
+    for (_, product_id), quantity in quantities.items():
+        sent[product_id] = sent.get(product_id, 0) + quantity
+
+    with transaction.atomic():
+        taken = remove_central_stock(sent, "outflow")
+        lots = _allocate(taken, quantities)
+        add_branch_stock(quantities, "outflow", lots)
+    return lots
+
+
+def recall(quantities):
+    """Reverse of dispatch(): move branch stock back to the central store."""
+    returned = {}
+    for (_, product_id), quantity in quantities.items():
+        returned[product_id] = returned.get(product_id, 0) + quantity
+
+    with transaction.atomic():
+        # Lock order must match dispatch(): central products first.
+        _lock(Product.objects, returned)
+        taken = remove_branch_stock(quantities, "outflow")
+        add_central_stock(
+            returned,
+            "outflow",
+            _allocate(
+                taken, {(None, pk): quantity for pk, quantity in returned.items()}
+            ),
+        )
+
+
+def soonest_expiry(lots, branch_id, product_id):
+    """Return the earliest expiry date among ``lots`` of one store and
+    product, or None if none of them expire."""
+    return min(
+        (
+            expiry_date
+            for (lot_branch_id, lot_product_id, expiry_date) in lots
+            if (lot_branch_id, lot_product_id) == (branch_id, product_id)
+            and expiry_date is not None
+        ),
+        default=None,
+    )
+
+
+def _journal(kind, quantities):
+    # ``quantities`` maps (branch id or None for the central store,
+    # product id) to the signed change.
+    movements = ledger.StockMovement.objects.bulk_create(
+        [
+            ledger.StockMovement(
+                product_id=product_id, branch_id=branch_id, kind=kind, quantity=quantity
+            )
+            for (branch_id, product_id), quantity in quantities.items()
+            if quantity
+        ],
+        batch_size=1000,
+    )
+    if movements:
+        dashboard_cache.invalidate(
+            {movement.branch_id for movement in movements if movement.branch_id}
+        )
+        events.publish(events.stock_events(kind, quantities))
+
+
+def _add_lots(lots):
+    lots = {key: units for key, units in lots.items() if units}
+    if not lots:
+        return
+    existing = {
+        (lot.branch_id, lot.product_id, lot.expiry_date): lot
+        for store_lots in _lots_of({key[:2] for key in lots}).values()
+        for lot in store_lots
+    }
+    changed, created = [], []
+    for (branch_id, product_id, expiry_date), units in lots.items():
+        lot = existing.get((branch_id, product_id, expiry_date))
+        if lot is None:
+            created.append(
+                ledger.StockLot(
+                    branch_id=branch_id,
+                    product_id=product_id,
+                    expiry_date=expiry_date,
+                    quantity=units,
+                )
+            )
+        else:
+            lot.quantity += units
+            changed.append(lot)
+    ledger.StockLot.objects.bulk_update(changed, ["quantity"], batch_size=1000)
+    ledger.StockLot.objects.bulk_create(created, batch_size=1000)
+
+
+def _take_lots(quantities, prefer=None):
+    # ``quantities`` maps (branch id or None, product id) to the units
+    # removed, and ``prefer`` to the expiry date of a lot to take from
+    # first. Units beyond the store's lots come from stock that predates
+    # them and are returned as undated.
+    if not quantities:
+        return {}
+    prefer = prefer or {}
+    lots = _lots_of(quantities)
+    taken = defaultdict(int)
+    changed = []
+    for key, quantity in quantities.items():
+        candidates = lots.get(key, [])
+        if key in prefer:
+            candidates = sorted(
+                candidates, key=lambda lot: lot.expiry_date != prefer[key]
+            )
+        for lot in candidates:
+            if not quantity:
+                break
+            units = min(quantity, lot.quantity)
+            lot.quantity -= units
+            quantity -= units
+            taken[(*key, lot.expiry_date)] += units
+            changed.append(lot)
+        if quantity:
+            taken[(*key, None)] += quantity
+    ledger.StockLot.objects.filter(
+        pk__in=[lot.pk for lot in changed if not lot.quantity]
+    ).delete()
+    ledger.StockLot.objects.bulk_update(
+        [lot for lot in changed if lot.quantity], ["quantity"], batch_size=1000
+    )
+    return dict(taken)
+
+
+def _adjust_lots(changes):
+    # A counted quantity above the books arrives undated; one below it is
+    # taken soonest expiry first, like any removal.
+    _add_lots(_undated({key: change for key, change in changes.items() if change > 0}))
+    _take_lots({key: -change for key, change in changes.items() if change < 0})
+
+
+def _lots_of(keys):
+    # The lots of each (branch id or None, product id) in ``keys``, soonest
+    # expiry first and undated last.
+    branch_ids = {branch_id for branch_id, _ in keys}
+    stores = Q(branch__in=branch_ids - {None})
+    if None in branch_ids:
+        stores |= Q(branch__isnull=True)
+    lots = defaultdict(list)
+    for lot in ledger.StockLot.objects.filter(
+        stores, product__in={product_id for _, product_id in keys}
+    ).order_by(F("expiry_date").asc(nulls_last=True), "id"):
+        if (lot.branch_id, lot.product_id) in keys:
+            lots[(lot.branch_id, lot.product_id)].append(lot)
+    return lots
+
+
+def _allocate(lots, quantities):
+    # Share ``lots`` taken from one store out among the (branch id or None,
+    # product id) pairs of ``quantities`` they are going to, keeping their
+    # expiry dates.
+    available = defaultdict(list)
+    for (_, product_id, expiry_date), units in sorted(
+        lots.items(), key=lambda item: (item[0][2] is None, item[0][2] or date.min)
+    ):
+        available[product_id].append([expiry_date, units])
+    allocated = defaultdict(int)
+    for (branch_id, product_id), quantity in quantities.items():
+        for lot in available[product_id]:
+            units = min(quantity, lot[1])
+            lot[1] -= units
+            quantity -= units
+            if units:
+                allocated[(branch_id, product_id, lot[0])] += units
+    return dict(allocated)
+
+
+def _undated(quantities):
+    return {
+        (branch_id, product_id, None): quantity
+        for (branch_id, product_id), quantity in quantities.items()
+    }
+
+
+def _lock_summaries(quantities):
+    ledger.BranchInventorySummary.lock({branch_id for branch_id, _ in quantities})
+
+
+def _summarize(quantities, created=()):
+    # ``created`` lists the (branch id, product id) pairs that got a new
+    # BranchProduct row.
+    changes = {}
+    for (branch_id, _), quantity in quantities.items():
+        change = changes.setdefault(branch_id, {"total_units": 0, "total_products": 0})
+        change["total_units"] += quantity
+    for branch_id, _ in created:
+        changes[branch_id]["total_products"] += 1
+    for branch_id, change in sorted(changes.items()):
+        ledger.BranchInventorySummary.apply(branch_id, **change)
+
+
+def _lock(queryset, pks):
+    # FOR NO KEY UPDATE: inserts that reference the locked products (a new
+    # request, a first delivery) only need a key share lock on them to check
+    # their foreign key, and must not queue behind a stock change.
+    return list(
+        queryset.select_for_update(no_key=True)
+        .filter(pk__in=sorted(pks))
+        .order_by("pk")
+    )
+
+
+def _lock_branch_products(quantities):
+    branch_products = (
+        BranchProduct.objects.select_for_update(of=("self",))
+        .select_related("product")
+        .filter(
+            branch__in={branch_id for branch_id, _ in quantities},
+            product__in={product_id for _, product_id in quantities},
+        )
+        .order_by("pk")
+    )
+    return [
+        branch_product
+        for branch_product in branch_products
+        if (branch_product.branch_id, branch_product.product_id) in quantities
+    ]
+
+
+def _by_pk(quantities, output_field=None):
+    return Case(
+        *[When(pk=pk, then=Value(quantity)) for pk, quantity in quantities.items()],
+        output_field=output_field or PositiveIntegerField(),
+    )
+
+
+def _raise_shortages(products, quantities):
+    found = {product.pk: product for product in products}
+    shortages = {
+        pk: (
+            _shortage_message(found[pk].name, found[pk].quantity, quantity)
+            if pk in found
+            else f"Product {pk} does not exist."
+        )
+        for pk, quantity in quantities.items()
+        if pk not in found or found[pk].quantity < quantity
+    }
+    if shortages:
+        raise InsufficientStock(list(shortages.values()), products=shortages)
+
+
+def _shortage_message(name, available, requested):
+    return (
+        f"Insufficient stock for {name}: "
+        f"{available} available, {requested} requested."
+    )
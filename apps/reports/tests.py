@@ -1,3 +1,1389 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import re
+import tempfile
+from datetime import timedelta
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.db.models import Sum
+from django.http import StreamingHttpResponse
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from apps.core import metrics
+from apps.core.tests.factories import (
+    create_admin,
+    create_branch,
+    create_manager,
+    create_product,
+    create_supplier,
+)
+from apps.users.authentication import users
+from apps.users.models import User
+from apps.products.models import Product, Category, Brand, DamagedProduct
+from apps.branches.models import BranchProduct, ProductRequest
+from .models import (
+    DailyStockRollup,
+    ProductInflow,
+    ProductOutflow,
+    BranchInventorySummary,
+    ReorderRun,
+    ReorderSetting,
+    ReorderSuggestion,
+    StockLot,
+    StockMovement,
+    StockSnapshot,
+)
+from . import dashboard_cache, events, parallel, reorder, stock
 
-# Create your tests here.
+
+class ReportQueryCountTests(TestCase):
+    # Query counts must not depend on the number of rows returned; each
+    # endpoint is exercised with several rows so a per-row lookup shows up.
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        cls.manager = create_manager()
+        cls.branch = create_branch(manager=cls.manager)
+        supplier = create_supplier()
+        category = Category.objects.create(name="Category")
+        brand = Brand.objects.create(name="Brand")
+        for i in range(5):
+            product = create_product(
+                name=f"Product {i}", sku=f"SKU-{i}", category=category, brand=brand
+            )
+            ProductInflow.objects.create(
+                product=product, supplier=supplier, quantity_received=10
+            )
+            ProductOutflow.objects.create(
+                product=product, branch=cls.branch, quantity_sent=5
+            )
+            ProductRequest.objects.create(
+                branch=cls.branch, product=product, quantity=5, status="fulfilled"
+            )
+
+    def setUp(self):
+        dashboard_cache.get_cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def assertQueries(self, url, count, user=None):
+        if user:
+            # Fresh from the database, as the authentication backend would load it.
+            self.client.force_authenticate(User.objects.get(pk=user.pk))
+        with self.assertNumQueries(count):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_inflow_list(self):
+        response = self.assertQueries(reverse("product_inflow-list"), 1)
+        self.assertEqual(len(response.data["results"]), 5)
+
+    def test_outflow_list(self):
+        response = self.assertQueries(reverse("product_outflow-list"), 1)
+        self.assertEqual(len(response.data["results"]), 5)
+
+    def test_daily_report(self):
+        response = self.assertQueries(reverse("daily-report"), 2)
+        self.assertEqual(len(response.data["inflows"]), 5)
+
+    def test_product_details_report(self):
+        response = self.assertQueries(reverse("product-details-report"), 1)
+        self.assertEqual(response.data[0]["total_inflow"], 10)
+        self.assertEqual(response.data[0]["total_outflow"], 5)
+
+    def test_branch_daily_report(self):
+        response = self.assertQueries(
+            reverse("branch-daily-report"), 2, user=self.manager
+        )
+        self.assertEqual(len(response.data["inflows"]), 5)
+
+    def test_branch_product_details_report(self):
+        self.assertQueries(
+            reverse("branch-product-details-report"), 2, user=self.manager
+        )
+
+    def test_dashboard(self):
+        self.assertQueries(reverse("dashboard"), 8)
+
+    def test_dashboard_top_products_are_per_product_and_period(self):
+        namesake = create_product(name="Product 0", sku="SKU-namesake", quantity=50)
+        ProductOutflow.objects.create(
+            product=namesake, branch=self.branch, quantity_sent=7
+        )
+        # Outside the period
+        DailyStockRollup.objects.create(
+            day=timezone.localdate() - timedelta(days=400),
+            product=namesake,
+            branch=self.branch,
+            quantity_out=1000,
+        )
+        top_products = self.client.get(reverse("dashboard")).data["top_products"]
+        self.assertEqual(top_products[0], {"name": "Product 0", "total_outflow": 7})
+        self.assertEqual(
+            [product["name"] for product in top_products].count("Product 0"), 2
+        )
+
+    def test_rollup_buckets_are_unique(self):
+        product = Product.objects.get(sku="SKU-0")
+        today = timezone.localdate()
+        DailyStockRollup.record(today, product, branch=self.branch, quantity_out=2)
+        self.assertEqual(
+            DailyStockRollup.objects.filter(
+                day=today, product=product, branch=self.branch
+            ).count(),
+            1,
+        )
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            DailyStockRollup.objects.create(day=today, product=product)
+            DailyStockRollup.objects.create(day=today, product=product)
+
+    def test_branch_dashboard(self):
+        response = self.assertQueries(reverse("branch-dashboard"), 7, user=self.manager)
+        self.assertEqual(
+            response.data["overview"],
+            {
+                "total_products": 5,
+                "active_products": 0,
+                "total_units": 25,
+                "total_requests": 5,
+                "pending_requests": 0,
+                # No reorder refresh has run: 5 units each is low.
+                "low_stock_products": 5,
+            },
+        )
+        self.assertEqual(len(response.data["inventory_levels"]), 5)
+        self.assertIsNone(response.data["inventory_levels_next"])
+
+    def test_branch_dashboard_ignores_the_page_asked_for(self):
+        # The first request builds the cached dashboard for the branch.
+        self.client.force_authenticate(self.manager)
+        response = self.client.get(reverse("branch-dashboard"), {"page_size": 1})
+        self.assertEqual(len(response.data["inventory_levels"]), 5)
+        response = self.client.get(reverse("branch-dashboard"))
+        self.assertEqual(len(response.data["inventory_levels"]), 5)
+        self.assertIsNone(response.data["inventory_levels_next"])
+
+    def test_branch_dashboard_links_the_next_page_relatively(self):
+        self.client.force_authenticate(self.manager)
+        with mock.patch(
+            "apps.reports.views.BranchInventoryLevelPagination.page_size", 3
+        ):
+            response = self.client.get(reverse("branch-dashboard"))
+        next_link = response.data["inventory_levels_next"]
+        self.assertTrue(next_link.startswith(reverse("branch-inventory-levels")))
+        names = [row["product__name"] for row in response.data["inventory_levels"]]
+        response = self.client.get(next_link)
+        names += [row["product__name"] for row in response.data["results"]]
+        self.assertEqual(names, [f"Product {i}" for i in range(5)])
+
+    def test_branch_inventory_levels(self):
+        self.client.force_authenticate(User.objects.get(pk=self.manager.pk))
+        response = self.client.get(reverse("branch-inventory-levels"), {"page_size": 3})
+        names = [row["product__name"] for row in response.data["results"]]
+        response = self.client.get(response.data["next"])
+        names += [row["product__name"] for row in response.data["results"]]
+        self.assertEqual(names, [f"Product {i}" for i in range(5)])
+
+
+class BulkInflowTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        cls.supplier = create_supplier()
+        cls.apple = create_product(name="Apple", quantity=0)
+        cls.pear = create_product(name="Pear", price=4, quantity=0)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.expiry = timezone.localdate() + timedelta(days=30)
+
+    def post(self, lines):
+        return self.client.post(reverse("product_inflow-bulk"), lines, format="json")
+
+    def line(self, product, quantity, **fields):
+        return {
+            "product": product.pk,
+            "supplier": self.supplier.pk,
+            "quantity_received": quantity,
+            **fields,
+        }
+
+    def test_receives_every_line(self):
+        response = self.post(
+            [
+                self.line(self.apple, 10, expiry_date=self.expiry.isoformat()),
+                self.line(self.apple, 5),
+                self.line(self.pear, 7),
+            ]
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            [(row["product"], row["quantity_received"]) for row in response.data],
+            [(self.apple.pk, 10), (self.apple.pk, 5), (self.pear.pk, 7)],
+        )
+        self.assertEqual(ProductInflow.objects.count(), 3)
+        self.assertEqual(
+            dict(Product.objects.values_list("name", "quantity")),
+            {"Apple": 15, "Pear": 7},
+        )
+
+    def test_rollups_journal_and_lots(self):
+        self.post(
+            [
+                self.line(self.apple, 10, expiry_date=self.expiry.isoformat()),
+                self.line(self.apple, 5),
+                self.line(self.pear, 7),
+            ]
+        )
+        rollups = DailyStockRollup.objects.filter(
+            day=timezone.localdate(), branch=None, supplier=self.supplier
+        )
+        self.assertEqual(
+            {
+                rollup.product_id: (rollup.quantity_in, rollup.value_in)
+                for rollup in rollups
+            },
+            {self.apple.pk: (15, 150), self.pear.pk: (7, 28)},
+        )
+        self.assertEqual(
+            dict(
+                StockMovement.objects.filter(kind="inflow", branch=None)
+                .values("product")
+                .annotate(total=Sum("quantity"))
+                .values_list("product", "total")
+            ),
+            {self.apple.pk: 15, self.pear.pk: 7},
+        )
+        self.assertEqual(
+            dict(
+                StockLot.objects.filter(product=self.apple, branch=None).values_list(
+                    "expiry_date", "quantity"
+                )
+            ),
+            {self.expiry: 10, None: 5},
+        )
+
+    def test_invalid_line_rejects_the_whole_batch(self):
+        for lines, field in [
+            (
+                [self.line(self.apple, 10), {**self.line(self.pear, 5), "product": 0}],
+                "product",
+            ),
+            (
+                [self.line(self.apple, 10), self.line(self.pear, -1)],
+                "quantity_received",
+            ),
+        ]:
+            response = self.post(lines)
+            self.assertEqual(response.status_code, 400)
+            # Errors are listed by line, empty for the valid ones.
+            self.assertEqual(response.data[0], {})
+            self.assertIn(field, response.data[1])
+        self.assertFalse(ProductInflow.objects.exists())
+        self.assertFalse(StockMovement.objects.filter(kind="inflow").exists())
+        self.assertEqual(Product.objects.get(pk=self.apple.pk).quantity, 0)
+
+    def test_failed_write_rolls_back_the_batch(self):
+        with mock.patch.object(
+            DailyStockRollup, "record_many", side_effect=IntegrityError
+        ):
+            with self.assertRaises(IntegrityError):
+                ProductInflow.bulk_receive(
+                    [
+                        ProductInflow(
+                            product=self.apple,
+                            supplier=self.supplier,
+                            quantity_received=10,
+                        )
+                    ]
+                )
+        self.assertFalse(ProductInflow.objects.exists())
+        self.assertFalse(StockLot.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.apple.pk).quantity, 0)
+
+    def test_lines_are_capped(self):
+        response = self.post([self.line(self.apple, 1)] * 1001)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ProductInflow.objects.exists())
+        self.assertEqual(self.post([]).status_code, 400)
+
+
+class BulkOutflowTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        cls.branch = create_branch()
+        cls.other_branch = create_branch("Other")
+        cls.apple = create_product(name="Apple", quantity=100)
+        cls.pear = create_product(name="Pear", price=4, quantity=50)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def post(self, lines):
+        return self.client.post(reverse("product_outflow-bulk"), lines, format="json")
+
+    def line(self, branch, product, quantity):
+        return {"branch": branch.pk, "product": product.pk, "quantity_sent": quantity}
+
+    def branch_stock(self):
+        return {
+            (branch_product.branch_id, branch_product.product_id): (
+                branch_product.quantity
+            )
+            for branch_product in BranchProduct.objects.all()
+        }
+
+    def test_dispatches_every_line(self):
+        BranchProduct.objects.create(branch=self.branch, product=self.apple, quantity=4)
+        response = self.post(
+            [
+                self.line(self.branch, self.apple, 10),
+                self.line(self.branch, self.apple, 5),
+                self.line(self.branch, self.pear, 7),
+                self.line(self.other_branch, self.apple, 3),
+            ]
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data), 4)
+        self.assertEqual(
+            dict(Product.objects.values_list("name", "quantity")),
+            {"Apple": 82, "Pear": 43},
+        )
+        # Added to the branch stock already there, or created
+        self.assertEqual(
+            self.branch_stock(),
+            {
+                (self.branch.pk, self.apple.pk): 19,
+                (self.branch.pk, self.pear.pk): 7,
+                (self.other_branch.pk, self.apple.pk): 3,
+            },
+        )
+        self.assertEqual(
+            dict(
+                DailyStockRollup.objects.filter(
+                    day=timezone.localdate(), branch=self.branch
+                ).values_list("product", "quantity_out")
+            ),
+            {self.apple.pk: 15, self.pear.pk: 7},
+        )
+
+    def test_insufficient_stock_names_the_lines(self):
+        response = self.post(
+            [
+                self.line(self.branch, self.apple, 10),
+                self.line(self.branch, self.pear, 30),
+                self.line(self.other_branch, self.pear, 30),
+            ]
+        )
+        self.assertEqual(response.status_code, 400)
+        message = "Insufficient stock for Pear: 50 available, 60 requested."
+        self.assertEqual(
+            response.data,
+            [{}, {"quantity_sent": [message]}, {"quantity_sent": [message]}],
+        )
+        self.assertFalse(ProductOutflow.objects.exists())
+        self.assertEqual(self.branch_stock(), {})
+        self.assertEqual(Product.objects.get(pk=self.apple.pk).quantity, 100)
+
+    def test_lines_are_capped(self):
+        response = self.post([self.line(self.branch, self.apple, 1)] * 25001)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ProductOutflow.objects.exists())
+
+
+class AsyncDashboardTests(TransactionTestCase):
+    # Not a TestCase: the query threads use connections of their own, which
+    # only see committed rows.
+    def setUp(self):
+        dashboard_cache.get_cache().clear()
+        self.admin = create_admin()
+        self.manager = create_manager()
+        branch = create_branch(manager=self.manager)
+        for i in range(3):
+            product = create_product(name=f"Product {i}", quantity=5 + i)
+            ProductOutflow.objects.create(
+                product=product, branch=branch, quantity_sent=i + 1
+            )
+        ProductRequest.objects.create(branch=branch, product=product, quantity=1)
+        self.client = APIClient()
+
+    def get(self, name, user, **params):
+        dashboard_cache.get_cache().clear()
+        self.client.force_authenticate(User.objects.get(pk=user.pk))
+        response = self.client.get(reverse(name), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_async_dashboards_match_sync(self):
+        for workers in (0, 3):
+            with self.subTest(workers=workers), override_settings(
+                DASHBOARD_QUERY_WORKERS=workers
+            ):
+                self.assertEqual(
+                    self.get("dashboard-async", self.admin, period="monthly"),
+                    self.get("dashboard", self.admin, period="monthly"),
+                )
+                self.assertEqual(
+                    self.get("branch-dashboard-async", self.manager),
+                    self.get("branch-dashboard", self.manager),
+                )
+
+    @override_settings(DASHBOARD_QUERY_WORKERS=1)
+    def test_query_threads_close_connections_like_requests(self):
+        # SQLite never closes an in-memory database, so only the calls are
+        # checked.
+        with mock.patch.object(parallel, "close_old_connections") as close:
+            results = parallel.run({"products": Product.objects.count})
+        self.assertEqual(results, {"products": 3})
+        self.assertEqual(close.call_count, 2)
+
+    @override_settings(DASHBOARD_QUERY_WORKERS=3)
+    def test_pool_queries_are_charged_to_the_request(self):
+        self.client.force_authenticate(self.admin)
+        counts = []
+        for name in ("dashboard", "dashboard-async"):
+            dashboard_cache.get_cache().clear()
+            response = self.client.get(reverse(name), {"period": "monthly"})
+            timing = re.search(r'desc="(\d+) queries"', response["Server-Timing"])
+            counts.append(int(timing.group(1)))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_benchmark_counts_queries_of_query_threads(self):
+        queries = {}
+        for name in ("dashboard", "dashboard-async"):
+            dashboard_cache.get_cache().clear()
+            with tempfile.NamedTemporaryFile("r", suffix=".json") as output:
+                call_command(
+                    "benchmark_endpoints",
+                    name,
+                    requests=1,
+                    warmup=0,
+                    output=output.name,
+                    stdout=io.StringIO(),
+                )
+                run = json.load(output)
+            queries[name] = run["endpoints"][f"{name} (admin, period=monthly)"][
+                "queries"
+            ]
+        self.assertEqual(queries["dashboard-async"], queries["dashboard"])
+
+    async def test_async_dashboards_are_served_over_asgi(self):
+        # As the Procfile serves them, through config.asgi's handler
+        for name, user, params in (
+            ("dashboard-async", self.admin, {"period": "monthly"}),
+            ("branch-dashboard-async", self.manager, {}),
+        ):
+            token = await sync_to_async(AccessToken.for_user)(user)
+            response = await self.async_client.get(
+                reverse(name), params, headers={"Authorization": f"Bearer {token}"}
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                response.json(),
+                await sync_to_async(self.get)(
+                    name.removesuffix("-async"), user, **params
+                ),
+            )
+
+    def test_async_dashboard_checks_request(self):
+        response = self.client.get(reverse("dashboard-async"))
+        self.assertEqual(response.status_code, 401)
+        self.client.force_authenticate(self.admin)
+        response = self.client.get(reverse("dashboard-async"), {"period": "weekly"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"error": "Invalid period specified"})
+
+
+class DashboardCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        cls.manager = create_manager()
+        cls.branch = create_branch(manager=cls.manager)
+        cls.other_branch = create_branch("Other")
+        cls.product = create_product()
+
+    def setUp(self):
+        dashboard_cache.get_cache().clear()
+        self.client = APIClient()
+
+    def get(self, name, user):
+        self.client.force_authenticate(User.objects.get(pk=user.pk))
+        response = self.client.get(reverse(name))
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_repeat_requests_are_served_from_cache(self):
+        first = self.get("dashboard", self.admin)
+        with self.assertNumQueries(0):
+            second = self.client.get(reverse("dashboard"))
+        self.assertEqual(first["X-Cache"], "MISS")
+        self.assertEqual(second["X-Cache"], "HIT")
+        self.assertEqual(first.data, second.data)
+
+    def test_outflow_expires_admin_and_own_branch_dashboard(self):
+        self.get("dashboard", self.admin)
+        self.get("branch-dashboard", self.manager)
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductOutflow.objects.create(
+                product=self.product, branch=self.branch, quantity_sent=5
+            )
+
+        response = self.get("dashboard", self.admin)
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.data["total_outflow"], 5)
+        self.assertEqual(self.get("branch-dashboard", self.manager)["X-Cache"], "MISS")
+
+    def test_other_branch_writes_keep_branch_dashboard(self):
+        self.get("branch-dashboard", self.manager)
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductRequest.objects.create(
+                branch=self.other_branch, product=self.product, quantity=1
+            )
+        self.assertEqual(self.get("branch-dashboard", self.manager)["X-Cache"], "HIT")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductRequest.objects.create(
+                branch=self.branch, product=self.product, quantity=1
+            )
+        response = self.get("branch-dashboard", self.manager)
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.data["overview"]["total_requests"], 1)
+
+    def test_per_process_cache_keeps_entries_briefly(self):
+        self.assertEqual(dashboard_cache.timeout(), 5)
+        with override_settings(
+            CACHES={
+                "default": {
+                    "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                    "LOCATION": tempfile.gettempdir(),
+                }
+            }
+        ):
+            self.assertEqual(dashboard_cache.timeout(), 300)
+
+    def test_stats(self):
+        self.get("dashboard", self.admin)
+        self.get("dashboard", self.admin)
+        response = self.get("dashboard-cache-stats", self.admin)
+        self.assertEqual(
+            response.data["dashboard"], {"hits": 1, "misses": 1, "hit_ratio": 0.5}
+        )
+
+
+class BranchInventorySummaryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.branch = create_branch()
+        cls.products = [create_product(name=f"Product {i}") for i in range(3)]
+
+    def assertSummaryCurrent(self):
+        summary = BranchInventorySummary.objects.get(pk=self.branch.pk)
+        [expected] = BranchInventorySummary.compute([self.branch.pk])
+        for field in BranchInventorySummary._meta.concrete_fields:
+            self.assertEqual(
+                getattr(summary, field.attname),
+                getattr(expected, field.attname),
+                field.name,
+            )
+        return summary
+
+    def test_writes_keep_summary_current(self):
+        first, second, third = self.products
+        ProductOutflow.objects.create(
+            product=first, branch=self.branch, quantity_sent=5
+        )
+        ProductOutflow.bulk_dispatch(
+            [
+                ProductOutflow(product=first, branch=self.branch, quantity_sent=2),
+                ProductOutflow(product=second, branch=self.branch, quantity_sent=3),
+            ]
+        )
+        outflow = ProductOutflow.objects.create(
+            product=third, branch=self.branch, quantity_sent=4
+        )
+        summary = self.assertSummaryCurrent()
+        self.assertEqual((summary.total_products, summary.total_units), (3, 14))
+
+        branch_product = BranchProduct.objects.get(product=first)
+        branch_product.status = "active"
+        branch_product.save()
+        outflow.delete()
+        request = ProductRequest.objects.create(
+            branch=self.branch, product=first, quantity=1
+        )
+        ProductRequest.objects.create(branch=self.branch, product=second, quantity=1)
+        request.status = "fulfilled"
+        request.save()
+        summary = self.assertSummaryCurrent()
+        self.assertEqual(summary.active_products, 1)
+        self.assertEqual(summary.pending_requests, 1)
+
+        branch_product.delete()
+        ProductRequest.objects.filter(product=second).delete()
+        self.assertSummaryCurrent()
+
+
+class EventStreamTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        cls.manager = create_manager()
+        cls.branch = create_branch(manager=cls.manager)
+        cls.other_branch = create_branch("Other")
+        cls.product = create_product()
+
+    def setUp(self):
+        # Ids are reused between test cases, whose writes never commit and
+        # so never expire the cached users.
+        users.clear()
+
+    async def open_stream(self, user, **params):
+        ticket = events.issue_ticket(user)
+        response = await self.async_client.get(
+            reverse("events"), {"ticket": ticket, **params}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b"retry: 3000\n\n")
+        return stream
+
+    async def next_event(self, stream):
+        chunk = await asyncio.wait_for(anext(stream), 1)
+        name, data = chunk.decode().strip().split("\n")
+        return name.removeprefix("event: "), json.loads(data.removeprefix("data: "))
+
+    @sync_to_async
+    def commit(self, write):
+        with self.captureOnCommitCallbacks(execute=True):
+            write()
+
+    async def test_branch_stream_sees_only_its_branch(self):
+        branch_stream = await self.open_stream(self.manager)
+        admin_stream = await self.open_stream(self.admin)
+
+        await self.commit(
+            lambda: stock.dispatch(
+                {
+                    (self.other_branch.pk, self.product.pk): 2,
+                    (self.branch.pk, self.product.pk): 3,
+                }
+            )
+        )
+        await self.commit(
+            lambda: ProductRequest.objects.create(
+                branch=self.branch, product=self.product, quantity=1
+            )
+        )
+
+        self.assertEqual(
+            await self.next_event(branch_stream),
+            (
+                "stock",
+                {
+                    "type": "stock",
+                    "kind": "outflow",
+                    "branch": self.branch.pk,
+                    "changes": [{"product": self.product.pk, "quantity": 3}],
+                },
+            ),
+        )
+        name, event = await self.next_event(branch_stream)
+        self.assertEqual(
+            (name, event["action"], event["status"]), ("request", "created", "pending")
+        )
+
+        # The admin stream also sees the central store and the other branch.
+        received = [await self.next_event(admin_stream) for _ in range(4)]
+        self.assertEqual(
+            sorted((event["type"], event["branch"] or 0) for _, event in received),
+            sorted(
+                [
+                    ("stock", 0),
+                    ("stock", self.branch.pk),
+                    ("stock", self.other_branch.pk),
+                    ("request", self.branch.pk),
+                ]
+            ),
+        )
+
+    async def test_rolled_back_writes_are_not_published(self):
+        stream = await self.open_stream(self.admin, branch=self.branch.pk)
+
+        def fail():
+            stock.remove_branch_stock({(self.branch.pk, self.product.pk): 1}, "outflow")
+
+        with self.assertRaises(stock.InsufficientStock):
+            await self.commit(fail)
+        with self.assertRaises(asyncio.TimeoutError):
+            await self.next_event(stream)
+
+    async def test_requires_valid_token(self):
+        response = await self.async_client.get(reverse("events"))
+        self.assertEqual(response.status_code, 401)
+        response = await self.async_client.get(reverse("events"), {"ticket": "x"})
+        self.assertEqual(response.status_code, 401)
+        # Access tokens are not accepted in the URL.
+        token = str(AccessToken.for_user(self.admin))
+        response = await self.async_client.get(reverse("events"), {"token": token})
+        self.assertEqual(response.status_code, 401)
+
+    async def test_tickets_are_issued_for_access_tokens_and_expire(self):
+        token = str(AccessToken.for_user(self.manager))
+        response = await self.async_client.post(
+            reverse("events-ticket"), headers={"Authorization": f"Bearer {token}"}
+        )
+        self.assertEqual(response.status_code, 201)
+        ticket = response.json()["ticket"]
+        self.assertEqual(events.ticket_user_id(ticket), self.manager.pk)
+        with override_settings(STOCK_EVENTS_TICKET_MAX_AGE=-1):
+            self.assertIsNone(events.ticket_user_id(ticket))
+
+
+@override_settings(
+    REORDER_VELOCITY_DAYS=10,
+    REORDER_LEAD_TIME_DAYS=2,
+    REORDER_SAFETY_DAYS=1,
+    REORDER_COVER_DAYS=5,
+)
+class ReorderTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = create_manager()
+        cls.branch = create_branch(manager=cls.manager)
+        cls.fast, cls.slow = [create_product(name=name) for name in ("Fast", "Slow")]
+        # 50 units in the window is 5 a day
+        ProductOutflow.objects.create(
+            product=cls.fast, branch=cls.branch, quantity_sent=50
+        )
+        ProductOutflow.objects.create(
+            product=cls.slow, branch=cls.branch, quantity_sent=1
+        )
+
+    def suggestion(self, product, branch=None):
+        return ReorderSuggestion.objects.get(product=product, branch=branch)
+
+    def test_refresh(self):
+        self.assertEqual(reorder.refresh(), 4)
+
+        # The branch holds 50 of the fast product and sells 5 a day: 10 days
+        # of cover, above the reorder point of 5 x (2 + 1).
+        fast = self.suggestion(self.fast, self.branch)
+        self.assertEqual(
+            (fast.on_hand, fast.daily_velocity, fast.days_of_cover),
+            (50, 5.0, 10.0),
+        )
+        self.assertEqual((fast.reorder_point, fast.suggested_quantity), (15, 0))
+        # Central has 50 left too; ship out 40 more and it drops below.
+        central = self.suggestion(self.fast)
+        self.assertEqual((central.on_hand, central.suggested_quantity), (50, 0))
+
+        ProductOutflow.objects.create(
+            product=self.fast, branch=self.branch, quantity_sent=40
+        )
+        # Only the changed product is revisited.
+        self.assertEqual(reorder.refresh(), 2)
+        central = self.suggestion(self.fast)
+        # 9 a day now: reorder point 27, top up to 9 x (2 + 5) = 63.
+        self.assertEqual(
+            (central.on_hand, central.reorder_point, central.suggested_quantity),
+            (10, 27, 53),
+        )
+
+    def test_settings_override_reorder_point(self):
+        ReorderSetting.objects.create(
+            product=self.slow, branch=self.branch, reorder_point=5
+        )
+        reorder.refresh()
+        slow = self.suggestion(self.slow, self.branch)
+        self.assertEqual((slow.on_hand, slow.reorder_point), (1, 5))
+        self.assertEqual(slow.suggested_quantity, 5)
+
+    def test_low_stock_falls_back_to_quantities(self):
+        ReorderSetting.objects.create(product=self.fast, reorder_point=60)
+        # No refresh yet: the branch's single unit of Slow is low.
+        self.assertEqual(reorder.low_stock_count(None), 0)
+        self.assertEqual(reorder.low_stock_count(self.branch.pk), 1)
+
+        reorder.refresh()
+        self.assertEqual(reorder.low_stock_count(None), 1)
+        self.assertEqual(
+            reorder.low_stock_count(self.branch.pk),
+            ReorderSuggestion.objects.filter(
+                branch=self.branch, suggested_quantity__gt=0
+            ).count(),
+        )
+
+        ReorderRun.objects.update(finished_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(reorder.low_stock_count(None), 0)
+
+    def test_requests_from_suggestions(self):
+        ReorderSetting.objects.create(
+            product=self.slow, branch=self.branch, reorder_point=5
+        )
+        reorder.refresh()
+        client = APIClient()
+        client.force_authenticate(self.manager)
+
+        response = client.get(
+            reverse("reorder_suggestions-list"), {"needs_reorder": "true"}
+        )
+        self.assertEqual(
+            [row["product_name"] for row in response.data["results"]], ["Slow"]
+        )
+
+        response = client.post(reverse("product_requests-from-suggestions"))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            [(row["product"], row["quantity"]) for row in response.data],
+            [(self.slow.pk, 5)],
+        )
+        # Requested stock counts as on order.
+        reorder.refresh(full=True)
+        slow = self.suggestion(self.slow, self.branch)
+        self.assertEqual((slow.on_order, slow.suggested_quantity), (5, 0))
+        response = client.post(reverse("product_requests-from-suggestions"))
+        self.assertEqual(response.data, [])
+
+
+class StockLotTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        cls.manager = create_manager()
+        cls.branch = create_branch(manager=cls.manager)
+        cls.supplier = create_supplier()
+        cls.product = create_product(name="Milk", quantity=0)
+        today = timezone.localdate()
+        cls.expired, cls.fresh = today - timedelta(days=5), today + timedelta(days=30)
+        cls.inflows = {
+            expiry_date: ProductInflow.objects.create(
+                product=cls.product,
+                supplier=cls.supplier,
+                quantity_received=10,
+                expiry_date=expiry_date,
+            )
+            for expiry_date in (cls.fresh, None, cls.expired)
+        }
+
+    def lots(self, branch=None):
+        return dict(
+            StockLot.objects.filter(product=self.product, branch=branch).values_list(
+                "expiry_date", "quantity"
+            )
+        )
+
+    def test_outflow_takes_soonest_expiry_first(self):
+        self.assertEqual(self.lots(), {self.expired: 10, self.fresh: 10, None: 10})
+        outflow = ProductOutflow.objects.create(
+            product=self.product, branch=self.branch, quantity_sent=15
+        )
+        self.assertEqual(self.lots(), {self.fresh: 5, None: 10})
+        self.assertEqual(self.lots(self.branch), {self.expired: 10, self.fresh: 5})
+        self.assertEqual(outflow.expiry_date, self.expired)
+
+        # Only what is still held past its expiry date is reported.
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        response = client.get(reverse("expired-product-report"))
+        self.assertEqual(response.data, [])
+        client.force_authenticate(self.manager)
+        response = client.get(reverse("branch-expired-product-report"))
+        self.assertEqual(
+            response.data,
+            [
+                {
+                    "product_name": "Milk",
+                    "expiry_date": self.expired.isoformat(),
+                    "quantity": 10,
+                }
+            ],
+        )
+
+        # Recalling the stock brings its lots back to the central store.
+        outflow.delete()
+        self.assertEqual(self.lots(), {self.expired: 10, self.fresh: 10, None: 10})
+        self.assertEqual(self.lots(self.branch), {})
+
+    def test_damage_and_corrections(self):
+        DamagedProduct.objects.create(product=self.product, quantity=4, reason="-")
+        self.assertEqual(self.lots(), {self.expired: 6, self.fresh: 10, None: 10})
+
+        # A deleted receipt is taken back out of its own lot.
+        self.inflows[self.fresh].delete()
+        self.assertEqual(self.lots(), {self.expired: 6, None: 10})
+
+        # A count below the books is taken soonest expiry first, one above
+        # them arrives undated.
+        stock.set_central_stock(self.product, 10)
+        self.assertEqual(self.lots(), {None: 10})
+        stock.set_central_stock(self.product, 12)
+        self.assertEqual(self.lots(), {None: 12})
+
+    def test_undoing_damage_restores_its_lot(self):
+        damage = DamagedProduct.objects.create(
+            product=self.product, quantity=4, reason="-"
+        )
+        self.assertEqual(damage.expiry_date, self.expired)
+        damage.delete()
+        self.assertEqual(self.lots(), {self.expired: 10, self.fresh: 10, None: 10})
+
+        # A report that names its lot is written off from that one.
+        damage = DamagedProduct.objects.create(
+            product=self.product, quantity=3, reason="-", expiry_date=self.fresh
+        )
+        self.assertEqual(self.lots(), {self.expired: 10, self.fresh: 7, None: 10})
+        damage.quantity = 1
+        damage.save()
+        self.assertEqual(self.lots(), {self.expired: 10, self.fresh: 9, None: 10})
+
+    def test_dashboard_counts_expired_stock_in_branches(self):
+        ProductOutflow.objects.create(
+            product=self.product, branch=self.branch, quantity_sent=4
+        )
+        dashboard_cache.get_cache().clear()
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        response = client.get(reverse("dashboard"), {"period": "daily"})
+        self.assertEqual(
+            response.data["expired_products"],
+            [{"product__name": "Milk", "total_expired": 10}],
+        )
+
+    def test_edits_apply_only_the_difference(self):
+        ProductOutflow.objects.create(
+            product=self.product, branch=self.branch, quantity_sent=30
+        )
+        inflow = self.inflows[self.fresh]
+        inflow.quantity_received = 12
+        inflow.save()
+        self.assertEqual(self.lots(), {self.fresh: 2})
+        with self.assertRaises(stock.InsufficientStock):
+            inflow.quantity_received = 1
+            inflow.save()
+
+        damage = DamagedProduct.objects.create(
+            product=self.product, quantity=2, reason="-"
+        )
+        damage.quantity = 1
+        damage.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 1)
+
+        outflow = ProductOutflow.objects.create(
+            product=self.product, branch=self.branch, quantity_sent=1
+        )
+        outflow.quantity_sent = 0
+        outflow.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 1)
+        self.assertEqual(
+            BranchProduct.objects.get(
+                branch=self.branch, product=self.product
+            ).quantity,
+            30,
+        )
+
+    def test_missing_product_is_refused(self):
+        with self.assertRaises(stock.InsufficientStock):
+            stock.remove_central_stock({0: 1}, "damage")
+        with self.assertRaises(stock.InsufficientStock):
+            stock.change_central_stock({0: -1, self.product.pk: 1}, "damage")
+
+
+class ReportExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        cls.manager = create_manager()
+        cls.branch = create_branch(manager=cls.manager)
+        other_branch = create_branch("Other")
+        supplier = create_supplier()
+        for i in range(3):
+            product = create_product(name=f"Product, {i}", sku=f"SKU-{i}", quantity=0)
+            ProductInflow.objects.create(
+                product=product,
+                supplier=supplier,
+                quantity_received=10 * (i + 1),
+                expiry_date=timezone.localdate() + timedelta(days=i),
+            )
+            ProductOutflow.objects.create(
+                product=product, branch=cls.branch, quantity_sent=2
+            )
+            ProductOutflow.objects.create(
+                product=product, branch=other_branch, quantity_sent=1
+            )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def export(self, name, export_format, **params):
+        response = self.client.get(reverse(name), {"format": export_format, **params})
+        self.assertEqual(response.status_code, 200)
+        # Streamed, not rendered
+        self.assertIsInstance(response, StreamingHttpResponse)
+        self.assertRegex(
+            response["Content-Disposition"],
+            rf'^attachment; filename=".+\.{export_format}"$',
+        )
+        return b"".join(response.streaming_content).decode()
+
+    def test_csv(self):
+        content = self.export("inward-qty-report", "csv")
+        rows = list(csv.reader(io.StringIO(content)))
+        self.assertEqual(
+            rows[0],
+            ["product__name", "supplier__name", "expiry_date", "total_quantity"],
+        )
+        expected = self.client.get(reverse("inward-qty-report")).data
+        self.assertEqual(
+            rows[1:],
+            [[str(value) for value in row.values()] for row in expected],
+        )
+        self.assertEqual(rows[1][0], "Product, 2")
+
+    def test_ndjson(self):
+        response = self.client.get(reverse("outward-qty-report"), {"format": "ndjson"})
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [
+            json.loads(line)
+            for line in b"".join(response.streaming_content).decode().splitlines()
+        ]
+        expected = self.client.get(reverse("outward-qty-report")).data
+        self.assertEqual(rows, json.loads(json.dumps(expected)))
+        self.assertEqual(len(rows), 6)
+
+    def test_filters_apply_to_exports(self):
+        self.client.force_authenticate(User.objects.get(pk=self.manager.pk))
+        rows = list(
+            csv.DictReader(
+                io.StringIO(self.export("branch-product-details-report", "csv"))
+            )
+        )
+        # Only the manager's branch, which was sent 2 of each
+        self.assertEqual([row["quantity"] for row in rows], ["2", "2", "2"])
+
+        self.client.force_authenticate(self.admin)
+        # Stock as of yesterday, before any of it arrived
+        as_of = (timezone.localdate() - timedelta(days=1)).isoformat()
+        rows = [
+            json.loads(line)
+            for line in self.export(
+                "product-details-report", "ndjson", as_of=as_of
+            ).splitlines()
+        ]
+        self.assertEqual([row["closing_stock"] for row in rows], [0, 0, 0])
+        expected = self.client.get(
+            reverse("product-details-report"), {"as_of": as_of}
+        ).data
+        self.assertEqual(rows, json.loads(json.dumps(expected)))
+
+
+class StockJournalTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        cls.branch = create_branch()
+        cls.supplier = create_supplier()
+        cls.milk = create_product(name="Milk", sku="MLK-1", quantity=20)
+
+    def journal(self):
+        return list(
+            StockMovement.objects.order_by("id").values_list(
+                "kind", "branch", "quantity"
+            )
+        )
+
+    def live(self):
+        quantities = {(None, self.milk.pk): Product.objects.get().quantity}
+        for branch_product in BranchProduct.objects.all():
+            quantities[(branch_product.branch_id, branch_product.product_id)] = (
+                branch_product.quantity
+            )
+        return quantities
+
+    def replayed(self, moment=None):
+        quantities = StockSnapshot.quantities_as_of(moment or timezone.now())
+        return {key: quantity for key, quantity in quantities.items() if quantity}
+
+    def receive_and_send(self):
+        inflow = ProductInflow.objects.create(
+            product=self.milk, supplier=self.supplier, quantity_received=10
+        )
+        outflow = ProductOutflow.objects.create(
+            product=self.milk, branch=self.branch, quantity_sent=4
+        )
+        return inflow, outflow
+
+    def test_every_stock_change_is_journaled(self):
+        inflow, outflow = self.receive_and_send()
+        inflow.quantity_received = 12
+        inflow.save()
+        outflow.delete()
+        branch = self.branch.pk
+        self.assertEqual(
+            self.journal(),
+            [
+                ("opening", None, 20),
+                ("inflow", None, 10),
+                ("outflow", None, -4),
+                ("outflow", branch, 4),
+                # Edits journal the difference, deletes the reversal.
+                ("inflow", None, 2),
+                ("outflow", branch, -4),
+                ("outflow", None, 4),
+            ],
+        )
+        with self.assertRaises(ValueError):
+            StockMovement.objects.first().save()
+
+    def test_quantities_as_of_replay_the_journal_since_the_snapshot(self):
+        self.receive_and_send()
+        call_command("take_stock_snapshot", settle_seconds=0, stdout=io.StringIO())
+        snapshot = StockSnapshot.objects.get()
+        self.assertEqual(
+            {
+                (line.branch_id, line.product_id): line.quantity
+                for line in snapshot.lines.all()
+            },
+            self.live(),
+        )
+        ProductOutflow.objects.create(
+            product=self.milk, branch=self.branch, quantity_sent=6
+        )
+        self.assertEqual(self.replayed(), self.live())
+        # The same as replaying the whole journal
+        snapshot.delete()
+        self.assertEqual(self.replayed(), self.live())
+
+    def test_quantities_as_of_an_earlier_moment(self):
+        self.receive_and_send()
+        yesterday = timezone.now() - timedelta(days=1)
+        StockMovement.objects.update(created_at=yesterday)
+        before = self.live()
+        ProductOutflow.objects.create(
+            product=self.milk, branch=self.branch, quantity_sent=6
+        )
+        self.assertEqual(self.replayed(yesterday), before)
+        self.assertEqual(self.replayed(yesterday - timedelta(seconds=1)), {})
+
+    def test_snapshot_skips_unsettled_and_repeated_runs(self):
+        output = io.StringIO()
+        call_command("take_stock_snapshot", stdout=output)
+        self.assertIn("No new movements", output.getvalue())
+        call_command("take_stock_snapshot", settle_seconds=0, stdout=output)
+        call_command("take_stock_snapshot", settle_seconds=0, stdout=output)
+        self.assertEqual(StockSnapshot.objects.count(), 1)
+
+    def test_product_details_as_of(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.receive_and_send()
+        yesterday = timezone.localdate() - timedelta(days=1)
+        StockMovement.objects.update(created_at=timezone.now() - timedelta(days=1))
+        ProductInflow.objects.update(date_received=yesterday)
+        ProductOutflow.objects.update(date_sent=yesterday)
+        ProductInflow.objects.create(
+            product=self.milk, supplier=self.supplier, quantity_received=5
+        )
+        url = reverse("product-details-report")
+        response = self.client.get(url, {"as_of": yesterday.isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data,
+            [
+                {
+                    "name": "Milk",
+                    "sku": "MLK-1",
+                    "total_inflow": 10,
+                    "total_outflow": 4,
+                    "closing_stock": 26,
+                }
+            ],
+        )
+        response = self.client.get(url)
+        self.assertEqual(
+            (response.data[0]["total_inflow"], response.data[0]["closing_stock"]),
+            (15, 31),
+        )
+        response = self.client.get(url, {"as_of": "yesterday"})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(METRICS_TOKEN="secret")
+class MetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        create_product(name="Milk", quantity=5)
+
+    def setUp(self):
+        metrics.registry.clear()
+        metrics.get_cache().delete(metrics.SLOTS_KEY)
+        dashboard_cache.get_cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_requests_are_timed_and_counted(self):
+        response = self.client.get(reverse("products-list"))
+        self.assertRegex(
+            response["Server-Timing"], r'^db;dur=[\d.]+;desc="\d+ queries", total;dur='
+        )
+
+        body = self.client.get(
+            reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret"
+        ).content.decode()
+        self.assertIn(
+            'http_requests_total{route="products-list",method="GET",status="200"} 1',
+            body,
+        )
+        self.assertIn(
+            'http_request_duration_seconds_count{route="products-list",method="GET"} 1',
+            body,
+        )
+        queries = re.search(
+            r'db_queries_total\{route="products-list",method="GET"\} (\d+)', body
+        )
+        self.assertGreater(int(queries.group(1)), 0)
+
+    def scrape(self):
+        return self.client.get(
+            reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret"
+        ).content.decode()
+
+    def test_streamed_responses_are_recorded_once_sent(self):
+        route = 'route="inward-qty-report",method="GET"'
+        response = self.client.get(reverse("inward-qty-report"), {"format": "csv"})
+        self.assertNotIn(route, self.scrape())
+        body = b"".join(response.streaming_content)
+        scraped = self.scrape()
+        self.assertIn(f"http_response_bytes_total{{{route}}} {len(body)}", scraped)
+        queries = re.search(rf"db_queries_total\{{{route}\}} (\d+)", scraped)
+        self.assertGreater(int(queries.group(1)), 0)
+
+    def test_processes_publish_to_slots_of_their_own(self):
+        stats = metrics.RequestStats()
+
+        def serve(registry):
+            registry.observe("route", "GET", 200, 0.01, stats, 10)
+
+        first, second = metrics.Registry(0), metrics.Registry(0)
+        serve(first)
+        serve(second)
+        self.assertNotEqual(first.slot, second.slot)
+        # The first process' slot expires while it is idle and is claimed by
+        # a new one; the first then publishes to another.
+        expired = first.slot
+        metrics.get_cache().delete(f"metrics:process:{expired}")
+        third = metrics.Registry(0)
+        serve(third)
+        self.assertEqual(third.slot, expired)
+        serve(first)
+        self.assertNotIn(first.slot, (second.slot, third.slot))
+        self.assertEqual(metrics.registry.collect()["route", "GET", 200][0], 4)
+        # Whatever slot the scraping process last held
+        metrics.registry.slot = third.slot
+        self.assertEqual(metrics.registry.collect()["route", "GET", 200][0], 4)
+
+    def test_slow_requests_are_logged_with_their_queries(self):
+        with override_settings(METRICS_SLOW_REQUEST_MS=0), self.assertLogs(
+            "apps.core.metrics", "WARNING"
+        ) as logs:
+            self.client.get(reverse("products-list"))
+        record = logs.records[0].metrics
+        self.assertEqual(record["route"], "products-list")
+        self.assertTrue(record["slowest"])
+        self.assertIn("SELECT", record["slowest"][0]["sql"])
+
+    def test_token_is_required(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 401)
+        response = self.client.get(
+            reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret"
+        )
+        self.assertEqual(response.status_code, 200)
+        with override_settings(METRICS_TOKEN=""):
+            response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer ")
+            self.assertEqual(response.status_code, 403)
+
+
+class SeedAndBenchmarkTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            "seed_stock_dataset",
+            products=30,
+            branches=3,
+            suppliers=2,
+            inflows=300,
+            outflows=300,
+            damaged=20,
+            requests=50,
+            days=30,
+            today=timezone.localdate(),
+            stdout=io.StringIO(),
+        )
+
+    def test_stock_reconciles_with_the_ledger(self):
+        for product in Product.objects.all():
+            inflows = ProductInflow.objects.filter(product=product).aggregate(
+                total=Sum("quantity_received")
+            )
+            outflows = ProductOutflow.objects.filter(product=product).aggregate(
+                total=Sum("quantity_sent")
+            )
+            damaged = DamagedProduct.objects.filter(product=product).aggregate(
+                total=Sum("quantity")
+            )
+            self.assertEqual(
+                product.quantity,
+                product.opening_stock
+                + (inflows["total"] or 0)
+                - (outflows["total"] or 0)
+                - (damaged["total"] or 0),
+            )
+        delivered = ProductOutflow.objects.values("branch", "product").annotate(
+            total=Sum("quantity_sent")
+        )
+        self.assertEqual(
+            {(row["branch"], row["product"]): row["total"] for row in delivered},
+            {
+                (row.branch_id, row.product_id): row.quantity
+                for row in BranchProduct.objects.all()
+            },
+        )
+        self.assertGreater(
+            ProductInflow.objects.order_by("date_received")
+            .values_list("date_received", flat=True)
+            .distinct()
+            .count(),
+            1,
+        )
+
+    def test_benchmark_records_every_endpoint(self):
+        with tempfile.NamedTemporaryFile("r", suffix=".json") as output:
+            call_command(
+                "benchmark_endpoints",
+                requests=2,
+                warmup=0,
+                output=output.name,
+                stdout=io.StringIO(),
+            )
+            run = json.load(output)
+        self.assertEqual(run["meta"]["rows"]["products.Product"], 30)
+        self.assertIn("dashboard (admin, period=monthly)", run["endpoints"])
+        for result in run["endpoints"].values():
+            self.assertEqual(result["requests"], 2)
+            self.assertGreaterEqual(result["p95_ms"], result["p50_ms"])
@@ -1,14 +1,34 @@
 from dateutil.relativedelta import relativedelta
-from datetime import timedelta
-from rest_framework import viewsets, permissions
+from itertools import chain
+from datetime import date, datetime, time, timedelta
+from rest_framework import viewsets, permissions, status
+from rest_framework.decorators import action
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from django.urls import reverse
 from django.utils import timezone
-from django.db.models import Sum, F, Count, IntegerField
+from django.views import View
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from django.db.models import (
+    Sum,
+    F,
+    Value,
+    CharField,
+    DecimalField,
+    OuterRef,
+    Subquery,
+)
 from django.db.models.functions import Coalesce, Cast
 from .serializers import (
     ProductInflowSerializer,
+    ProductInflowBulkSerializer,
     ProductOutflowSerializer,
+    ProductOutflowBulkSerializer,
     InwardQtyReportSerializer,
     OutwardQtyReportSerializer,
     BranchWiseQtyReportSerializer,
@@ -26,25 +46,165 @@ from .serializers import (
     ProductRequestStatusSerializer,
     ProductOutflowDashboardSerializer,
     BranchProductInventorySerializer,
+    ReorderSuggestionSerializer,
+    ReorderSettingSerializer,
 )
 from apps.products.models import Product
 from apps.branches.models import Branch, BranchProduct, ProductRequest
-from .models import ProductInflow, ProductOutflow
+from .models import (
+    ProductInflow,
+    ProductOutflow,
+    DailyStockRollup,
+    StockSnapshot,
+    BranchInventorySummary,
+    ReorderSetting,
+    ReorderSuggestion,
+    StockLot,
+    request_field,
+)
+from .exports import ExportableReportMixin
+from . import dashboard_cache, events, parallel, reorder
+from apps.core.pagination import KeysetPagination
+from apps.core.views import AsyncAPIView
+from apps.users.authentication import (
+    CachedJWTAuthentication,
+    managed_branch_id,
+    users,
+)
+
+DAILY_REPORT_EXPORT_COLUMNS = [
+    "movement",
+    "product_name",
+    "supplier_name",
+    "branch_name",
+    "quantity",
+    "expiry_date",
+]
+
+
+def product_total(ledger, field):
+    # Summed in a correlated subquery: joining the inflow and outflow ledgers
+    # in the same query would multiply each side by the other's row count.
+    return Subquery(
+        ledger.filter(product=OuterRef("pk"))
+        .order_by()
+        .values("product")
+        .annotate(total=Sum(field))
+        .values("total")
+    )
+
+
+class ProductInflowPagination(KeysetPagination):
+    ordering = ("-date_received", "-id")
+    max_page_size = 500
+
+
+class ProductOutflowPagination(KeysetPagination):
+    ordering = ("-date_sent", "-id")
+    max_page_size = 500
 
 
 class ProductInflowViewSet(viewsets.ModelViewSet):
-    queryset = ProductInflow.objects.all()
+    queryset = ProductInflow.objects.select_related("product", "supplier")
     serializer_class = ProductInflowSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ProductInflowPagination
+    bulk_max_lines = 1000
+
+    @action(detail=False, methods=["post"])
+    def bulk(self, request):
+        serializer = ProductInflowBulkSerializer(
+            data=request.data,
+            many=True,
+            allow_empty=False,
+            max_length=self.bulk_max_lines,
+        )
+        serializer.is_valid(raise_exception=True)
+        inflows = serializer.save()
+        return Response(
+            ProductInflowSerializer(inflows, many=True).data,
+            status=status.HTTP_201_CREATED,
+        )
+
+
+class BranchInventoryLevelPagination(KeysetPagination):
+    ordering = ("product_name", "id")
+    page_size = 50
+    max_page_size = 500
+
+
+class BranchDashboardInventoryPagination(BranchInventoryLevelPagination):
+    # The dashboard's first page is cached for everyone at the branch, so it
+    # is always the default page, whatever ?page_size= or ?cursor= the
+    # request that built it carried.
+    def get_page_size(self, request):
+        return BranchInventoryLevelPagination.page_size
+
+    def decode_cursor(self, request):
+        return None
 
 
 class ProductOutflowViewSet(viewsets.ModelViewSet):
-    queryset = ProductOutflow.objects.all()
+    queryset = ProductOutflow.objects.select_related("product", "branch")
     serializer_class = ProductOutflowSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ProductOutflowPagination
+    bulk_max_lines = 25000
+
+    @action(detail=False, methods=["post"])
+    def bulk(self, request):
+        serializer = ProductOutflowBulkSerializer(
+            data=request.data,
+            many=True,
+            allow_empty=False,
+            max_length=self.bulk_max_lines,
+        )
+        serializer.is_valid(raise_exception=True)
+        outflows = serializer.save()
+        return Response(
+            ProductOutflowSerializer(outflows, many=True).data,
+            status=status.HTTP_201_CREATED,
+        )
+
+
+class ReorderSuggestionPagination(KeysetPagination):
+    ordering = ("-suggested_quantity", "-id")
+    max_page_size = 500
+
+
+class ReorderSuggestionViewSet(viewsets.ReadOnlyModelViewSet):
+    """Suggestions of the last reorder refresh. Branch managers see their
+    branch; admins the central store, or the branch in ?branch=. Only the
+    ones that need stock with ?needs_reorder=true."""
+
+    serializer_class = ReorderSuggestionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ReorderSuggestionPagination
+
+    def get_queryset(self):
+        user = self.request.user
+        if user.role == "branch_manager":
+            branch = managed_branch_id(self.request)
+        else:
+            branch = self.request.query_params.get("branch") or None
+            if branch is not None and not branch.isdigit():
+                raise ValidationError({"branch": "Expected a branch id."})
+        queryset = ReorderSuggestion.objects.filter(branch=branch).select_related(
+            "product"
+        )
+        if self.request.query_params.get("needs_reorder") == "true":
+            queryset = queryset.filter(suggested_quantity__gt=0)
+        return queryset
 
 
-class InwardQtyReportView(APIView):
+class ReorderSettingViewSet(viewsets.ModelViewSet):
+    queryset = ReorderSetting.objects.all().order_by("id")
+    serializer_class = ReorderSettingSerializer
+    permission_classes = [permissions.IsAdminUser]
+    filterset_fields = ["product", "branch"]
+
+
+class InwardQtyReportView(ExportableReportMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
@@ -55,11 +215,18 @@ class InwardQtyReportView(APIView):
             .annotate(total_quantity=Sum("quantity_received"))
             .order_by("-total_quantity")
         )
+        if self.is_export(request):
+            return self.export(
+                request,
+                inflows,
+                list(InwardQtyReportSerializer().fields),
+                "inward-qty",
+            )
         serializer = InwardQtyReportSerializer(inflows, many=True)
         return Response(serializer.data)
 
 
-class OutwardQtyReportView(APIView):
+class OutwardQtyReportView(ExportableReportMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
@@ -70,11 +237,18 @@ class OutwardQtyReportView(APIView):
             .annotate(total_quantity=Sum("quantity_sent"))
             .order_by("-total_quantity")
         )
+        if self.is_export(request):
+            return self.export(
+                request,
+                outflows,
+                list(OutwardQtyReportSerializer().fields),
+                "outward-qty",
+            )
         serializer = OutwardQtyReportSerializer(outflows, many=True)
         return Response(serializer.data)
 
 
-class BranchWiseQtyReportView(APIView):
+class BranchWiseQtyReportView(ExportableReportMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
@@ -83,26 +257,41 @@ class BranchWiseQtyReportView(APIView):
             .annotate(total_quantity=Sum("quantity"))
             .order_by("branch__name", "-total_quantity")
         )
+        if self.is_export(request):
+            return self.export(
+                request,
+                branch_products,
+                list(BranchWiseQtyReportSerializer().fields),
+                "branch-wise-qty",
+            )
         serializer = BranchWiseQtyReportSerializer(branch_products, many=True)
         return Response(serializer.data)
 
 
-class ExpiredProductReportView(APIView):
+class ExpiredProductReportView(ExportableReportMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
         today = timezone.now().date()
+        # What the central store still holds past its expiry date
         expired_products = (
-            ProductInflow.objects.filter(expiry_date__lte=today)
+            StockLot.objects.filter(branch=None, expiry_date__lte=today)
             .values("product__name", "expiry_date")
-            .annotate(quantity=Sum("quantity_received"))
+            .annotate(quantity=Sum("quantity"))
             .order_by("expiry_date")
         )
+        if self.is_export(request):
+            return self.export(
+                request,
+                expired_products,
+                list(ExpiredProductReportSerializer().fields),
+                "expired-products",
+            )
         serializer = ExpiredProductReportSerializer(expired_products, many=True)
         return Response(serializer.data)
 
 
-class SupplierWiseProductReportView(APIView):
+class SupplierWiseProductReportView(ExportableReportMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
@@ -111,11 +300,18 @@ class SupplierWiseProductReportView(APIView):
             .annotate(total_quantity=Sum("quantity_received"))
             .order_by("supplier__name", "-total_quantity")
         )
+        if self.is_export(request):
+            return self.export(
+                request,
+                supplier_products,
+                list(SupplierWiseProductReportSerializer().fields),
+                "supplier-wise-products",
+            )
         serializer = SupplierWiseProductReportSerializer(supplier_products, many=True)
         return Response(serializer.data)
 
 
-class OpenedProductReportView(APIView):
+class OpenedProductReportView(ExportableReportMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
@@ -125,11 +321,18 @@ class OpenedProductReportView(APIView):
             .annotate(quantity=Sum("quantity"))
             .order_by("-quantity")
         )
+        if self.is_export(request):
+            return self.export(
+                request,
+                opened_products,
+                list(OpenedProductReportSerializer().fields),
+                "opened-products",
+            )
         serializer = OpenedProductReportSerializer(opened_products, many=True)
         return Response(serializer.data)
 
 
-class ClosedProductReportView(APIView):
+class ClosedProductReportView(ExportableReportMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
@@ -139,17 +342,53 @@ class ClosedProductReportView(APIView):
             .annotate(quantity=Sum("quantity"))
             .order_by("-quantity")
         )
+        if self.is_export(request):
+            return self.export(
+                request,
+                closed_products,
+                list(ClosedProductReportSerializer().fields),
+                "closed-products",
+            )
         serializer = ClosedProductReportSerializer(closed_products, many=True)
         return Response(serializer.data)
 
 
-class DailyReportView(APIView):
+class DailyReportView(ExportableReportMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
         today = timezone.now().date()
-        inflows = ProductInflow.objects.filter(date_received=today)
-        outflows = ProductOutflow.objects.filter(date_sent=today)
+        inflows = ProductInflow.objects.filter(date_received=today).select_related(
+            "product", "supplier"
+        )
+        outflows = ProductOutflow.objects.filter(date_sent=today).select_related(
+            "product", "branch"
+        )
+
+        if self.is_export(request):
+            # One row per movement, inflows first
+            rows = chain(
+                inflows.annotate(
+                    movement=Value("inflow"),
+                    product_name=F("product__name"),
+                    supplier_name=F("supplier__name"),
+                    branch_name=Value(None, output_field=CharField()),
+                    quantity=F("quantity_received"),
+                )
+                .values(*DAILY_REPORT_EXPORT_COLUMNS)
+                .iterator(chunk_size=self.export_chunk_size),
+                outflows.annotate(
+                    movement=Value("outflow"),
+                    product_name=F("product__name"),
+                    supplier_name=Value(None, output_field=CharField()),
+                    branch_name=F("branch__name"),
+                    quantity=F("quantity_sent"),
+                )
+                .values(*DAILY_REPORT_EXPORT_COLUMNS)
+                .iterator(chunk_size=self.export_chunk_size),
+            )
+            return self.export(request, rows, DAILY_REPORT_EXPORT_COLUMNS, "daily")
+
         data = {
             "inflows": inflows,
             "outflows": outflows,
@@ -158,29 +397,85 @@ class DailyReportView(APIView):
         return Response(serializer.data)
 
 
-class ProductDetailsReportView(APIView):
+class ProductDetailsReportView(ExportableReportMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
+        columns = list(ProductDetailsReportSerializer().fields)
+        as_of = request.query_params.get("as_of")
+        if not as_of:
+            products = Product.objects.annotate(
+                total_inflow=product_total(
+                    ProductInflow.objects.all(), "quantity_received"
+                ),
+                total_outflow=product_total(
+                    ProductOutflow.objects.all(), "quantity_sent"
+                ),
+                closing_stock=F("quantity"),
+            ).values("name", "sku", "total_inflow", "total_outflow", "closing_stock")
+            if self.is_export(request):
+                return self.export(request, products, columns, "product-details")
+            serializer = ProductDetailsReportSerializer(products, many=True)
+            return Response(serializer.data)
+
+        try:
+            as_of = date.fromisoformat(as_of)
+        except ValueError:
+            return Response(
+                {"error": "Invalid as_of date, expected YYYY-MM-DD"}, status=400
+            )
+
+        # Stock at the end of the requested day, rebuilt from the journal
+        closing_stock = StockSnapshot.quantities_as_of(
+            timezone.make_aware(datetime.combine(as_of, time.max)),
+            central_only=True,
+        )
         products = Product.objects.annotate(
-            total_inflow=Sum("productinflow__quantity_received"),
-            total_outflow=Sum("productoutflow__quantity_sent"),
-            closing_stock=F("quantity"),
-        ).values("name", "sku", "total_inflow", "total_outflow", "closing_stock")
+            total_inflow=product_total(
+                ProductInflow.objects.filter(date_received__lte=as_of),
+                "quantity_received",
+            ),
+            total_outflow=product_total(
+                ProductOutflow.objects.filter(date_sent__lte=as_of),
+                "quantity_sent",
+            ),
+        ).values("id", "name", "sku", "total_inflow", "total_outflow")
+
+        if self.is_export(request):
+            rows = (
+                {**product, "closing_stock": closing_stock[(None, product["id"])]}
+                for product in products.iterator(chunk_size=self.export_chunk_size)
+            )
+            return self.export(request, rows, columns, f"product-details-{as_of}")
+
+        products = [
+            {**product, "closing_stock": closing_stock[(None, product["id"])]}
+            for product in products
+        ]
         serializer = ProductDetailsReportSerializer(products, many=True)
         return Response(serializer.data)
 
 
-class BranchDailyReportView(APIView):
+class BranchDailyReportView(ExportableReportMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        branch = request.user.managed_branch
+        branch = managed_branch_id(request)
         today = timezone.now().date()
 
         inflows = ProductRequest.objects.filter(
             branch=branch, status="fulfilled", date_requested__date=today
-        )
+        ).select_related("product")
+
+        if self.is_export(request):
+            return self.export(
+                request,
+                inflows.annotate(product_name=F("product__name")).values(
+                    "product_name", "quantity"
+                ),
+                ["product_name", "quantity"],
+                "branch-daily",
+            )
 
         data = {
             "inflows": inflows,
@@ -190,11 +485,22 @@ class BranchDailyReportView(APIView):
         return Response(serializer.data)
 
 
-class BranchProductDetailsReportView(APIView):
+class BranchProductDetailsReportView(ExportableReportMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        branch = request.user.managed_branch
+        branch = managed_branch_id(request)
+
+        if self.is_export(request):
+            return self.export(
+                request,
+                BranchProduct.objects.filter(branch=branch)
+                .annotate(name=F("product__name"), sku=F("product__sku"))
+                .values("name", "sku", "quantity", "status"),
+                list(BranchProductDetailsReportSerializer().fields),
+                "branch-product-details",
+            )
+
         branch_products = BranchProduct.objects.filter(branch=branch).select_related(
             "product"
         )
@@ -213,24 +519,28 @@ class BranchProductDetailsReportView(APIView):
         return Response(serializer.data)
 
 
-class BranchExpiredProductReportView(APIView):
+class BranchExpiredProductReportView(ExportableReportMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        branch = request.user.managed_branch
+        branch = managed_branch_id(request)
         today = timezone.now().date()
 
         expired_products = (
-            BranchProduct.objects.filter(
-                branch=branch, product__productinflow__expiry_date__lte=today
-            )
-            .annotate(
-                product_name=F("product__name"),
-                expiry_date=F("product__productinflow__expiry_date"),
-            )
+            StockLot.objects.filter(branch=branch, expiry_date__lte=today)
+            .annotate(product_name=F("product__name"))
             .values("product_name", "expiry_date", "quantity")
+            .order_by("expiry_date", "id")
         )
 
+        if self.is_export(request):
+            return self.export(
+                request,
+                expired_products,
+                list(BranchExpiredProductReportSerializer().fields),
+                "branch-expired-products",
+            )
+
         serializer = BranchExpiredProductReportSerializer(expired_products, many=True)
         return Response(serializer.data)
 
@@ -239,153 +549,352 @@ class DashboardView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        # Get query parameters for time period filtering
-        period = request.query_params.get("period", "daily")
-
-        # Calculate date range based on the period
-        end_date = timezone.now().date()
-        if period == "daily":
-            start_date = end_date
-        elif period == "monthly":
-            start_date = end_date - relativedelta(months=1)
-        elif period == "yearly":
-            start_date = end_date - relativedelta(years=1)
-        else:
+        period = dashboard_period(request)
+        if period is None:
             return Response({"error": "Invalid period specified"}, status=400)
+        period, start_date, end_date = period
 
-        # Fetch data for different sections of the dashboard
-        total_products = Product.objects.count()
-        total_branches = Branch.objects.count()
-
-        inflow_data = ProductInflow.objects.filter(
-            date_received__range=[start_date, end_date]
-        ).aggregate(
-            total_inflow=Coalesce(Sum("quantity_received"), 0),
-            total_inflow_value=Coalesce(
-                Sum(
-                    F("quantity_received") * F("product__price"),
-                    output_field=IntegerField(),
-                ),
-                0,
-            ),
+        data, hit = dashboard_cache.fetch(
+            "dashboard",
+            dashboard_cache.ALL,
+            f"{period}:{end_date}",
+            lambda: self.build(start_date, end_date),
         )
+        return cached_response(data, hit)
 
-        outflow_data = ProductOutflow.objects.filter(
-            date_sent__range=[start_date, end_date]
-        ).aggregate(
-            total_outflow=Coalesce(Sum("quantity_sent"), 0),
-            total_outflow_value=Coalesce(
-                Sum(
-                    F("quantity_sent") * F("product__price"),
-                    output_field=IntegerField(),
-                ),
-                0,
-            ),
-        )
-
-        top_products = Product.objects.annotate(
-            total_outflow=Coalesce(Sum("productoutflow__quantity_sent"), 0)
-        ).order_by("-total_outflow")[:5]
-
-        low_stock_products = Product.objects.filter(quantity__lte=10).count()
-
-        branch_stock = (
-            BranchProduct.objects.values("branch__name")
-            .annotate(total_stock=Sum("quantity"))
-            .order_by("-total_stock")[:5]
+    def build(self, start_date, end_date):
+        return self.assemble(
+            {
+                name: query()
+                for name, query in self.queries(start_date, end_date).items()
+            }
         )
 
-        expired_products = (
-            ProductInflow.objects.filter(expiry_date__lte=end_date)
-            .values("product__name")
-            .annotate(total_expired=Sum("quantity_received"))
-            .order_by("-total_expired")[:5]
-        )
+    def queries(self, start_date, end_date):
+        # Sections of the dashboard, independent of each other
+        return {
+            "total_products": Product.objects.count,
+            "total_branches": Branch.objects.count,
+            # Served from the daily rollup so the cost is bounded by the
+            # number of days in the period rather than the size of the ledger.
+            "movement_data": lambda: DailyStockRollup.objects.filter(
+                day__range=[start_date, end_date]
+            ).aggregate(
+                total_inflow=Coalesce(Sum("quantity_in"), 0),
+                total_inflow_value=Coalesce(
+                    Sum("value_in"), 0, output_field=DecimalField()
+                ),
+                total_outflow=Coalesce(Sum("quantity_out"), 0),
+                total_outflow_value=Coalesce(
+                    Sum("value_out"), 0, output_field=DecimalField()
+                ),
+            ),
+            # Grouped by product, so products sharing a name stay apart
+            "top_products": lambda: list(
+                DailyStockRollup.objects.filter(
+                    day__range=[start_date, end_date], branch__isnull=False
+                )
+                .values("product", "product__name")
+                .annotate(total_outflow=Sum("quantity_out"))
+                .order_by("-total_outflow")[:5]
+            ),
+            # Central products low on stock
+            "low_stock_products": lambda: reorder.low_stock_count(None),
+            "branch_stock": lambda: list(
+                BranchProduct.objects.values("branch__name")
+                .annotate(total_stock=Sum("quantity"))
+                .order_by("-total_stock")[:5]
+            ),
+            # Still held past their expiry date, centrally or in a branch
+            "expired_products": lambda: list(
+                StockLot.objects.filter(expiry_date__lte=end_date)
+                .values("product__name")
+                .annotate(total_expired=Sum("quantity"))
+                .order_by("-total_expired")[:5]
+            ),
+        }
 
-        # Prepare the response data
-        response_data = {
-            "total_products": total_products,
-            "total_branches": total_branches,
-            "total_inflow": inflow_data["total_inflow"],
-            "total_inflow_value": float(inflow_data["total_inflow_value"]),
-            "total_outflow": outflow_data["total_outflow"],
-            "total_outflow_value": float(outflow_data["total_outflow_value"]),
+    def assemble(self, results):
+        movement_data = results["movement_data"]
+        return {
+            "total_products": results["total_products"],
+            "total_branches": results["total_branches"],
+            "total_inflow": movement_data["total_inflow"],
+            "total_inflow_value": float(movement_data["total_inflow_value"]),
+            "total_outflow": movement_data["total_outflow"],
+            "total_outflow_value": float(movement_data["total_outflow_value"]),
             "top_products": [
-                {"name": product.name, "total_outflow": product.total_outflow}
-                for product in top_products
+                {
+                    "name": product["product__name"],
+                    "total_outflow": product["total_outflow"],
+                }
+                for product in results["top_products"]
             ],
-            "low_stock_products": low_stock_products,
-            "branch_stock": list(branch_stock),
-            "expired_products": list(expired_products),
+            "low_stock_products": results["low_stock_products"],
+            "branch_stock": results["branch_stock"],
+            "expired_products": results["expired_products"],
         }
 
-        return Response(response_data)
-
 
 class BranchDashboardView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        branch = request.user.managed_branch
+        branch = managed_branch_id(request)
         today = timezone.now().date()
-        last_30_days = today - timedelta(days=30)
+        data, hit = dashboard_cache.fetch(
+            "branch_dashboard",
+            dashboard_cache.branch_scope(branch),
+            today,
+            lambda: self.build(request, branch, today),
+        )
+        return cached_response(data, hit)
 
-        # Branch overview
-        total_products = BranchProduct.objects.filter(branch=branch).count()
-        active_products = BranchProduct.objects.filter(
-            branch=branch, status="active"
-        ).count()
-        total_requests = ProductRequest.objects.filter(branch=branch).count()
-        pending_requests = ProductRequest.objects.filter(
-            branch=branch, status="pending"
-        ).count()
+    def build(self, request, branch, today):
+        paginator = BranchDashboardInventoryPagination()
+        return self.assemble(
+            request,
+            paginator,
+            {
+                name: query()
+                for name, query in self.queries(
+                    request, branch, today, paginator
+                ).items()
+            },
+        )
 
-        overview = {
-            "total_products": total_products,
-            "active_products": active_products,
-            "total_requests": total_requests,
-            "pending_requests": pending_requests,
+    def queries(self, request, branch, today, paginator):
+        last_30_days = today - timedelta(days=30)
+        return {
+            # Branch overview, kept current by the writes themselves
+            "summary": lambda: BranchInventorySummary.for_branch(branch),
+            "low_stock_products": lambda: reorder.low_stock_count(branch),
+            # Top 5 products by quantity
+            "top_products": lambda: list(
+                BranchProduct.objects.filter(branch=branch)
+                .order_by("-quantity")[:5]
+                .values("product__name", "quantity")
+            ),
+            # Product outflow in the last 30 days
+            "product_outflow": lambda: list(
+                ProductOutflow.objects.filter(
+                    branch=branch, date_sent__gte=last_30_days
+                )
+                .values("date_sent")
+                .annotate(total_quantity=Sum("quantity_sent"))
+                .order_by("date_sent")
+            ),
+            # First page of the inventory levels; the rest is paged through
+            # BranchInventoryLevelsView.
+            "inventory_levels": lambda: paginator.paginate_queryset(
+                inventory_levels_of(branch), request
+            ),
         }
 
-        # Top 5 products by quantity
-        top_products = (
-            BranchProduct.objects.filter(branch=branch)
-            .order_by("-quantity")[:5]
-            .values("product__name", "quantity")
-        )
+    def assemble(self, request, paginator, results):
+        summary = results["summary"]
+        overview = {
+            "total_products": summary.total_products,
+            "active_products": summary.active_products,
+            "total_units": summary.total_units,
+            "total_requests": summary.total_requests,
+            "pending_requests": summary.pending_requests,
+            "low_stock_products": results["low_stock_products"],
+        }
 
         # Product request status
-        request_status = (
-            ProductRequest.objects.filter(branch=branch)
-            .values("status")
-            .annotate(count=Count("status"))
-        )
+        request_status = [
+            {"status": status, "count": getattr(summary, request_field(status))}
+            for status, _ in ProductRequest.REQUEST_STATUS
+            if getattr(summary, request_field(status))
+        ]
 
-        # Product outflow in the last 30 days
-        product_outflow = (
-            ProductOutflow.objects.filter(branch=branch, date_sent__gte=last_30_days)
-            .values("date_sent")
-            .annotate(total_quantity=Sum("quantity_sent"))
-            .order_by("date_sent")
-        )
-
-        # Current inventory levels
-        inventory_levels = BranchProduct.objects.filter(branch=branch).values(
-            "product__name", "quantity"
-        )
+        # Relative, as the cached link is served to clients on any host
+        paginator.base_url = reverse("branch-inventory-levels")
 
         serialized_data = {
             "overview": BranchOverviewSerializer(overview).data,
-            "top_products": TopProductsSerializer(top_products, many=True).data,
+            "top_products": TopProductsSerializer(
+                results["top_products"], many=True
+            ).data,
             "request_status": ProductRequestStatusSerializer(
                 request_status, many=True
             ).data,
             "product_outflow": ProductOutflowDashboardSerializer(
-                product_outflow, many=True
+                results["product_outflow"], many=True
             ).data,
             "inventory_levels": BranchProductInventorySerializer(
-                inventory_levels, many=True
+                results["inventory_levels"], many=True
             ).data,
+            "inventory_levels_next": paginator.get_next_link(),
         }
 
-        return Response(serialized_data)
+        return serialized_data
+
+
+class BranchInventoryLevelsView(ExportableReportMixin, APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = BranchInventoryLevelPagination
+
+    def get(self, request):
+        levels = inventory_levels_of(managed_branch_id(request))
+
+        if self.is_export(request):
+            return self.export(
+                request,
+                levels.order_by(*self.pagination_class.ordering),
+                ["product_name", "quantity"],
+                "branch-inventory-levels",
+            )
+
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(levels, request, view=self)
+        return paginator.get_paginated_response(
+            BranchProductInventorySerializer(page, many=True).data
+        )
+
+
+def inventory_levels_of(branch):
+    return (
+        BranchProduct.objects.filter(branch=branch)
+        .annotate(product_name=F("product__name"))
+        .values("id", "product_name", "quantity")
+    )
+
+
+class AsyncDashboardView(AsyncAPIView, DashboardView):
+    """DashboardView for ASGI deployments: the sections are queried at the
+    same time instead of one after another."""
+
+    async def get(self, request):
+        period = dashboard_period(request)
+        if period is None:
+            return Response({"error": "Invalid period specified"}, status=400)
+        name, start_date, end_date = period
+
+        async def build():
+            return self.assemble(
+                await parallel.gather(self.queries(start_date, end_date))
+            )
+
+        data, hit = await dashboard_cache.afetch(
+            "dashboard", dashboard_cache.ALL, f"{name}:{end_date}", build
+        )
+        return cached_response(data, hit)
+
+
+class AsyncBranchDashboardView(AsyncAPIView, BranchDashboardView):
+    """BranchDashboardView for ASGI deployments, see AsyncDashboardView."""
+
+    async def get(self, request):
+        branch = await sync_to_async(managed_branch_id)(request)
+        today = timezone.now().date()
+
+        async def build():
+            paginator = BranchDashboardInventoryPagination()
+            results = await parallel.gather(
+                self.queries(request, branch, today, paginator)
+            )
+            return self.assemble(request, paginator, results)
+
+        data, hit = await dashboard_cache.afetch(
+            "branch_dashboard", dashboard_cache.branch_scope(branch), today, build
+        )
+        return cached_response(data, hit)
+
+
+def dashboard_period(request):
+    """Return ``(period, start date, end date)`` for the ?period= of a
+    dashboard request, or None if it is not one of daily, monthly or
+    yearly."""
+    period = request.query_params.get("period", "daily")
+    end_date = timezone.now().date()
+    if period == "daily":
+        start_date = end_date
+    elif period == "monthly":
+        start_date = end_date - relativedelta(months=1)
+    elif period == "yearly":
+        start_date = end_date - relativedelta(years=1)
+    else:
+        return None
+    return period, start_date, end_date
+
+
+class DashboardCacheStatsView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(dashboard_cache.stats(["dashboard", "branch_dashboard"]))
+
+
+class EventStreamTicketView(APIView):
+    """Trade the access token for a ticket to open the event stream with,
+    as ?ticket=, valid for STOCK_EVENTS_TICKET_MAX_AGE seconds."""
+
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        return Response(
+            {
+                "ticket": events.issue_ticket(request.user),
+                "expires_in": settings.STOCK_EVENTS_TICKET_MAX_AGE,
+            },
+            status=status.HTTP_201_CREATED,
+        )
+
+
+class EventStreamView(View):
+    """Server-sent events for stock and request changes: a branch manager's
+    own branch, or for admins every branch or the one in ?branch=. Opened
+    with a bearer token or a ticket from EventStreamTicketView."""
+
+    async def get(self, request):
+        # Under WSGI the stream would hold a worker for as long as it is open.
+        if not isinstance(request, ASGIRequest):
+            return JsonResponse(
+                {"error": "The event stream is only served over ASGI."}, status=501
+            )
+        keys, error, status_code = await sync_to_async(event_stream_keys)(request)
+        if error:
+            return JsonResponse({"error": error}, status=status_code)
+        response = StreamingHttpResponse(
+            events.stream(keys), content_type="text/event-stream"
+        )
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+
+def event_stream_keys(request):
+    # EventSource cannot send headers, so browsers pass a ticket instead.
+    ticket = request.GET.get("ticket")
+    if ticket:
+        user_id = events.ticket_user_id(ticket)
+        user = users.get(user_id) if user_id is not None else None
+        if user is None or not user.is_active:
+            return None, "Invalid or expired ticket.", 401
+    else:
+        try:
+            user, _ = CachedJWTAuthentication().authenticate(request) or (None, None)
+        except (InvalidToken, AuthenticationFailed):
+            return None, "Invalid or expired token.", 401
+        if user is None:
+            return None, "Authentication credentials were not provided.", 401
+
+    if user.role == "admin":
+        branch_id = request.GET.get("branch")
+        if not branch_id:
+            return [events.ALL], None, None
+        if not (branch_id.isdigit() and Branch.objects.filter(pk=branch_id).exists()):
+            return None, "Branch not found.", 404
+        return [int(branch_id)], None, None
+    branch = getattr(user, "managed_branch", None)
+    if branch is None:
+        return None, "You do not manage a branch.", 403
+    return [branch.pk], None, None
+
+
+def cached_response(data, hit):
+    response = Response(data)
+    response["X-Cache"] = "HIT" if hit else "MISS"
+    return response
@@ -0,0 +1,182 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.exceptions import AuthenticationFailed, PermissionDenied
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+# Authenticated users are resolved from a per-process cache of User rows,
+# loaded together with the branch they manage, instead of a query for the
+# user and another for request.user.managed_branch on every request.
+# Entries are reloaded after USER_AUTH_CACHE_TTL seconds. User and branch
+# writes bump a version kept in the Django cache, as in
+# apps/products/scan_cache.py: the writing process drops its entries as soon
+# as the write commits, and when that cache is shared every other process
+# does within USER_AUTH_CACHE_CHECK_INTERVAL seconds. With a per-process
+# cache such as the default LocMemCache the other processes only notice at
+# the TTL, so a deactivated user or a changed password is honoured there up
+# to USER_AUTH_CACHE_TTL seconds late. Refreshing a token always checks the
+# user against the database.
+#
+# Access tokens carry the user's role and managed branch id as claims, so
+# branch-scoped views can filter on the token alone. A token whose claims no
+# longer match the user is rejected and has to be replaced by logging in.
+
+VERSION_KEY = "users:auth:version"
+
+
+class UserCache:
+    def __init__(self, max_entries, ttl, check_interval):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.version = None
+        self.checked = 0.0
+
+    def get(self, user_id):
+        """Return a copy of the user with ``user_id`` and its managed branch,
+        or None if there is no such user."""
+        self.sync()
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None and now - entry[0] < self.ttl:
+                self.entries.move_to_end(user_id)
+                return copy.deepcopy(entry[1])
+            generation = self.generation
+
+        user = load(user_id)
+        if user is None:
+            return None
+        with self.lock:
+            # A user read while a write committed may already be stale.
+            if generation == self.generation:
+                self.entries[user_id] = (now, user)
+                self.entries.move_to_end(user_id)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        # Each request gets its own user and branch to annotate or modify.
+        return copy.deepcopy(user)
+
+    def invalidate(self):
+        transaction.on_commit(self.bump)
+
+    def bump(self):
+        self.clear()
+        cache = get_cache()
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.set(VERSION_KEY, _new_version(), timeout=None)
+
+    def sync(self):
+        now = time.monotonic()
+        if now - self.checked < self.check_interval:
+            return
+        self.checked = now
+        version = get_cache().get_or_set(VERSION_KEY, _new_version, timeout=None)
+        if version != self.version:
+            self.clear()
+            self.version = version
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.generation += 1
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that takes the user from the per-process cache."""
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken("Token contained no recognizable user identification")
+
+        user = users.get(user_id)
+        check_user(user, validated_token)
+        return user
+
+
+def check_user(user, token):
+    """Raise AuthenticationFailed unless ``user``, as loaded for the user id
+    in ``token``, may still use it."""
+    if user is None:
+        raise AuthenticationFailed("User not found", code="user_not_found")
+    if not user.is_active:
+        raise AuthenticationFailed("User is inactive", code="user_inactive")
+    if api_settings.CHECK_REVOKE_TOKEN and token.get(
+        api_settings.REVOKE_TOKEN_CLAIM
+    ) != get_md5_hash_password(user.password):
+        raise AuthenticationFailed(
+            "The user's password has been changed.", code="password_changed"
+        )
+    # Tokens issued before the claims were added have none to check.
+    if any(
+        name in token and token[name] != value for name, value in claims(user).items()
+    ):
+        raise AuthenticationFailed(
+            "The user's role or branch has changed; log in again.",
+            code="claims_changed",
+        )
+
+
+def claims(user):
+    branch = getattr(user, "managed_branch", None)
+    return {"role": user.role, "branch_id": branch.pk if branch else None}
+
+
+def add_claims(token, user):
+    for name, value in claims(user).items():
+        token[name] = value
+    return token
+
+
+def managed_branch_id(request):
+    """Return the id of the branch the requesting user manages, from the
+    access token's claims when it has them. Raises PermissionDenied if the
+    user manages no branch."""
+    token = request.auth
+    if token is not None and "branch_id" in token:
+        branch_id = token["branch_id"]
+    else:
+        branch = getattr(request.user, "managed_branch", None)
+        branch_id = branch.pk if branch else None
+    if branch_id is None:
+        raise PermissionDenied("You do not manage a branch.")
+    return branch_id
+
+
+def load(user_id):
+    from .models import User
+
+    return (
+        User.objects.select_related("managed_branch")
+        .filter(**{api_settings.USER_ID_FIELD: user_id})
+        .first()
+    )
+
+
+def get_cache():
+    return caches[settings.USER_AUTH_CACHE_ALIAS]
+
+
+def _new_version():
+    return time.time_ns() // 1000
+
+
+users = UserCache(
+    settings.USER_AUTH_CACHE_SIZE,
+    settings.USER_AUTH_CACHE_TTL,
+    settings.USER_AUTH_CACHE_CHECK_INTERVAL,
+)
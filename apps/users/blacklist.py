@@ -0,0 +1,151 @@
+import hashlib
+import math
+import threading
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.tokens import RefreshToken as BaseRefreshToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
+from apps.core.caches import is_shared
+
+# Refresh token rotation checks the presented token against the blacklist
+# and then blacklists it, on every refresh. Blacklisting writes the token's
+# rows in the request, as simplejwt does, so the tables are always the
+# truth. With a shared cache, checks are answered by a per-process Bloom
+# filter of the blacklisted jtis of unexpired tokens, so a token that was
+# never blacklisted costs no query however large the tables grow; only a
+# possible match is confirmed against them. Each process adds newly written
+# rows to its filter every TOKEN_BLACKLIST_CHECK_INTERVAL seconds, and tokens
+# blacklisted since are marked in the cache until they expire.
+#
+# A per-process cache cannot tell one process about the others' tokens, so
+# without a shared one every check asks the tables.
+
+CACHE_PREFIX = "users:blacklist:"
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(
+            64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        )
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def add(self, key):
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self.positions(key)
+        )
+
+    def positions(self, key):
+        # Double hashing over one 128-bit digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        step = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * step) % self.size for i in range(self.hashes)]
+
+
+class Blacklist:
+    def __init__(self, capacity, error_rate, check_interval):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.filter = None
+        self.last_id = 0
+        self.checked = 0.0
+
+    def contains(self, jti):
+        if not is_shared(settings.TOKEN_BLACKLIST_CACHE_ALIAS):
+            return BlacklistedToken.objects.filter(token__jti=jti).exists()
+        self.sync()
+        with self.lock:
+            maybe = jti in self.filter
+        if maybe:
+            return BlacklistedToken.objects.filter(token__jti=jti).exists()
+        return bool(get_cache().get(CACHE_PREFIX + jti))
+
+    def add(self, token):
+        """Tell other processes about ``token``, whose rows were just
+        written, once they are committed."""
+        jti = token[api_settings.JTI_CLAIM]
+        expires_at = datetime_from_epoch(token["exp"])
+
+        def mark():
+            remaining = (expires_at - timezone.now()).total_seconds()
+            get_cache().set(CACHE_PREFIX + jti, True, max(1, math.ceil(remaining)))
+            with self.lock:
+                if self.filter is not None:
+                    self.filter.add(jti)
+
+        transaction.on_commit(mark)
+
+    def sync(self):
+        now = time.monotonic()
+        with self.lock:
+            if self.filter is not None and now - self.checked < self.check_interval:
+                return
+            self.checked = now
+            # Start over once full, dropping tokens that have expired since.
+            rebuild = self.filter is None or self.filter.count > self.capacity
+            last_id = 0 if rebuild else self.last_id
+        # A row committed late under a lower id is missed here, but its token
+        # is in the shared cache until it expires.
+        rows = list(
+            BlacklistedToken.objects.filter(
+                pk__gt=last_id, token__expires_at__gt=timezone.now()
+            )
+            .order_by("pk")
+            .values_list("pk", "token__jti")
+        )
+        with self.lock:
+            if rebuild:
+                self.filter = BloomFilter(self.capacity, self.error_rate)
+            for _, jti in rows:
+                self.filter.add(jti)
+            if rows:
+                self.last_id = rows[-1][0]
+            elif rebuild:
+                self.last_id = 0
+
+    def clear(self):
+        with self.lock:
+            self.filter = None
+            self.last_id = 0
+
+
+class RefreshToken(BaseRefreshToken):
+    """RefreshToken checked against and added to the cached blacklist."""
+
+    def check_blacklist(self):
+        if blacklist.contains(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError("Token is blacklisted")
+
+    def blacklist(self):
+        blacklisted = super().blacklist()
+        blacklist.add(self)
+        return blacklisted
+
+
+def get_cache():
+    return caches[settings.TOKEN_BLACKLIST_CACHE_ALIAS]
+
+
+blacklist = Blacklist(
+    settings.TOKEN_BLACKLIST_FILTER_CAPACITY,
+    settings.TOKEN_BLACKLIST_FILTER_ERROR_RATE,
+    settings.TOKEN_BLACKLIST_CHECK_INTERVAL,
+)
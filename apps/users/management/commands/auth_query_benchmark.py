@@ -0,0 +1,93 @@
+import statistics
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+from apps.branches.models import Branch
+from apps.users.authentication import CachedJWTAuthentication, add_claims, users
+
+# Branch manager endpoints, by URL name
+ENDPOINTS = [
+    "branch-dashboard",
+    "branch-inventory-levels",
+    "branch_products-list",
+    "product_requests-list",
+    "reorder_suggestions-list",
+    "branch-expired-product-report",
+]
+
+AUTHENTICATION = {
+    "jwt": JWTAuthentication,
+    "cached": CachedJWTAuthentication,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Call a branch manager's endpoints with a bearer token, authenticated "
+        "by simplejwt's JWTAuthentication, which loads the user and then the "
+        "managed branch on every request, and by CachedJWTAuthentication, and "
+        "print the queries and time per request for each."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=100)
+        parser.add_argument("endpoints", nargs="*", help="URL names to call.")
+
+    def handle(self, *args, **options):
+        branch = Branch.objects.exclude(manager=None).select_related("manager").first()
+        if branch is None:
+            raise CommandError(
+                "There is no branch with a manager; run seed_stock_dataset first."
+            )
+        unknown = set(options["endpoints"]) - set(ENDPOINTS)
+        if unknown:
+            raise CommandError("Unknown endpoint; choose from " + ", ".join(ENDPOINTS))
+        # As issued at login
+        token = add_claims(AccessToken.for_user(branch.manager), branch.manager)
+        header = f"Bearer {token}"
+        factory = APIRequestFactory()
+        users.clear()
+
+        for name in options["endpoints"] or ENDPOINTS:
+            path = reverse(name)
+            for label, authentication in AUTHENTICATION.items():
+                view = view_for(path, authentication)
+                counts, timings = [], []
+                # The first request fills the caches.
+                for i in range(options["requests"] + 1):
+                    request = factory.get(path, HTTP_AUTHORIZATION=header)
+                    with CaptureQueriesContext(connection) as queries:
+                        started = time.perf_counter()
+                        response = view(request)
+                        response.render()
+                        elapsed = (time.perf_counter() - started) * 1000
+                    if response.status_code != 200:
+                        raise CommandError(f"{name} returned {response.status_code}.")
+                    if i:
+                        counts.append(len(queries))
+                        timings.append(elapsed)
+                self.stdout.write(
+                    f"{name:<30} {label:<7} "
+                    f"queries={statistics.mean(counts):5.2f} "
+                    f"p50={statistics.median(timings):7.2f}ms "
+                    f"mean={statistics.mean(timings):7.2f}ms"
+                )
+
+
+def view_for(path, authentication):
+    # The view behind ``path`` with only ``authentication``, and no throttle
+    # to run into.
+    func = resolve(path).func
+    initkwargs = {
+        **func.initkwargs,
+        "authentication_classes": [authentication],
+        "throttle_classes": [],
+    }
+    if getattr(func, "actions", None):
+        return func.cls.as_view(func.actions, **initkwargs)
+    return func.cls.as_view(**initkwargs)
@@ -0,0 +1,108 @@
+import multiprocessing
+import statistics
+import time
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+from apps.branches.models import Branch
+from apps.users.models import User
+
+PREFIX = "storm-"
+WRITES = ("INSERT", "UPDATE", "DELETE")
+
+
+def run_worker(args):
+    usernames, password = args
+    path = reverse("login-list")
+    func = resolve(path).func
+    # No throttle to run into
+    view = func.cls.as_view(func.actions, **func.initkwargs, throttle_classes=[])
+    factory = APIRequestFactory()
+    results = []
+    try:
+        for username in usernames:
+            request = factory.post(path, {"username": username, "password": password})
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = view(request)
+                elapsed = (time.perf_counter() - started) * 1000
+            writes = sum(
+                query["sql"].lstrip().upper().startswith(WRITES) for query in queries
+            )
+            results.append((response.status_code, elapsed, len(queries), writes))
+    finally:
+        connections.close_all()
+    return results
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a shift-change login storm: create --users branch managers, "
+        "each with a branch, and log them all in --rounds times from --workers "
+        "processes at once. Print the logins per second, latency percentiles "
+        "and the queries and writes per login, then delete the managers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--rounds", type=int, default=1)
+        parser.add_argument("--workers", type=int, default=8)
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username__startswith=PREFIX).exists():
+            raise CommandError(
+                f"Users named {PREFIX}* exist already; delete them first."
+            )
+        password = "storm-password"
+        # Hashed once for all of them; every login still checks it in full.
+        hashed = make_password(password)
+        managers = User.objects.bulk_create(
+            User(username=f"{PREFIX}{i}", password=hashed, role="branch_manager")
+            for i in range(options["users"])
+        )
+        Branch.objects.bulk_create(
+            Branch(
+                name=f"Storm {manager.pk}",
+                location="-",
+                contact_details="-",
+                branch_code=f"{PREFIX}{manager.pk}",
+                manager=manager,
+            )
+            for manager in managers
+        )
+
+        try:
+            usernames = [manager.username for manager in managers] * options["rounds"]
+            workers = options["workers"]
+            jobs = [(usernames[i::workers], password) for i in range(workers)]
+
+            # Each forked worker must open its own database connection.
+            connections.close_all()
+            started = time.perf_counter()
+            with multiprocessing.get_context("fork").Pool(workers) as pool:
+                results = [row for rows in pool.map(run_worker, jobs) for row in rows]
+            elapsed = time.perf_counter() - started
+
+            failed = sum(status != 200 for status, *_ in results)
+            timings = sorted(row[1] for row in results)
+            percentiles = statistics.quantiles(timings, n=100)
+            self.stdout.write(
+                f"{len(results)} logins from {workers} workers in {elapsed:.2f}s "
+                f"({len(results) / elapsed:.1f}/s), {failed} failed."
+            )
+            self.stdout.write(
+                f"p50={percentiles[49]:.1f}ms p95={percentiles[94]:.1f}ms "
+                f"p99={percentiles[98]:.1f}ms "
+                f"queries={statistics.mean(row[2] for row in results):.2f} "
+                f"writes={statistics.mean(row[3] for row in results):.2f} per login"
+            )
+            if failed:
+                raise CommandError("Some logins failed.")
+        finally:
+            OutstandingToken.objects.filter(user__in=managers).delete()
+            Branch.objects.filter(manager__in=managers).delete()
+            User.objects.filter(pk__in=[manager.pk for manager in managers]).delete()
@@ -0,0 +1,54 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import (
+    BlacklistedToken,
+    OutstandingToken,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete the outstanding and blacklisted rows of expired refresh "
+        "tokens in chunks of --chunk-size, one short transaction each, instead "
+        "of simplejwt's flushexpiredtokens single delete. Tokens are walked "
+        "in id order, which is issue and so expiry order, and the walk stops "
+        "at the first chunk with nothing expired unless --all is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=5000)
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=0.0,
+            help="Seconds to pause between chunks.",
+        )
+        parser.add_argument("--all", action="store_true", help="Walk the whole table.")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now()
+        last_id = 0
+        deleted = 0
+        while True:
+            window = list(
+                OutstandingToken.objects.filter(pk__gt=last_id)
+                .order_by("pk")
+                .values_list("pk", "expires_at")[: options["chunk_size"]]
+            )
+            if not window:
+                break
+            last_id = window[-1][0]
+            expired = [pk for pk, expires_at in window if expires_at <= cutoff]
+            if not expired:
+                if options["all"]:
+                    continue
+                break
+            with transaction.atomic():
+                BlacklistedToken.objects.filter(token_id__in=expired).delete()
+                deleted += OutstandingToken.objects.filter(pk__in=expired).delete()[0]
+            if options["sleep"]:
+                time.sleep(options["sleep"])
+
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired tokens."))
@@ -10,6 +10,13 @@ class User(AbstractUser):
     phone_number = models.CharField(max_length=15, blank=True)
     role = models.CharField(max_length=20, choices=ROLES)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The role as stored, to tell when a save changes it.
+        instance._saved_role = instance.__dict__.get('role')
+        return instance
+
     def save(self, *args, **kwargs):
         if self.role == 'admin':
             self.is_staff = True
@@ -18,8 +25,18 @@ class User(AbstractUser):
             self.is_staff = False
             self.is_superuser = False
 
+        update_fields = kwargs.get('update_fields')
+        # Saves that keep the role, such as recording last_login, leave the
+        # groups alone.
+        role_changed = self.role != getattr(self, '_saved_role', None) and (
+            update_fields is None or 'role' in update_fields
+        )
+
         super().save(*args, **kwargs)
 
+        if not role_changed:
+            return
+        self._saved_role = self.role
         if self.role == 'admin':
             admin_group, _ = Group.objects.get_or_create(name='Admin')
             self.groups.add(admin_group)
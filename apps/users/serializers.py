@@ -1,9 +1,14 @@
 from rest_framework import serializers
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.serializers import (
+    TokenObtainSerializer,
+    TokenRefreshSerializer,
+)
 from rest_framework_simplejwt.settings import api_settings
 from django.contrib.auth.models import update_last_login
 from django.contrib.auth import get_user_model
 from apps.branches.serializers import BranchSerializer
+from .authentication import add_claims, check_user, load
+from .blacklist import RefreshToken
 
 
 User = get_user_model()
@@ -23,7 +28,16 @@ class UserSerializer(serializers.ModelSerializer):
         return user
 
 
-class LoginSerializer(TokenObtainPairSerializer):
+class LoginSerializer(TokenObtainSerializer):
+    # The user comes with their branch from UserBackend, so logging in reads
+    # once and writes the token's outstanding row, and last_login if enabled.
+    token_class = RefreshToken
+
+    @classmethod
+    def get_token(cls, user):
+        # Role and branch ride along in the refresh token and every access
+        # token issued from it; see authentication.py.
+        return add_claims(super().get_token(user), user)
 
     def validate(self, attrs):
         data = super().validate(attrs)
@@ -39,3 +53,24 @@ class LoginSerializer(TokenObtainPairSerializer):
             update_last_login(None, self.user)
 
         return data
+
+
+class RefreshSerializer(TokenRefreshSerializer):
+    # Rotation checks and blacklists through the cached blacklist.
+    token_class = RefreshToken
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs["refresh"])
+        # From the database rather than the user cache, which other
+        # processes may be holding stale; see authentication.py.
+        check_user(load(refresh.get(api_settings.USER_ID_CLAIM)), refresh)
+
+        data = {"access": str(refresh.access_token)}
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                refresh.blacklist()
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            data["refresh"] = str(refresh)
+        return data
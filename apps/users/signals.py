@@ -0,0 +1,14 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from apps.branches.models import Branch
+from .authentication import users
+from .models import User
+
+
+@receiver([post_save, post_delete], sender=User)
+@receiver([post_save, post_delete], sender=Branch)
+def expire_user_cache(sender, instance, update_fields=None, **kwargs):
+    # Logging in only records last_login, which authentication does not use.
+    if update_fields is not None and set(update_fields) == {"last_login"}:
+        return
+    users.invalidate()
@@ -1,3 +1,191 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from django.contrib.auth.models import update_last_login
+from django.core.management import call_command
 from django.test import TestCase
+from django.utils import timezone
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.token_blacklist.models import (
+    BlacklistedToken,
+    OutstandingToken,
+)
+from apps.core.tests.factories import create_branch, create_manager
+from . import blacklist as blacklist_module
+from .authentication import users
+from .blacklist import Blacklist, RefreshToken, blacklist
+from .models import User
 
-# Create your tests here.
+
+class TokenAuthenticationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = create_manager()
+        cls.branch = create_branch(manager=cls.manager)
+
+    def setUp(self):
+        users.clear()
+        self.client = APIClient()
+        response = self.client.post(
+            reverse("login-list"), {"username": "manager", "password": "password"}
+        )
+        self.token = response.data["access"]
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.token}")
+
+    def test_user_is_cached_between_requests(self):
+        # The user and the branch in one query, then neither; the branch
+        # products are only counted, there are none.
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("branch_products-list"))
+        self.assertEqual(response.status_code, 200)
+        # Not reloaded by a version check falling between the requests
+        with mock.patch.object(users, "check_interval", float("inf")):
+            with self.assertNumQueries(1):
+                self.client.get(reverse("branch_products-list"))
+
+    def test_cached_users_do_not_share_their_branch(self):
+        users.get(self.manager.pk).managed_branch.name = "Changed"
+        self.assertEqual(users.get(self.manager.pk).managed_branch.name, "Main")
+
+    def test_token_with_changed_branch_is_rejected(self):
+        self.client.get(reverse("branch_products-list"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.branch.manager = None
+            self.branch.save()
+        response = self.client.get(reverse("branch_products-list"))
+        self.assertEqual(response.status_code, 401)
+
+
+class LoginTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = create_manager()
+        create_branch(manager=cls.manager)
+
+    def test_login_reads_user_and_branch_once(self):
+        with self.assertNumQueries(2):
+            response = self.client.post(
+                reverse("login-list"), {"username": "manager", "password": "password"}
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["user"]["managed_branch"]["name"], "Main")
+        jti = RefreshToken(response.data["refresh"])["jti"]
+        self.assertTrue(
+            OutstandingToken.objects.filter(jti=jti, user=self.manager).exists()
+        )
+
+    def test_last_login_is_one_update(self):
+        user = User.objects.get()
+        with self.assertNumQueries(1):
+            update_last_login(None, user)
+
+    def test_groups_follow_role_changes(self):
+        user = User.objects.get()
+        user.role = "admin"
+        user.save()
+        self.assertIn("Admin", user.groups.values_list("name", flat=True))
+        with self.assertNumQueries(1):
+            user.save()
+
+
+class RefreshTokenBlacklistTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_manager()
+
+    def setUp(self):
+        blacklist.clear()
+        self.client = APIClient()
+        response = self.client.post(
+            reverse("login-list"), {"username": "manager", "password": "password"}
+        )
+        self.refresh = response.data["refresh"]
+
+    def test_rotated_token_is_rejected(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("refresh-list"), {"refresh": self.refresh}
+            )
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post(reverse("refresh-list"), {"refresh": self.refresh})
+        self.assertEqual(response.status_code, 401)
+
+    def test_refresh_checks_the_user_in_the_database(self):
+        # Not a write other processes' user caches would hear about
+        User.objects.update(is_active=False)
+        response = self.client.post(reverse("refresh-list"), {"refresh": self.refresh})
+        self.assertEqual(response.status_code, 401)
+
+    def shared_cache(self):
+        return mock.patch.object(blacklist_module, "is_shared", return_value=True)
+
+    def test_unrevoked_token_is_checked_without_queries(self):
+        with self.shared_cache():
+            blacklist.sync()
+            with self.assertNumQueries(0):
+                RefreshToken(self.refresh).check_blacklist()
+
+    def test_blacklisting_writes_the_rows_at_once(self):
+        with self.shared_cache():
+            other = Blacklist(1000, 0.001, 60.0)
+            other.sync()
+            token = RefreshToken(self.refresh)
+            with self.captureOnCommitCallbacks(execute=True):
+                token.blacklist()
+                self.assertTrue(
+                    BlacklistedToken.objects.filter(token__jti=token["jti"]).exists()
+                )
+            # Another process finds it in the cache until its filter catches up.
+            with self.assertNumQueries(0):
+                self.assertTrue(other.contains(token["jti"]))
+
+    def test_per_process_cache_checks_the_tables(self):
+        token = RefreshToken(self.refresh)
+        with self.assertNumQueries(1):
+            token.check_blacklist()
+        # Blacklisted by another process, whose cache this one cannot see
+        BlacklistedToken.objects.create(
+            token=OutstandingToken.objects.get(jti=token["jti"])
+        )
+        with self.assertRaises(TokenError):
+            token.check_blacklist()
+
+    def test_revoked_token_is_rejected_through_the_cache(self):
+        with self.shared_cache():
+            other = Blacklist(1000, 0.001, 60.0)
+            other.sync()
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(
+                    reverse("logout"), {"refresh_token": self.refresh}
+                )
+            self.assertEqual(response.status_code, 200)
+            jti = RefreshToken(self.refresh, verify=False)["jti"]
+            # This process's filter, another's cache marker, and a filter
+            # loaded after the marker has expired all reject it.
+            response = self.client.post(
+                reverse("refresh-list"), {"refresh": self.refresh}
+            )
+            self.assertEqual(response.status_code, 401)
+            self.assertTrue(other.contains(jti))
+            blacklist_module.get_cache().delete(blacklist_module.CACHE_PREFIX + jti)
+            self.assertTrue(Blacklist(1000, 0.001, 60.0).contains(jti))
+
+    def test_logout_revokes_token(self):
+        response = self.client.post(reverse("logout"), {"refresh_token": self.refresh})
+        self.assertEqual(response.status_code, 200)
+        with self.assertRaises(TokenError):
+            RefreshToken(self.refresh)
+
+    def test_prune_deletes_expired_tokens(self):
+        for token in OutstandingToken.objects.all():
+            BlacklistedToken.objects.create(token=token)
+        OutstandingToken.objects.update(expires_at=timezone.now() - timedelta(days=1))
+        live = RefreshToken.for_user(User.objects.get())
+        call_command("prune_tokens", chunk_size=1, stdout=StringIO())
+        self.assertEqual(
+            list(OutstandingToken.objects.values_list("jti", flat=True)),
+            [live["jti"]],
+        )
+        self.assertFalse(BlacklistedToken.objects.exists())
@@ -2,10 +2,10 @@ from rest_framework import viewsets, permissions, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
-from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.exceptions import TokenError, InvalidToken
 from django.contrib.auth import get_user_model
-from .serializers import UserSerializer, LoginSerializer
+from .blacklist import RefreshToken
+from .serializers import UserSerializer, LoginSerializer, RefreshSerializer
 
 
 User = get_user_model()
@@ -73,6 +73,7 @@ class LogoutView(viewsets.ViewSet):
 
 
 class RefreshViewSet(viewsets.ViewSet, TokenRefreshView):
+    serializer_class = RefreshSerializer
     permission_classes = (permissions.AllowAny,)
     http_method_names = ["post"]
 
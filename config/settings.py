@@ -33,6 +33,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'corsheaders',
     'rest_framework_simplejwt.token_blacklist',
@@ -52,13 +53,15 @@ CORS_ALLOW_CREDENTIALS = True
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'apps.users.authentication.CachedJWTAuthentication',
     ],
     'DEFAULT_THROTTLE_CLASSES': [
         'rest_framework.throttling.UserRateThrottle',
     ],
     'DEFAULT_THROTTLE_RATES': {
         'user': '1000/day',
+        # POS scanner lookups, per user
+        'scan': '120/minute',
     },
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
@@ -66,6 +69,7 @@ REST_FRAMEWORK = {
 }
 
 MIDDLEWARE = [
+    'apps.core.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -125,6 +129,43 @@ DATABASES = {
 DATABASES["default"] = dj_database_url.parse(env.str("DATABASE_URL"))
 
 
+# Cache
+# LocMemCache is per process; set REDIS_URL when running several workers so
+# that dashboard invalidations reach every one of them.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+if env.str('REDIS_URL', default=''):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': env.str('REDIS_URL'),
+    }
+
+DASHBOARD_CACHE_ALIAS = env.str('DASHBOARD_CACHE_ALIAS', default='default')
+DASHBOARD_CACHE_TIMEOUT = env.int('DASHBOARD_CACHE_TIMEOUT', default=300)
+# Used instead when the dashboard cache is per process, see
+# apps/reports/dashboard_cache.py
+DASHBOARD_LOCAL_CACHE_TIMEOUT = env.int('DASHBOARD_LOCAL_CACHE_TIMEOUT', default=5)
+
+# Threads, each with its own database connection, that query the sections
+# of the async dashboards concurrently; see apps/reports/parallel.py.
+DASHBOARD_QUERY_WORKERS = env.int('DASHBOARD_QUERY_WORKERS', default=4)
+
+# Reorder engine, see apps/reports/reorder.py. Velocity is averaged over the
+# last REORDER_VELOCITY_DAYS; the other values are in days of that velocity.
+REORDER_VELOCITY_DAYS = env.int('REORDER_VELOCITY_DAYS', default=28)
+REORDER_LEAD_TIME_DAYS = env.int('REORDER_LEAD_TIME_DAYS', default=7)
+REORDER_SAFETY_DAYS = env.int('REORDER_SAFETY_DAYS', default=3)
+REORDER_COVER_DAYS = env.int('REORDER_COVER_DAYS', default=14)
+# Past this many seconds since the last refresh the dashboards stop trusting
+# the suggestions and count low stock from the quantities on hand.
+REORDER_SUGGESTIONS_MAX_AGE = env.int('REORDER_SUGGESTIONS_MAX_AGE', default=86400)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -165,6 +206,47 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Rendered barcode labels, see apps/products/barcode_cache.py
+BARCODE_CACHE_DIR = env.path('BARCODE_CACHE_DIR', default=BASE_DIR / 'cache' / 'barcodes')
+BARCODE_CACHE_MAX_BYTES = env.int('BARCODE_CACHE_MAX_BYTES', default=32 * 1024 * 1024)
+
+# Per-process SKU lookups for scanners, see apps/products/scan_cache.py
+PRODUCT_SCAN_CACHE_ALIAS = env.str('PRODUCT_SCAN_CACHE_ALIAS', default='default')
+PRODUCT_SCAN_CACHE_SIZE = env.int('PRODUCT_SCAN_CACHE_SIZE', default=50000)
+PRODUCT_SCAN_CACHE_CHECK_INTERVAL = env.float('PRODUCT_SCAN_CACHE_CHECK_INTERVAL', default=1.0)
+PRODUCT_SCAN_CACHE_LOCAL_TTL = env.float('PRODUCT_SCAN_CACHE_LOCAL_TTL', default=10.0)
+
+# Per-process cache of authenticated users, see apps/users/authentication.py
+USER_AUTH_CACHE_ALIAS = env.str('USER_AUTH_CACHE_ALIAS', default='default')
+USER_AUTH_CACHE_SIZE = env.int('USER_AUTH_CACHE_SIZE', default=10000)
+USER_AUTH_CACHE_TTL = env.float('USER_AUTH_CACHE_TTL', default=60.0)
+USER_AUTH_CACHE_CHECK_INTERVAL = env.float('USER_AUTH_CACHE_CHECK_INTERVAL', default=1.0)
+
+# Cached refresh token blacklist checks, see apps/users/blacklist.py
+TOKEN_BLACKLIST_CACHE_ALIAS = env.str('TOKEN_BLACKLIST_CACHE_ALIAS', default='default')
+TOKEN_BLACKLIST_FILTER_CAPACITY = env.int('TOKEN_BLACKLIST_FILTER_CAPACITY', default=1000000)
+TOKEN_BLACKLIST_FILTER_ERROR_RATE = env.float('TOKEN_BLACKLIST_FILTER_ERROR_RATE', default=0.001)
+TOKEN_BLACKLIST_CHECK_INTERVAL = env.float('TOKEN_BLACKLIST_CHECK_INTERVAL', default=5.0)
+
+# Per-route request metrics served on /metrics, see apps/core/metrics.py.
+# Scrapes must send METRICS_TOKEN as a bearer token; /metrics is refused
+# while it is unset.
+METRICS_ENABLED = env.bool('METRICS_ENABLED', default=True)
+METRICS_TOKEN = env.str('METRICS_TOKEN', default='')
+METRICS_CACHE_ALIAS = env.str('METRICS_CACHE_ALIAS', default='default')
+METRICS_PUBLISH_INTERVAL = env.float('METRICS_PUBLISH_INTERVAL', default=15.0)
+METRICS_SLOW_REQUEST_MS = env.float('METRICS_SLOW_REQUEST_MS', default=1000.0)
+METRICS_SLOW_QUERIES = env.int('METRICS_SLOW_QUERIES', default=5)
+
+# Live event streams, see apps/reports/events.py. Set the backend to
+# 'postgres' when running several workers so events reach every one of them.
+STOCK_EVENTS_BACKEND = env.str('STOCK_EVENTS_BACKEND', default='local')
+STOCK_EVENTS_CHANNEL = env.str('STOCK_EVENTS_CHANNEL', default='stock_events')
+STOCK_EVENTS_HEARTBEAT = env.float('STOCK_EVENTS_HEARTBEAT', default=15.0)
+STOCK_EVENTS_MAX_PENDING = env.int('STOCK_EVENTS_MAX_PENDING', default=1000)
+STOCK_EVENTS_RETRY_MS = env.int('STOCK_EVENTS_RETRY_MS', default=3000)
+STOCK_EVENTS_TICKET_MAX_AGE = env.int('STOCK_EVENTS_TICKET_MAX_AGE', default=30)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -172,6 +254,9 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'users.User'
 
+# Loads the managed branch with the user, see apps/users/backends.py
+AUTHENTICATION_BACKENDS = ['apps.users.backends.UserBackend']
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(hours=24),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=3),
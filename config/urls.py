@@ -2,7 +2,7 @@ from rest_framework.routers import DefaultRouter
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from apps.users.views import (
     UserRegisterViewSet,
     LogoutView,
@@ -10,12 +10,18 @@ from apps.users.views import (
     RefreshViewSet,
     UserViewSet,
 )
-from apps.products.views import ProductViewSet, DamagedProductViewSet
+from apps.products.views import (
+    ProductViewSet,
+    DamagedProductViewSet,
+    BarcodeView,
+    BarcodeSheetView,
+)
 from apps.branches.views import (
     BranchViewSet,
     ProductRequestViewSet,
     BranchProductViewSet,
 )
+from apps.core.views import MetricsView
 from apps.suppliers.views import SupplierViewSet
 from apps.reports.views import (
     ProductInflowViewSet,
@@ -34,6 +40,14 @@ from apps.reports.views import (
     BranchProductDetailsReportView,
     DashboardView,
     BranchDashboardView,
+    AsyncDashboardView,
+    AsyncBranchDashboardView,
+    BranchInventoryLevelsView,
+    DashboardCacheStatsView,
+    EventStreamView,
+    EventStreamTicketView,
+    ReorderSuggestionViewSet,
+    ReorderSettingViewSet,
 )
 
 
@@ -57,12 +71,32 @@ router.register(r"branches", BranchViewSet, basename="branches")
 router.register(r"branch-products", BranchProductViewSet, basename="branch_products")
 router.register(r"product-requests", ProductRequestViewSet, basename="product_requests")
 
+# Replenishment
+router.register(
+    r"reorder-suggestions", ReorderSuggestionViewSet, basename="reorder_suggestions"
+)
+router.register(r"reorder-settings", ReorderSettingViewSet, basename="reorder_settings")
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/", include(router.urls)),
     path("api/logout/", LogoutView.as_view({"post": "logout"}), name="logout"),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 
+# Barcode labels
+urlpatterns += [
+    re_path(
+        r"^api/barcode-sheet\.(?P<fmt>svg|png)$",
+        BarcodeSheetView.as_view(),
+        name="barcode-sheet",
+    ),
+    re_path(
+        r"^api/barcodes/(?P<sku>[^/]+)\.(?P<fmt>svg|png)$",
+        BarcodeView.as_view(),
+        name="barcode",
+    ),
+]
+
 # Store Reports
 urlpatterns += [
     path(
@@ -130,5 +164,36 @@ urlpatterns += [
 # Dashboard URL
 urlpatterns += [
     path("api/dashboard/", DashboardView.as_view(), name="dashboard"),
+    path(
+        "api/dashboard/async/", AsyncDashboardView.as_view(), name="dashboard-async"
+    ),
+    path(
+        "api/dashboard/cache-stats/",
+        DashboardCacheStatsView.as_view(),
+        name="dashboard-cache-stats",
+    ),
     path('api/branch-dashboard/', BranchDashboardView.as_view(), name='branch-dashboard'),
+    path(
+        "api/branch-dashboard/async/",
+        AsyncBranchDashboardView.as_view(),
+        name="branch-dashboard-async",
+    ),
+    path(
+        "api/branch-dashboard/inventory-levels/",
+        BranchInventoryLevelsView.as_view(),
+        name="branch-inventory-levels",
+    ),
+]
+
+# Live events
+urlpatterns += [
+    path("api/events/", EventStreamView.as_view(), name="events"),
+    path(
+        "api/events/ticket/", EventStreamTicketView.as_view(), name="events-ticket"
+    ),
+]
+
+# Request metrics for Prometheus
+urlpatterns += [
+    path("metrics", MetricsView.as_view(), name="metrics"),
 ]